@@ -1,11 +1,20 @@
 # admin_products.py
-from flask import Blueprint, render_template_string, request, redirect, url_for, flash, session, render_template
+from flask import Blueprint, request, redirect, url_for, flash, session, render_template
 import json
 import os
 from functools import wraps
 from datetime import datetime
 from flask_wtf import CSRFProtect
 
+import storage
+from data_manager import get_product, put_product, allocate_product_id, ORDERS_FILE, ProductConflictError
+from data_manager import save_products as save_products_record
+from pagination import paginate_records
+from template_registry import register_template
+from data_manager import delete_product as delete_product_record
+from data_manager import get_order, remove_user_purchase
+from data_manager import delete_order as delete_order_record
+
 # Importar load_orders desde app.py (asumiendo que app.py la define y la carga)
 try:
     from app import load_orders, load_products # Necesitamos load_products para el detalle del producto en la lista de órdenes
@@ -52,35 +61,21 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def load_products_local(): # Renombrada para evitar conflicto si se importa de app
-    """Carga los productos desde el archivo JSON."""
-    if not os.path.exists(PRODUCTS_FILE):
-        return {}
-    try:
-        with open(PRODUCTS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
-        print(f"Error al cargar los productos: {e}")
-        return {}
-
 def save_products(products):
-    """Guarda los productos en el archivo JSON."""
-    try:
-        with open(PRODUCTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(products, f, indent=2, ensure_ascii=False)
-        return True
-    except Exception as e:
-        print(f"Error al guardar productos: {e}")
-        return False
+    """Guarda el catálogo completo con data_manager.save_products (versión del catálogo y estadísticas incluidas)."""
+    return save_products_record(products)
 
-# Plantillas HTML (se han movido a archivos separados en una estructura real)
-PRODUCT_FORM_TEMPLATE = """
+# Plantillas HTML registradas en template_registry (se compilan una vez y se renderizan por nombre)
+PRODUCT_FORM_TEMPLATE = register_template('inline/admin_product_form.html', """
 {% extends "base.html" %}
 {% block title %}{{ title }}{% endblock %}
 {% block content %}
 <div class="max-w-md mx-auto bg-white p-8 rounded-lg shadow-lg mt-8">
     <h1 class="text-2xl font-bold mb-6 text-center text-gray-800">{{ title }}</h1>
     <form method="POST">
+        {% if product.id is defined %}
+        <input type="hidden" name="version" value="{{ product.version | default(0) }}">
+        {% endif %}
         <div class="mb-4">
             <label for="name" class="block text-gray-700 text-sm font-bold mb-2">Nombre del Producto:</label>
             <input type="text" id="name" name="name" value="{{ product.name | default('') }}" required
@@ -122,21 +117,11 @@ PRODUCT_FORM_TEMPLATE = """
     </form>
 </div>
 {% endblock %}
-"""
+""")
 
-# Rutas de administración de productos
-@admin_products_bp.route('/admin/products')
-@admin_required
-def manage_products():
-    """
-    Muestra una lista de todos los productos y permite acciones de gestión.
-    """
-    products = load_products_local()
-    # Convertir lista a dict si es necesario (migración)
-    if isinstance(products, list):
-        products = {str(p['id']): p for p in products}
-    return render_template_string("""
+PRODUCTS_LIST_TEMPLATE = register_template('inline/admin_products_list.html', """
 {% extends "base.html" %}
+{% from "_pagination.html" import render_pagination %}
 {% block title %}Gestión de Productos{% endblock %}
 {% block content %}
 <div class="max-w-4xl mx-auto px-4 py-8">
@@ -172,7 +157,7 @@ def manage_products():
                 </tr>
             </thead>
             <tbody>
-                {% for product in products.values() %}
+                {% for product in products %}
                 <tr class="hover:bg-gray-50 border-b border-gray-200">
                     <td class="px-5 py-5 text-sm text-gray-900">{{ product.id }}</td>
                     <td class="px-5 py-5 text-sm text-gray-900">
@@ -196,6 +181,7 @@ def manage_products():
             </tbody>
         </table>
     </div>
+    {{ render_pagination(pagination) }}
     {% else %}
     <div class="text-center py-12 bg-gray-50 rounded-lg border border-gray-200">
         <i class="fas fa-box-open text-gray-400 text-6xl mb-4"></i>
@@ -214,7 +200,17 @@ def manage_products():
     </div>
 </div>
 {% endblock %}
-    """, products=products)
+""")
+
+# Rutas de administración de productos
+@admin_products_bp.route('/admin/products')
+@admin_required
+def manage_products():
+    """
+    Muestra una lista paginada de los productos y permite acciones de gestión.
+    """
+    pagination = paginate_records(PRODUCTS_FILE, default_per_page=50)
+    return render_template(PRODUCTS_LIST_TEMPLATE, products=pagination.items, pagination=pagination)
 
 
 @admin_products_bp.route('/admin/products/add', methods=['GET', 'POST'])
@@ -224,15 +220,6 @@ def add_product():
     Maneja la adición de nuevos productos.
     """
     if request.method == 'POST':
-        products = load_products_local()
-        # Convertir lista a dict si es necesario (migración)
-        if isinstance(products, list):
-            products_dict = {str(p['id']): p for p in products}
-        else:
-            products_dict = products
-        new_id = 1
-        if products_dict:
-            new_id = max([int(pid) for pid in products_dict.keys()]) + 1
         try:
             name = request.form['name']
             description = request.form['description']
@@ -244,7 +231,7 @@ def add_product():
                 flash('Todos los campos son requeridos y los valores deben ser válidos.', 'error')
             else:
                 new_product = {
-                    'id': new_id,
+                    'id': allocate_product_id(),
                     'name': name,
                     'description': description,
                     'price': price,
@@ -252,15 +239,17 @@ def add_product():
                     'image_url': image_url,
                     'category': category
                 }
-                products_dict[str(new_id)] = new_product
-                if save_products(products_dict):
+                # create=True: nunca reemplaza un producto existente (p. ej. uno añadido a mano con ese ID)
+                if put_product(new_product, create=True):
                     flash('¡Producto añadido exitosamente!', 'success')
                     return redirect(url_for('admin_products.manage_products'))
                 else:
                     flash('Error al guardar el producto.', 'error')
         except ValueError:
             flash('Por favor, introduce valores numéricos válidos para precio y stock.', 'error')
-    return render_template_string(PRODUCT_FORM_TEMPLATE, title="Añadir Nuevo Producto", product={})
+        except ProductConflictError:
+            flash('Ya existe un producto con ese ID. Por favor, inténtalo de nuevo.', 'error')
+    return render_template(PRODUCT_FORM_TEMPLATE, title="Añadir Nuevo Producto", product={})
 
 @admin_products_bp.route('/admin/products/edit/<int:product_id>', methods=['GET', 'POST'])
 @admin_required
@@ -268,12 +257,7 @@ def edit_product(product_id):
     """
     Maneja la edición de un producto existente.
     """
-    products = load_products_local()
-    # Convertir lista a dict si es necesario
-    if isinstance(products, list):
-        products = {str(p['id']): p for p in products}
-    pid = str(product_id)
-    product = products.get(pid)
+    product = get_product(product_id)
     if not product:
         flash('Producto no encontrado.', 'error')
         return redirect(url_for('admin_products.manage_products'))
@@ -285,17 +269,24 @@ def edit_product(product_id):
             product['stock'] = int(request.form['stock'])
             product['image_url'] = request.form.get('image_url', '')
             product['category'] = request.form.get('category', 'Sin categoría')
+            # Versión con la que se abrió el formulario: si el producto cambió entre medias
+            # (p. ej. se vendieron unidades) no se pisa el cambio
+            expected_version = int(request.form.get('version', product.get('version', 0)))
             if not product['name'] or not product['description'] or product['price'] <= 0 or product['stock'] < 0:
                 flash('Todos los campos son requeridos y los valores deben ser válidos.', 'error')
             else:
-                if save_products(products):
+                if put_product(product, expected_version=expected_version):
                     flash('¡Producto actualizado exitosamente!', 'success')
                     return redirect(url_for('admin_products.manage_products'))
                 else:
                     flash('Error al actualizar el producto.', 'error')
         except ValueError:
             flash('Por favor, introduce valores numéricos válidos para precio y stock.', 'error')
-    return render_template_string(PRODUCT_FORM_TEMPLATE, title="Editar Producto", product=product)
+        except ProductConflictError:
+            flash('El producto cambió mientras lo editabas (por ejemplo, se vendieron unidades). '
+                  'Revisa los datos actuales y guarda de nuevo.', 'error')
+            product = get_product(product_id) or product
+    return render_template(PRODUCT_FORM_TEMPLATE, title="Editar Producto", product=product)
 
 @admin_products_bp.route('/admin/products/delete/<int:product_id>', methods=['POST'])
 @admin_required
@@ -303,73 +294,59 @@ def delete_product(product_id):
     """
     Maneja la eliminación de un producto.
     """
-    products = load_products_local()
-    # Convertir lista a dict si es necesario
-    if isinstance(products, list):
-        products = {str(p['id']): p for p in products}
-    pid = str(product_id)
-    if pid in products:
-        del products[pid]
-        if save_products(products):
-            flash('¡Producto eliminado exitosamente!', 'success')
-        else:
-            flash('Error al eliminar el producto.', 'error')
-    else:
+    if get_product(product_id) is None:
         flash('Producto no encontrado.', 'error')
+    elif delete_product_record(product_id):
+        flash('¡Producto eliminado exitosamente!', 'success')
+    else:
+        flash('Error al eliminar el producto.', 'error')
     return redirect(url_for('admin_products.manage_products'))
 
 @admin_products_bp.route('/admin/orders') # NUEVA RUTA
 @admin_required
 def admin_orders():
     """
-    Muestra la página de gestión de pedidos del administrador.
+    Muestra la página de gestión de pedidos del administrador (paginada, los más recientes primero).
     """
-    all_orders = load_orders() # Carga todos los pedidos
-    all_products = load_products() # Carga todos los productos para buscar detalles
+    # Los pedidos se guardan en orden de creación: el orden inverso de inserción es el orden
+    # por fecha descendente, sin cargar ni ordenar todos los pedidos.
+    pagination = paginate_records(ORDERS_FILE, default_per_page=50, reverse=True)
 
-    # Enriquecer los elementos de cada pedido con detalles del producto (nombre, imagen)
+    # Enriquecer los elementos de cada pedido de la página con detalles del producto (nombre, imagen)
     # Esto es útil si los datos del pedido solo guardan el ID del producto
-    enriched_orders = []
-    for order in all_orders:
-        enriched_items = []
+    for order in pagination.items:
         for item in order.get('items', []):
-            product_detail = next((p for p in all_products if p['id'] == item['product_id']), None)
+            product_detail = get_product(item.get('product_id'))
             if product_detail:
                 item['name'] = product_detail.get('name', item.get('name', 'Producto Desconocido'))
                 item['image_url'] = product_detail.get('image_url', item.get('image_url', ''))
-            enriched_items.append(item)
-        order['items'] = enriched_items
-        enriched_orders.append(order)
 
-    # Opcional: Ordenar los pedidos, por ejemplo, por fecha descendente
-    sorted_orders = sorted(
-        enriched_orders,
-        key=lambda x: x.get('timestamp', ''),
-        reverse=True
-    )
-    
-    return render_template('admin_orders.html', orders=sorted_orders)
+    return render_template('admin_orders.html', orders=pagination.items, pagination=pagination)
 
-@admin_products_bp.route('/admin/orders/delete/<int:order_id>', methods=['POST'])
+@admin_products_bp.route('/admin/orders/delete/<string:order_id>', methods=['POST'])
 @admin_required
 def delete_order(order_id):
     """
-    Elimina un pedido por su ID (solo admins).
+    Elimina un pedido completado por su order_id (solo admins), junto con su compra del historial.
     """
-    orders = load_orders()
-    initial_count = len(orders)
-    orders = [o for o in orders if o.get('id') != order_id]
-    if len(orders) < initial_count:
-        # Guardar los pedidos actualizados
-        try:
-            with open('user_orders.json', 'w', encoding='utf-8') as f:
-                json.dump(orders, f, indent=2, ensure_ascii=False)
-            flash('¡Pedido eliminado exitosamente!', 'success')
-        except Exception as e:
-            flash(f'Error al eliminar el pedido: {e}', 'error')
-    else:
+    order = get_order(order_id)
+    if order is None:
         flash('No se encontró el pedido a eliminar.', 'error')
-    return redirect(url_for('admin_orders'))
+        return redirect(url_for('admin_products.admin_orders'))
+    if order.get('status') not in ('Completado', 'completed'):
+        flash('Solo se pueden eliminar pedidos completados.', 'warning')
+        return redirect(url_for('admin_products.admin_orders'))
+    # Pedido y compra en una sola transacción, como la cancelación del usuario (user_auth.delete_order)
+    try:
+        with storage.transaction():
+            if not delete_order_record(order_id):
+                raise RuntimeError(f'No se pudo eliminar el pedido {order_id}')
+            remove_user_purchase(order_id)
+        flash('¡Pedido eliminado exitosamente!', 'success')
+    except Exception as e:
+        print(f"Error al eliminar el pedido {order_id}: {e}")
+        flash('Error al eliminar el pedido.', 'error')
+    return redirect(url_for('admin_products.admin_orders'))
 
 def create_admin_products_routes(app):
     """
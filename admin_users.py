@@ -1,5 +1,5 @@
 # admin_users.py - Admin User Management Blueprint
-from flask import Blueprint, render_template_string, redirect, url_for, flash, session
+from flask import Blueprint, render_template, redirect, url_for, flash, session
 import json
 import os
 from functools import wraps
@@ -8,6 +8,9 @@ from admin_delete_forms import AdminDeleteUserForm
 # --- IMPORTACIONES DESDE data_manager.py ---
 # Ahora importamos directamente desde data_manager.py
 from data_manager import load_users, save_users, USERS_FILE # USERS_FILE también debe venir de data_manager
+from data_manager import delete_user as delete_user_record
+from pagination import paginate_records
+from template_registry import register_template
 
 admin_users_bp = Blueprint('admin_users', __name__)
 
@@ -24,8 +27,9 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Plantilla HTML para la gestión de usuarios (ahora enlaza CSS externo)
-ADMIN_USERS_TEMPLATE = """
+# Plantilla HTML para la gestión de usuarios (ahora enlaza CSS externo), registrada en template_registry
+ADMIN_USERS_TEMPLATE = register_template('inline/admin_users.html', """
+{% from "_pagination.html" import render_pagination %}
 <!DOCTYPE html>
 <html lang="es">
 <head>
@@ -91,7 +95,7 @@ ADMIN_USERS_TEMPLATE = """
                             </td>
                             <td class="px-6 py-4 whitespace-nowrap text-sm font-medium">
                                 <form action="{{ url_for('admin_users.delete_user', username=user.username) }}" method="POST" onsubmit="return confirm('¿Estás seguro de que quieres eliminar al usuario {{ user.username }}?');">
-                                    {{ delete_forms[user.username].hidden_tag() }}
+                                    {{ delete_form.hidden_tag() }}
                                     <button type="submit" class="text-red-600 hover:text-red-900">Eliminar</button>
                                 </form>
                             </td>
@@ -100,6 +104,7 @@ ADMIN_USERS_TEMPLATE = """
                     </tbody>
                 </table>
             </div>
+            {{ render_pagination(pagination) }}
             {% else %}
             <p class="text-gray-600 text-center py-4">No hay usuarios registrados.</p>
             {% endif %}
@@ -113,33 +118,29 @@ ADMIN_USERS_TEMPLATE = """
     </div>
 </body>
 </html>
-"""
+""")
 
 @admin_users_bp.route('/admin/users')
 @admin_required
 def manage_users():
     """
-    Muestra una lista de todos los usuarios registrados en el sistema.
+    Muestra una lista paginada de los usuarios registrados en el sistema (orden de registro).
     """
-    users = load_users() # Ahora se llama a la función de data_manager.py
-    # Convierte el diccionario de usuarios a una lista para facilitar la iteración en la plantilla
-    users_list = list(users.values())
-    # Crear un formulario de borrado por usuario
-    delete_forms = {u['username']: AdminDeleteUserForm() for u in users_list}
-    return render_template_string(ADMIN_USERS_TEMPLATE, title="Gestión de Usuarios", users=users_list, delete_forms=delete_forms)
+    pagination = paginate_records(USERS_FILE, default_per_page=50)
+    # Un único formulario de borrado: el token CSRF es el mismo para todas las filas
+    delete_form = AdminDeleteUserForm()
+    return render_template(ADMIN_USERS_TEMPLATE, title="Gestión de Usuarios", users=pagination.items,
+                           pagination=pagination, delete_form=delete_form)
 
 @admin_users_bp.route('/admin/users/delete/<string:username>', methods=['POST'])
 @admin_required
 def delete_user(username):
     form = AdminDeleteUserForm()
     if form.validate_on_submit():
-        users = load_users()
         if username == 'admin':
             flash('No puedes eliminar el usuario administrador.', 'error')
             return redirect(url_for('admin_users.manage_users'))
-        if username in users:
-            del users[username]
-            save_users(users)
+        if delete_user_record(username):
             flash(f'¡Usuario "{username}" eliminado exitosamente!', 'success')
         else:
             flash(f'No se pudo eliminar el usuario "{username}" porque no fue encontrado.', 'error')
@@ -1,7 +1,9 @@
 # app.py - Main Flask Application with Enhanced Features
-from flask import Flask, render_template, request, session, redirect, url_for, flash, jsonify, make_response
+from flask import (Flask, render_template, request, session, redirect, url_for, flash, jsonify, make_response,
+                   get_template_attribute)
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from flask_wtf.csrf import generate_csrf
 import json
 import os
 from datetime import datetime, timedelta
@@ -10,6 +12,8 @@ from functools import wraps
 import logging
 import re
 
+import click
+
 # --- Importar funciones de carga/guardado desde data_manager.py ---
 # ¡IMPORTANTE! Asegúrate de que tengas un archivo data_manager.py
 # en la misma carpeta, con todas las funciones de carga/guardado.
@@ -17,20 +21,38 @@ from data_manager import (
     load_products, save_products, load_orders, save_orders,
     load_reports, save_reports, load_users, save_users,
     load_notifications, save_notifications, load_user_carts, save_user_carts,
-    load_user_purchases, save_user_purchases,  # <-- Agregado aquí
+    load_user_purchases, save_user_purchases, add_user_purchase,  # <-- Agregado aquí
+    PRODUCTS_FILE, USER_PURCHASES_FILE,
     # ADMIN_FILE eliminado porque no existe en data_manager.py
     # Estas funciones se importan ahora DIRECTAMENTE desde data_manager.py
     add_notification, get_cart, add_to_cart, remove_from_cart, update_cart_quantity,
-    clear_user_persistent_cart
+    clear_user_persistent_cart,
+    # Accesores por registro: leen/escriben un solo usuario, pedido o producto
+    get_user, put_user, update_user_fields, put_order, get_product,
+    # Stock: reservas al abrir el checkout y descuento con comprobación atómica al comprar
+    reserve_stock, purchase_stock, OutOfStockError,
+    transaction, get_stats, rebuild_stats,
+    # Notificaciones: propias + difusiones (ver data_manager.add_broadcast)
+    rebuild_unread_counts, add_broadcast, get_user_notifications, mark_notifications_read, dismiss_notification
 )
-from data_manager_chat import add_chat_message, get_user_chat, get_all_user_chats
+from data_manager_chat import (add_chat_message, get_user_chat_page, get_chat_summaries, mark_chat_read_by_admin,
+                               rebuild_chat_summaries, chat_cursor, wait_for_chat_messages)
+import product_search
+import report_engine
+from http_cache import catalog_cache
+from render_cache import cached_fragment, get_render_cache_stats
+import template_registry
+import static_files
+import uploads
+import upload_gc
+from pagination import paginate_records, get_page_args, Pagination, page_url
 
 # --- Importar tus módulos existentes (Blueprints) ---
 # Aquí, solo importas el Blueprint de user_auth, no sus funciones internas
 from user_auth import user_bp, login_required
 from admin_products import admin_products_bp
 from admin_users import admin_users_bp
-from admin_forms import AdminLoginForm
+from admin_forms import AdminLoginForm, AdminGenerateReportForm
 
 # Configuración básica del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -46,25 +68,41 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7) # Cambiado a 7 días como ejemplo
 
 # Configuración para carga de imágenes
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = uploads.IMAGE_EXTENSIONS
 UPLOAD_FOLDER = os.path.join('static', 'uploads')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Werkzeug corta con 413 las peticiones más grandes (por Content-Length, sin leer el cuerpo) y
+# UploadRequest escribe cada archivo directamente en uploads/ comprobando que sea una imagen.
+app.config['MAX_CONTENT_LENGTH'] = uploads.MAX_UPLOAD_MB * 1024 * 1024
+app.request_class = uploads.UploadRequest
 
+# Espera máxima (segundos) de una consulta de mensajes nuevos del chat (long-poll). Cada espera
+# ocupa un hilo del servidor mientras dura, pero no consume CPU.
+CHAT_WAIT_MAX = 25
 
 # Registrar Blueprints
 app.register_blueprint(user_bp)
 app.register_blueprint(admin_products_bp)
 app.register_blueprint(admin_users_bp)
 
+# Enlaces de paginación en las plantillas (ver templates/_pagination.html)
+app.add_template_global(page_url)
+# Token CSRF para los formularios escritos a mano en las plantillas (checkout.html, admin_orders.html)
+app.add_template_global(generate_csrf, 'csrf_token')
+app.add_template_global(cached_fragment)
+# Plantillas definidas en los módulos (admin_products, admin_users): se compilan una vez aquí
+template_registry.init_app(app)
+# Vista de static/: caché larga, Range y envío por el proxy (X-Accel-Redirect/X-Sendfile), ver static_files.py
+static_files.init_app(app)
+
 
 # --- Funciones de utilidad ---
 
 def init_admin_users():
     """Inicializa o actualiza el usuario administrador con la contraseña por defecto."""
-    users = load_users()
     # Siempre actualiza la contraseña del admin
     ADMIN_PASSWORD_HASH = generate_password_hash("ADMIN1234@")
-    users['admin'] = {
+    put_user('admin', {
         'username': 'admin',
         'email': 'admin@marketplace.com',
         'password': ADMIN_PASSWORD_HASH,
@@ -72,8 +110,7 @@ def init_admin_users():
         'registration_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'last_login': None,
         'is_active': True
-    }
-    save_users(users)
+    })
     logger.info("Usuario administrador 'admin' creado o actualizado con contraseña por defecto.")
 
 # Decorador para requerir autenticación de administrador
@@ -92,15 +129,40 @@ def allowed_file(filename):
     """Verifica si el archivo tiene una extensión permitida."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_image_upload(field):
+    """
+    Guarda la imagen enviada en el campo 'field' del formulario (una sola copia por contenido,
+    ver uploads.py). Retorna (url de la imagen, url de la miniatura) o (None, None) si no hay imagen válida.
+    """
+    file = request.files.get(field)
+    if not file or not allowed_file(file.filename):
+        return None, None
+    return uploads.save_upload(file, file.filename.rsplit('.', 1)[1].lower())
+
+def _upload_rejected(error, message):
+    """Vuelve al formulario con un aviso si se rechazó la imagen enviada; en otro caso, la respuesta de error normal."""
+    if request.method != 'POST':
+        return error
+    flash(message, 'error')
+    return redirect(request.path)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(error):
+    return _upload_rejected(error, f'La imagen supera el tamaño máximo permitido ({uploads.MAX_UPLOAD_MB} MB).')
+
+@app.errorhandler(UnsupportedMediaType)
+def upload_not_image(error):
+    return _upload_rejected(error, error.description)
+
 
 # --- Rutas principales ---
 
 @app.route('/')
+@catalog_cache
 def home():
-    """Página de inicio que muestra los productos disponibles."""
-    products_dict = load_products()
-    products = list(products_dict.values())  # Convertir a lista para la plantilla
-    return render_template('index.html', products=products)
+    """Página de inicio que muestra los productos disponibles (paginados)."""
+    pagination = paginate_records(PRODUCTS_FILE)
+    return render_template('index.html', products=pagination.items, pagination=pagination)
 
 @app.route('/cart')
 @login_required # Asegúrate de que el usuario esté logueado para ver el carrito
@@ -109,14 +171,12 @@ def cart():
     # user_cart es el carrito persistente del usuario (si está logueado)
     user_cart = get_cart(session.get('user_username'))
     
-    products = load_products() # Para obtener detalles de los productos en el carrito
-    
     cart_items_details = []
     total_price = 0
     
     if user_cart:
         for product_id, quantity in user_cart.items():
-            product = products.get(product_id)
+            product = get_product(product_id) # Detalles del producto en el carrito
             if product:
                 item_total = product['price'] * quantity
                 total_price += item_total
@@ -190,30 +250,43 @@ def checkout():
         flash('Tu carrito está vacío.', 'error')
         return redirect(url_for('cart'))
 
-    products = load_products()
-    orders = load_orders()
-    users = load_users()
-    current_user = users.get(username)
+    current_user = get_user(username)
 
     cart_items_details = []
     total_price = 0
 
     for product_id, quantity in user_cart.items():
-        product = products.get(product_id)
-        if product and product['stock'] >= quantity: # Verificar stock antes de checkout
-            item_total = product['price'] * quantity
-            total_price += item_total
-            cart_items_details.append({
-                'id': product_id,
-                'name': product['name'],
-                'price': product['price'],
-                'quantity': quantity,
-                'image': product.get('image', '/static/images/default_product.png'),
-                'total': item_total
-            })
-        else:
-            flash(f'Stock insuficiente para {product.get("name", "un producto")}. Por favor, ajusta tu carrito.', 'error')
+        product = get_product(product_id)
+        if not product:
+            flash('Un producto de tu carrito ya no está disponible. Por favor, ajusta tu carrito.', 'error')
             return redirect(url_for('cart'))
+        item_total = product['price'] * quantity
+        total_price += item_total
+        cart_items_details.append({
+            'id': product_id,
+            'name': product['name'],
+            'price': product['price'],
+            'quantity': quantity,
+            'image': product.get('image', '/static/images/default_product.png'),
+            'total': item_total,
+            'subtotal': item_total  # Nombre que usa checkout.html
+        })
+
+    def _out_of_stock(error):
+        name = next((item['name'] for item in cart_items_details if item['id'] == error.product_id), 'un producto')
+        flash(f'Stock insuficiente para {name} (disponibles: {error.available}). Por favor, ajusta tu carrito.', 'error')
+        return redirect(url_for('cart'))
+
+    # Al abrir el checkout se reservan las unidades del carrito durante unos minutos; el stock
+    # se descuenta al pagar, comprobándolo de nuevo de forma atómica producto a producto.
+    reserved_until = None
+    if request.method == 'GET':
+        try:
+            reserved_until = datetime.fromtimestamp(reserve_stock(username, user_cart)).strftime('%H:%M')
+        except OutOfStockError as e:
+            return _out_of_stock(e)
+        except Exception as e:
+            logger.error(f"Error al reservar el stock de {username}: {e}")
 
     if request.method == 'POST':
         # Eliminar referencia a delivery_address
@@ -236,12 +309,7 @@ def checkout():
                 'order_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                 'status': 'pending'
             }
-            orders[order_id] = new_order
-            save_orders(orders)
-
-            # --- Registrar la compra en user_purchases.json ---
-            user_purchases = load_user_purchases()
-            user_purchases.append({
+            purchase = {
                 'order_id': order_id,
                 'username': username,
                 'items': new_order['items'],
@@ -249,32 +317,40 @@ def checkout():
                 'payment_method_id': 'default',
                 'order_date': new_order['order_date'],
                 'status': new_order['status']
-            })
-            save_user_purchases(user_purchases)
-            # --- Fin registro compra ---
-
-            # Actualizar stock de productos
-            for item in cart_items_details:
-                product_id = item['id']
-                quantity_bought = item['quantity']
-                products[product_id]['stock'] -= quantity_bought
-            save_products(products) # Guardar los productos con el stock actualizado
+            }
 
-            # Limpiar el carrito del usuario después de la compra
-            clear_user_persistent_cart(username)
+            # Todo el registro del pedido es una sola unidad de trabajo: cada archivo se lee
+            # una vez y se escribe una vez al final; si un paso falla no se guarda nada.
+            try:
+                with transaction():
+                    if not put_order(new_order) or not add_user_purchase(purchase):
+                        raise RuntimeError(f'No se pudo registrar el pedido {order_id}')
+
+                    # Descontar el stock (solo los productos comprados); sin stock se deshace todo el pedido
+                    for item in cart_items_details:
+                        purchase_stock(username, item['id'], item['quantity'])
+
+                    # Limpiar el carrito del usuario después de la compra
+                    clear_user_persistent_cart(username)
+
+                    add_notification(username, f'Tu pedido #{order_id} ha sido confirmado. Total: ${total_price:.2f}', 'order_confirmation')
+
+                    # --- Mensaje de compra en el chat ---
+                    for item in cart_items_details:
+                        product_name = item['name']
+                        product_image = item.get('image', '/static/images/default_product.png')
+                        chat_text = f"¡Has comprado: {product_name}!"
+                        # El mensaje tendrá tanto texto como imagen
+                        add_chat_message(username, 'system', chat_text, image_url=product_image, order_id=order_id)
+                    # --- Fin mensaje de compra en el chat ---
+            except OutOfStockError as e:
+                return _out_of_stock(e)
+            except Exception as e:
+                logger.error(f"Error al procesar el pedido {order_id}: {e}")
+                flash('Error al registrar tu pedido. Por favor, inténtalo de nuevo.', 'error')
+                return redirect(url_for('cart'))
 
             flash('¡Tu pedido ha sido realizado con éxito!', 'success')
-            add_notification(username, f'Tu pedido #{order_id} ha sido confirmado. Total: ${total_price:.2f}', 'order_confirmation')
-            
-            # --- Mensaje de compra en el chat ---
-            for item in cart_items_details:
-                product_name = item['name']
-                product_image = item.get('image', '/static/images/default_product.png')
-                chat_text = f"¡Has comprado: {product_name}!"
-                # El mensaje tendrá tanto texto como imagen
-                add_chat_message(username, 'system', chat_text, image_url=product_image, order_id=order_id)
-            # --- Fin mensaje de compra en el chat ---
-
             return redirect(url_for('user_auth.user_orders'))
         else:
             flash('Error en el procesamiento del pago. Por favor, inténtalo de nuevo.', 'error')
@@ -285,29 +361,31 @@ def checkout():
     return render_template('checkout.html', 
                            cart_items=cart_items_details, 
                            total_price=total_price,
-                           user_address=user_address)
+                           user_address=user_address,
+                           reserved_until=reserved_until)
 
 @app.route('/products')
+@catalog_cache
 def products():
     """Página del catálogo de productos con búsqueda y filtrado."""
-    products_dict = load_products()
-    # Convertir a lista para iterar en la plantilla
-    products = list(products_dict.values())
-    # Obtener categorías únicas
-    categories = sorted(set(p.get('category', 'Sin categoría') for p in products))
-    # Filtros
-    search = request.args.get('search', '').lower()
+    # Filtros: la búsqueda y las facetas por categoría salen del índice invertido (product_search.py)
+    search = request.args.get('search', '')
     category = request.args.get('category', '')
-    if search:
-        products = [p for p in products if search in p.get('name', '').lower() or search in p.get('description', '').lower()]
+    page, per_page, _ = get_page_args()
+    product_ids, total, category_counts = product_search.search(search, category, offset=(page - 1) * per_page, limit=per_page)
     if category:
-        products = [p for p in products if p.get('category', 'Sin categoría') == category]
-    return render_template('products.html', products=products, categories=categories)
+        category_counts.setdefault(category, 0)  # Mantener visible la categoría seleccionada
+    # Solo se cargan los productos de la página actual
+    products = [p for p in (get_product(pid) for pid in product_ids) if p]
+    pagination = Pagination(products, page, per_page, total)
+    categories = sorted(category_counts)
+    return render_template('products.html', products=products, categories=categories, category_counts=category_counts,
+                           pagination=pagination)
 
 @app.route('/product/<int:product_id>')
+@catalog_cache
 def product_detail(product_id):
-    products = load_products()
-    product = products.get(str(product_id))
+    product = get_product(product_id)
     if not product:
         return render_template('error_404.html'), 404
     return render_template('product_detail.html', product=product)
@@ -319,56 +397,31 @@ def product_detail(product_id):
 @admin_required
 def admin_dashboard():
     """Página principal del panel de administración."""
-    users = load_users()
-    products = load_products()
-    orders = load_orders()
-    reports = load_reports()
-
-    # Contar usuarios y administradores
-    total_users = len(users)
-    total_admins = sum(1 for u in users.values() if u.get('role') == 'admin')
+    # Contadores mantenidos en cada escritura (data_manager.get_stats): no se recorren los datos
+    counters = get_stats()
+    total_products = counters.get('products', 0)
+    avg_price = counters.get('price_sum', 0) / total_products if total_products else 0
 
-    # Contar productos (activos/inactivos)
-    total_products = len(products)
-    active_products = sum(1 for p in products.values() if p.get('is_active', False))
-
-    # Estadísticas de órdenes
-    total_orders = len(orders)
-    pending_orders = sum(1 for o in orders.values() if o.get('status') == 'pending')
-    completed_orders = sum(1 for o in orders.values() if o.get('status') == 'completed')
-
-    # Suma total de ingresos de órdenes completadas
-    total_revenue = sum(o.get('total_price', 0) for o in orders.values() if o.get('status') == 'completed')
-
-    # Calcular precio promedio de productos
-    if products:
-        avg_price = sum(p.get('price', 0) for p in products.values()) / len(products)
-    else:
-        avg_price = 0
-
-    # Notificaciones recientes (ejemplo: las últimas 5)
-    all_notifications = load_notifications()
-    recent_notifications = []
-    for user_notifs in all_notifications.values():
-        recent_notifications.extend(user_notifs)
-    recent_notifications = sorted(recent_notifications, key=lambda x: x.get('timestamp', '0'), reverse=True)[:5]
+    # Notificaciones recientes (las últimas 5, de la más nueva a la más antigua)
+    recent_notifications = list(reversed(counters.get('recent_notifications', [])[-5:]))
 
     # Agrupar estadísticas en un diccionario
     stats = {
-        'total_usuarios': total_users,
-        'total_administradores': total_admins,
+        'total_usuarios': counters.get('users', 0),
+        'total_administradores': counters.get('admins', 0),
         'total_productos': total_products,
-        'productos_activos': active_products,
-        'total_ordenes': total_orders,
-        'ordenes_pendientes': pending_orders,
-        'ordenes_completadas': completed_orders,
-        'ingresos_totales': total_revenue,
+        'productos_activos': counters.get('active_products', 0),
+        'total_ordenes': counters.get('orders', 0),
+        'ordenes_pendientes': counters.get('pending_orders', 0),
+        'ordenes_completadas': counters.get('completed_orders', 0),
+        'ingresos_totales': counters.get('revenue', 0),
         'avg_price': avg_price
     }
 
     return render_template('admin_dashboard.html',
                            stats=stats,
-                           recent_notifications=recent_notifications)
+                           recent_notifications=recent_notifications,
+                           render_cache_stats=get_render_cache_stats())
 
 @app.route('/admin/reports')
 @admin_required
@@ -379,7 +432,22 @@ def admin_reports():
     # Ordenar por fecha de generación si lo deseas
     reports_sorted = dict(sorted(reports.items(), key=lambda item: item[1].get('generated_at', ''), reverse=True))
 
-    return render_template('admin_reports.html', reports=reports_sorted)
+    return render_template('admin_reports.html', reports=reports_sorted,
+                           report_form=AdminGenerateReportForm(),
+                           generating=report_engine.is_generating())
+
+@app.route('/admin/reports/generate', methods=['POST'])
+@admin_required
+def admin_generate_report():
+    """Pone al día el reporte de ventas en segundo plano (o lo recalcula entero con 'full')."""
+    form = AdminGenerateReportForm()
+    if not form.validate_on_submit():
+        flash('Solicitud no válida. Inténtalo de nuevo.', 'error')
+    elif report_engine.start_sales_report(full=form.full.data):
+        flash('Generando el reporte de ventas en segundo plano. Recarga la página en unos momentos.', 'info')
+    else:
+        flash('Ya se está generando un reporte de ventas.', 'info')
+    return redirect(url_for('admin_reports'))
 
 @app.route('/admin/logout')
 def admin_logout():
@@ -398,8 +466,7 @@ def admin_login():
     if form.validate_on_submit():
         username = form.username.data
         password = form.password.data
-        users = load_users()
-        admin = users.get('admin')
+        admin = get_user('admin')
         if admin and username == 'admin' and check_password_hash(admin['password'], password):
             session['admin_logged_in'] = True
             session['admin_username'] = 'admin'
@@ -414,65 +481,69 @@ def admin_login():
 @admin_required
 def admin_user_purchases():
     """Muestra el historial de compras de todos los usuarios para el administrador."""
-    purchases = load_user_purchases()
-    # Ordenar por fecha descendente
-    purchases_sorted = sorted(purchases, key=lambda x: x.get('order_date', ''), reverse=True)
-    return render_template('admin_user_purchases.html', purchases=purchases_sorted)
+    # Las compras se añaden al final en el momento de la compra: el orden inverso de inserción
+    # es el orden por fecha descendente, así no hace falta ordenar toda la lista en cada visita.
+    pagination = paginate_records(USER_PURCHASES_FILE, default_per_page=50, reverse=True)
+    return render_template('admin_user_purchases.html', purchases=pagination.items, pagination=pagination)
 
 @app.route('/admin/user_chats')
 @admin_required
 def admin_user_chats():
     """Muestra la lista de usuarios con los que hay chat."""
-    # Obtener todos los chats agrupados por usuario
-    user_chats = get_all_user_chats()
-    # user_chats es un dict: {username: [mensajes]}
-    return render_template('admin_user_chats.html', user_chats=user_chats)
+    # Solo se leen los resúmenes (último mensaje, no leídos...), no los mensajes de cada chat
+    return render_template('admin_user_chats.html', chat_summaries=get_chat_summaries())
 
 @app.route('/admin/user_chats_overview')
 @admin_required
 def admin_user_chats_overview():
     """Muestra una lista de usuarios que han escrito en el chat (sin mostrar mensajes)."""
-    user_chats = get_all_user_chats()
-    user_list = sorted(user_chats.keys())
-    return render_template('admin_user_chats_overview.html', user_list=user_list)
+    return render_template('admin_user_chats_overview.html', chat_summaries=get_chat_summaries())
 
 @app.route('/admin/user_chat/<username>', methods=['GET', 'POST'])
 @admin_required
 def admin_user_chat(username):
-    chat_history = get_user_chat(username)
-    user_chats = get_all_user_chats()
-    user_list = sorted(user_chats.keys())
     if request.method == 'POST':
         message = request.form.get('message')
-        image_url = None
-        if 'admin_image' in request.files:
-            file = request.files['admin_image']
-            if file and allowed_file(file.filename):
-                filename = secure_filename(f"admin_{username}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                image_url = f"/static/uploads/{filename}"
+        image_url, thumb_url = save_image_upload('admin_image')
         if message or image_url:
-            add_chat_message(username, 'admin', message, image_url=image_url)
+            add_chat_message(username, 'admin', message, image_url=image_url, thumb_url=thumb_url)
             flash('Mensaje enviado al usuario.', 'success')
         return redirect(url_for('admin_user_chat', username=username))
-    return render_template('admin_user_chat.html', username=username, chat_history=chat_history, user_list=user_list)
+    chat_history, older_cursor, _ = get_user_chat_page(username)
+    mark_chat_read_by_admin(username)
+    user_list = [summary['username'] for summary in get_chat_summaries()]
+    return render_template('admin_user_chat.html', username=username, chat_history=chat_history, user_list=user_list,
+                           chat_cursor=chat_cursor(chat_history), older_cursor=older_cursor)
+
+@app.route('/admin/user_chat/<username>/history')
+@admin_required
+def admin_user_chat_history(username):
+    """Página de mensajes anteriores al cursor ?before= (ver _chat_history_response)."""
+    render = get_template_attribute('_chat_message.html', 'admin_chat_message')
+    return _chat_history_response(username, lambda msg: render(msg, username))
+
+@app.route('/admin/user_chat/<username>/messages')
+@admin_required
+def admin_user_chat_messages(username):
+    """Mensajes del chat posteriores al cursor ?after= (ver _chat_messages_response)."""
+    render = get_template_attribute('_chat_message.html', 'admin_chat_message')
+    response, messages = _chat_messages_response(username, lambda msg: render(msg, username))
+    if messages:
+        mark_chat_read_by_admin(username)  # El administrador los está viendo en la página abierta
+    return response
 
 @app.route('/contact_admin', methods=['GET', 'POST'])
 @login_required
 def contact_admin():
     username = session.get('user_username')
     user_cart = get_cart(username)
-    products = load_products()
-    users = load_users()
-    current_user = users.get(username)
 
     cart_items_details = []
     total_price = 0
 
     if user_cart:
         for product_id, quantity in user_cart.items():
-            product = products.get(product_id)
+            product = get_product(product_id)
             if product:
                 item_total = product['price'] * quantity
                 total_price += item_total
@@ -485,24 +556,14 @@ def contact_admin():
                     'total': item_total
                 })
 
-    chat_history = get_user_chat(username)
-
     if request.method == 'POST':
         message = request.form.get('message')
         ancho = request.form.get('ancho')
         ancho_unidad = request.form.get('ancho_unidad')
         largo = request.form.get('largo')
         largo_unidad = request.form.get('largo_unidad')
-        image_url = None
-        if 'admin_image' in request.files:
-            file = request.files['admin_image']
-            if file and allowed_file(file.filename):
-                filename = secure_filename(f"{username}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                image_url = f"/static/uploads/{filename}"
+        image_url, thumb_url = save_image_upload('admin_image')
         # Registrar la compra como pendiente (flujo original)
-        orders = load_orders()
         order_id = secrets.token_hex(8)
         new_order = {
             'order_id': order_id,
@@ -521,8 +582,6 @@ def contact_admin():
             'status': 'pending',
             'admin_message': message
         }
-        orders[order_id] = new_order
-        save_orders(orders)
         # Guardar mensaje en el chat (ahora con order_id)
         msg_text = f"{message}\nTamaño solicitado: {ancho} {ancho_unidad} x {largo} {largo_unidad}"
         # --- FILTRO DE MENSAJES: No guardar tokens ni cadenas sospechosas ---
@@ -539,11 +598,7 @@ def contact_admin():
             if 'csrf' in msg.lower() or 'token' in msg.lower():
                 return True
             return False
-        if (message and not is_suspicious_message(message)) or image_url:
-            add_chat_message(username, 'user', msg_text, image_url=image_url, order_id=order_id)
-        # Registrar en user_purchases.json
-        user_purchases = load_user_purchases()
-        user_purchases.append({
+        purchase = {
             'order_id': order_id,
             'username': username,
             'items': new_order['items'],
@@ -552,29 +607,38 @@ def contact_admin():
             'order_date': new_order['order_date'],
             'status': 'pending',
             'admin_message': message
-        })
-        save_user_purchases(user_purchases)
-        clear_user_persistent_cart(username)
+        }
+        # Pedido, chat, historial de compras y carrito se confirman juntos (una escritura por archivo)
+        try:
+            with transaction():
+                if not put_order(new_order):
+                    raise RuntimeError(f'No se pudo registrar el pedido {order_id}')
+                if (message and not is_suspicious_message(message)) or image_url:
+                    add_chat_message(username, 'user', msg_text, image_url=image_url, order_id=order_id,
+                                     thumb_url=thumb_url)
+                # Registrar en user_purchases.json
+                if not add_user_purchase(purchase):
+                    raise RuntimeError(f'No se pudo registrar la compra {order_id}')
+                clear_user_persistent_cart(username)
+        except Exception as e:
+            logger.error(f"Error al registrar la solicitud {order_id}: {e}")
+            flash('Error al enviar tu solicitud. Por favor, inténtalo de nuevo.', 'error')
+            return redirect(url_for('contact_admin'))
         flash('Tu solicitud ha sido enviada al administrador. Pronto te contactarán para finalizar la compra.', 'success')
         return redirect(url_for('user_auth.user_orders'))
 
-    return render_template('contact_admin.html', cart_items=cart_items_details, total_price=total_price, chat_history=chat_history)
+    # Solo los mensajes más recientes; el historial completo está en /user/chat
+    chat_history, older_cursor, _ = get_user_chat_page(username)
+    return render_template('contact_admin.html', cart_items=cart_items_details, total_price=total_price,
+                           chat_history=chat_history, has_older_messages=older_cursor is not None)
 
 @app.route('/user/chat', methods=['GET', 'POST'])
 @login_required
 def user_chat():
     username = session.get('user_username')
-    chat_history = get_user_chat(username)
     if request.method == 'POST':
         message = request.form.get('message')
-        image_url = None
-        if 'user_image' in request.files:
-            file = request.files['user_image']
-            if file and allowed_file(file.filename):
-                filename = secure_filename(f"{username}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{file.filename}")
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-                image_url = f"/static/uploads/{filename}"
+        image_url, thumb_url = save_image_upload('user_image')
         # --- FILTRO DE MENSAJES: No guardar tokens ni cadenas sospechosas ---
         def is_suspicious_message(msg):
             if not msg:
@@ -590,34 +654,87 @@ def user_chat():
                 return True
             return False
         if (message and not is_suspicious_message(message)) or image_url:
-            add_chat_message(username, 'user', message, image_url=image_url)
+            add_chat_message(username, 'user', message, image_url=image_url, thumb_url=thumb_url)
             flash('Mensaje enviado al administrador.', 'success')
         else:
             flash('Mensaje inválido o sospechoso, no se ha enviado.', 'error')
         return redirect(url_for('user_chat'))
-    return render_template('user_chat.html', chat_history=chat_history)
+    chat_history, older_cursor, _ = get_user_chat_page(username)
+    return render_template('user_chat.html', chat_history=chat_history, chat_cursor=chat_cursor(chat_history),
+                           older_cursor=older_cursor)
+
+@app.route('/user/chat/messages')
+@login_required
+def user_chat_messages():
+    """Mensajes del chat del usuario posteriores al cursor ?after= (ver _chat_messages_response)."""
+    render = get_template_attribute('_chat_message.html', 'user_chat_message')
+    return _chat_messages_response(session.get('user_username'), render)[0]
+
+@app.route('/user/chat/history')
+@login_required
+def user_chat_history():
+    """Página de mensajes anteriores al cursor ?before= del chat del usuario."""
+    render = get_template_attribute('_chat_message.html', 'user_chat_message')
+    return _chat_history_response(session.get('user_username'), render)
+
+def _chat_messages_response(username, render):
+    """
+    JSON con los mensajes posteriores a ?after=<id> ya renderizados con la misma macro que la
+    página, y el cursor para la siguiente consulta. Con ?wait=N (máx. CHAT_WAIT_MAX segundos)
+    espera a que llegue alguno (long-poll). Retorna (respuesta, mensajes).
+    """
+    after = request.args.get('after', '')
+    wait = min(max(request.args.get('wait', 0, type=int) or 0, 0), CHAT_WAIT_MAX)
+    messages, reset = wait_for_chat_messages(username, after, timeout=wait)
+    payload = {
+        'messages': _render_chat_messages(messages, render),
+        'cursor': chat_cursor(messages) if messages else after,
+        'reset': reset,
+    }
+    return jsonify(payload), messages
+
+def _chat_history_response(username, render):
+    """JSON con la página de mensajes anteriores a ?before=<cursor> y el cursor de la página previa (o null)."""
+    messages, older_cursor, reset = get_user_chat_page(username, request.args.get('before'))
+    return jsonify({'messages': _render_chat_messages(messages, render), 'cursor': older_cursor, 'reset': reset})
+
+def _render_chat_messages(messages, render):
+    return [{'id': msg.get('id'), 'html': str(render(msg)).strip()} for msg in messages]
 
 @app.route('/user/notifications')
 @login_required
 def user_notifications():
     username = session.get('user_username')
-    notifications = load_notifications().get(username, [])
+    notifications = get_user_notifications(username)
     return render_template('user_notifications.html', notifications=notifications)
 
+@app.route('/user/notifications/mark_read/<notification_id>', methods=['POST'])
+@login_required
+def user_notification_mark_read(notification_id):
+    """Marca una notificación (propia o difusión) como leída. Lo usa user_notifications.html."""
+    if mark_notifications_read(session.get('user_username'), notification_id):
+        return jsonify(success=True)
+    return jsonify(success=False, message='Notificación no encontrada.'), 404
+
+@app.route('/user/notifications/delete/<notification_id>', methods=['POST'])
+@login_required
+def user_notification_delete(notification_id):
+    """Elimina una notificación propia o descarta una difusión solo para este usuario."""
+    if dismiss_notification(session.get('user_username'), notification_id):
+        return jsonify(success=True)
+    return jsonify(success=False, message='Notificación no encontrada.'), 404
+
 @app.route('/user/notification_settings', methods=['GET', 'POST'])
 @login_required
 def notification_settings():
     username = session.get('user_username')
-    users = load_users()
-    user = users.get(username)
+    user = get_user(username)
     if not user:
         flash('Usuario no encontrado.', 'error')
         return redirect(url_for('user_auth.user_dashboard'))
     if request.method == 'POST':
         notifications_enabled = request.form.get('notifications_enabled') == 'on'
-        user['notifications_enabled'] = notifications_enabled
-        users[username] = user
-        save_users(users)
+        update_user_fields(username, notifications_enabled=notifications_enabled)
         flash('Preferencia de notificaciones actualizada.', 'success')
         return redirect(url_for('notification_settings'))
     notifications_enabled = user.get('notifications_enabled', True)
@@ -626,8 +743,6 @@ def notification_settings():
 @app.route('/admin/create_notification', methods=['GET', 'POST'])
 @admin_required
 def admin_create_notification():
-    users = load_users()
-    usernames = [u for u in users if users[u].get('role') != 'admin']
     if request.method == 'POST':
         title = request.form.get('title', '').strip()
         message = request.form.get('message', '').strip()
@@ -636,23 +751,77 @@ def admin_create_notification():
         if not title or not message:
             flash('Título y mensaje son obligatorios.', 'error')
             return redirect(url_for('admin_create_notification'))
-        # Enviar a todos o a un usuario
+        # Enviar a todos (una sola difusión, no una escritura por usuario) o a un usuario
         if target == 'all':
-            for username in usernames:
-                user = users[username]
-                if user.get('notifications_enabled', True):
-                    add_notification(username, message, notif_type, title=title)
-            flash('Notificación enviada a todos los usuarios que aceptan notificaciones.', 'success')
+            if add_broadcast(message, notif_type, title=title):
+                flash('Notificación enviada a todos los usuarios que aceptan notificaciones.', 'success')
+            else:
+                flash('Error al enviar la notificación.', 'error')
         else:
-            user = users.get(target)
+            user = get_user(target)
             if user and user.get('notifications_enabled', True):
                 add_notification(target, message, notif_type, title=title)
                 flash(f'Notificación enviada a {target}.', 'success')
             else:
                 flash('El usuario no existe o no acepta notificaciones.', 'error')
         return redirect(url_for('admin_dashboard'))
+    users = load_users()
+    usernames = [u for u in users if users[u].get('role') != 'admin']
     return render_template('admin_create_notification.html', usernames=usernames)
 
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recalcula desde cero las estadísticas del panel de administración (data/stats.json)."""
+    stats = rebuild_stats()
+    counters = {key: value for key, value in stats.items() if key != 'recent_notifications'}
+    print(f"Estadísticas reconstruidas: {counters}")
+
+@app.cli.command('generate-report')
+@click.option('--full', is_flag=True, help='Recalcular desde el principio del historial.')
+def generate_report_command(full):
+    """Genera o pone al día el reporte de ventas (reports.json) a partir del historial de compras."""
+    report = report_engine.generate_sales_report(full=full)
+    if report is not None:
+        print(f"Reporte de ventas generado: {report['processed_purchases']} compras, "
+              f"ingresos ${report['totals']['revenue']:.2f}")
+
+@app.cli.command('rebuild-unread-counts')
+def rebuild_unread_counts_command():
+    """Recalcula desde cero los contadores de notificaciones sin leer (data/notifications_unread.json)."""
+    if rebuild_unread_counts():
+        print("Contadores de notificaciones sin leer reconstruidos.")
+
+@app.cli.command('generate-thumbnails')
+def generate_thumbnails_command():
+    """Genera las miniaturas que falten de las imágenes subidas (requiere Pillow)."""
+    if uploads.THUMB_FORMAT is None:
+        print("Pillow no está instalado: no se generan miniaturas.")
+        return
+    print(f"Miniaturas generadas: {uploads.generate_missing_thumbnails()}")
+
+@app.cli.command('gc-uploads')
+@click.option('--shards', default=upload_gc.SHARDS_PER_RUN, show_default=True, help='Carpetas de static/uploads a revisar en esta ejecución.')
+@click.option('--all', 'all_shards', is_flag=True, help='Revisar todas las carpetas.')
+@click.option('--grace-hours', default=upload_gc.GRACE_HOURS, show_default=True, help='Antigüedad mínima de un archivo para retirarlo.')
+@click.option('--delete', is_flag=True, help='Borrar los archivos en vez de moverlos a la cuarentena.')
+@click.option('--dry-run', is_flag=True, help='Solo contar lo que se retiraría.')
+def gc_uploads_command(shards, all_shards, grace_hours, delete, dry_run):
+    """Retira de static/uploads las imágenes que ya no usa ningún mensaje ni producto (por tandas de carpetas)."""
+    result = upload_gc.collect_garbage(None if all_shards else shards, grace_hours, delete, dry_run)
+    if result is None:
+        return
+    action = 'se retirarían' if dry_run else ('borrados' if delete else f'movidos a {upload_gc.QUARANTINE_DIR}')
+    print(f"{result['scanned']} archivos revisados en {result['shards']} carpetas; {result['removed']} {action} "
+          f"({result['bytes_reclaimed'] / 1024 / 1024:.1f} MB).")
+    if not result['cycle_complete']:
+        print(f"La próxima ejecución continúa en la carpeta '{result['next_shard']}'.")
+
+@app.cli.command('rebuild-chat-summaries')
+def rebuild_chat_summaries_command():
+    """Recalcula desde cero los resúmenes de las conversaciones (data/chat_summaries.json)."""
+    if rebuild_chat_summaries():
+        print("Resúmenes de chats reconstruidos.")
+
 def init_app():
     """Inicializa la aplicación Flask, incluyendo la configuración de usuarios y el registro de Blueprints."""
     init_admin_users()
@@ -0,0 +1,49 @@
+# bench_common.py - Utilidades comunes de los benchmarks
+#
+# Cada benchmark trabaja en un directorio temporal con su propia carpeta 'data/' (las rutas de
+# data_manager son relativas al directorio actual), así nunca toca los datos reales de la app.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import storage
+import data_manager
+
+BACKENDS = ['json', 'sqlite']
+
+def backends_from_argv():
+    """Backends pedidos en la línea de comandos ('json', 'sqlite'); los dos si no se indica ninguno."""
+    chosen = [arg for arg in sys.argv[1:] if arg in BACKENDS]
+    return chosen or BACKENDS
+
+@contextmanager
+def temp_data_dir(backend):
+    """Directorio de datos vacío con el backend indicado; se borra al terminar."""
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix='bench-')
+    try:
+        os.makedirs(os.path.join(root, 'data'))
+        os.chdir(root)
+        storage.STORAGE_BACKEND = backend
+        storage.SQLITE_PATH = os.path.join(root, 'data', 'store.sqlite3')
+        storage.clear_cache()
+        data_manager._ready_indexes.clear()
+        yield root
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+def mean_time(func, number):
+    """Tiempo medio en segundos de 'number' llamadas a func()."""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number
@@ -0,0 +1,55 @@
+# bench_email_lookup.py - Búsqueda de usuarios por email con el índice users_by_email
+#
+# Uso:
+#   python benchmarks/bench_email_lookup.py [json] [sqlite] [tamaño ...]
+#
+# Para cada tamaño (por defecto 1k, 10k, 100k y 1M usuarios) escribe users.json, construye el
+# índice con rebuild_email_index y mide get_user_by_email con la caché caliente. Hasta
+# SCAN_LIMIT usuarios mide también el recorrido completo que hacía el login antes del índice.
+
+import random
+import sys
+
+from bench_common import backends_from_argv, mean_time, temp_data_dir
+import data_manager
+import storage
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+LOOKUPS = 200
+SCAN_LIMIT = 100_000
+SCAN_LOOKUPS = 5
+
+def seed(size):
+    users = {f'usuario{i}': {'username': f'usuario{i}', 'email': f'Usuario{i}@Example.com', 'full_name': f'Usuario {i}'}
+             for i in range(size)}
+    storage.save_json(data_manager.USERS_FILE, users)
+    assert data_manager.rebuild_email_index()
+
+def scan_by_email(email):
+    """Búsqueda anterior al índice: recorre todos los usuarios."""
+    email = data_manager.normalize_email(email)
+    return next((user for user in data_manager.load_users().values()
+                 if data_manager.normalize_email(user.get('email')) == email), None)
+
+def bench(size):
+    seed(size)
+    emails = [f'usuario{random.randrange(size)}@example.com' for _ in range(LOOKUPS)]
+    for email in emails:
+        data_manager.get_user_by_email(email)  # Caché caliente
+    lookups = iter(emails * 2)
+    indexed = mean_time(lambda: data_manager.get_user_by_email(next(lookups)), LOOKUPS)
+    scan = None
+    if size <= SCAN_LIMIT:
+        scan = mean_time(lambda: scan_by_email(random.choice(emails)), SCAN_LOOKUPS)
+    return indexed, scan
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:] if arg.isdigit()] or SIZES
+    for backend in backends_from_argv():
+        for size in sizes:
+            with temp_data_dir(backend):
+                indexed, scan = bench(size)
+            line = f"[{backend}] {size:>9} usuarios: get_user_by_email {indexed * 1e6:.0f} us"
+            if scan is not None:
+                line += f", recorrido completo {scan * 1e3:.1f} ms"
+            print(line, flush=True)
@@ -0,0 +1,43 @@
+# bench_render.py - Plantillas de administración: render_template_string frente al registro
+#
+# Uso:
+#   python benchmarks/bench_render.py
+#
+# Renderiza dentro de un contexto de petición la lista de usuarios y el formulario de producto
+# de dos formas: como antes (render_template_string con el código fuente, que Jinja compila en
+# cada llamada) y por nombre con render_template (compiladas una vez por template_registry).
+
+from flask import render_template, render_template_string
+
+from bench_common import mean_time, temp_data_dir
+from pagination import Pagination
+import template_registry
+
+RENDERS = 200
+
+def cases():
+    from admin_delete_forms import AdminDeleteUserForm
+    from admin_products import PRODUCT_FORM_TEMPLATE
+    from admin_users import ADMIN_USERS_TEMPLATE
+
+    users = [{'username': f'usuario{i}', 'email': f'usuario{i}@example.com', 'full_name': f'Usuario {i}',
+              'registration_date': '2025-01-01 10:00:00'} for i in range(50)]
+    product = {'id': '1', 'name': 'Letrero LED', 'description': 'Letrero de neón LED', 'price': 49.9, 'stock': 10,
+               'category': 'led', 'image_url': '/static/images/1.png', 'version': 3}
+    return [
+        ('lista de usuarios', ADMIN_USERS_TEMPLATE,
+         lambda: dict(title='Gestión de Usuarios', users=users, pagination=Pagination(users, 1, 50, 1000),
+                      delete_form=AdminDeleteUserForm())),
+        ('formulario de producto', PRODUCT_FORM_TEMPLATE, lambda: dict(title='Editar Producto', product=product)),
+    ]
+
+if __name__ == '__main__':
+    with temp_data_dir('json'):
+        from app import app
+        app.config['WTF_CSRF_ENABLED'] = False
+        with app.test_request_context('/admin'):
+            for label, name, context in cases():
+                source = template_registry._sources[name]
+                before = mean_time(lambda: render_template_string(source, **context()), RENDERS)
+                after = mean_time(lambda: render_template(name, **context()), RENDERS)
+                print(f"{label}: render_template_string {before * 1e3:.2f} ms, registro {after * 1e3:.2f} ms")
@@ -0,0 +1,75 @@
+# bench_stock_contention.py - Compras concurrentes desde varios hilos
+#
+# Uso:
+#   python benchmarks/bench_stock_contention.py [json] [sqlite]
+#
+# Compara el descuento antiguo (comprobar el stock y después adjust_product_stock) con
+# purchase_stock en dos escenarios: todos los hilos compran el mismo producto (el antiguo
+# vende de más) y cada hilo compra un producto distinto (mide el coste de la comprobación).
+
+import threading
+import time
+
+from bench_common import backends_from_argv, temp_data_dir
+import data_manager
+import storage
+
+THREADS = 16
+PER_THREAD = 20
+SHARED_STOCK = 100
+FIRST_ID = 900
+
+def setup():
+    for i in range(THREADS + 1):
+        stock = SHARED_STOCK if i == 0 else PER_THREAD
+        data_manager.put_product({'id': str(FIRST_ID + i), 'name': f'Producto {i}', 'description': 'benchmark',
+                                  'price': 1.0, 'stock': stock, 'category': 'benchmark'})
+
+def check_then_adjust(product_id, username):
+    product = data_manager.get_product(product_id)
+    if product and product['stock'] >= 1:
+        time.sleep(0.0005)  # Tiempo entre la comprobación y el descuento (render, pago simulado)
+        data_manager.adjust_product_stock(product_id, -1)
+        return True
+    return False
+
+def purchase(product_id, username):
+    try:
+        with storage.transaction():
+            data_manager.purchase_stock(username, product_id, 1)
+            time.sleep(0.0005)
+        return True
+    except data_manager.OutOfStockError:
+        return False
+
+def run(buy, same_product):
+    setup()
+    sold = [0] * THREADS
+
+    def worker(i):
+        product_id = str(FIRST_ID if same_product else FIRST_ID + 1 + i)
+        for _ in range(PER_THREAD * 2 if same_product else PER_THREAD):
+            sold[i] += buy(product_id, f'usuario{i}')
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if same_product:
+        left = data_manager.get_product(str(FIRST_ID))['stock']
+    else:
+        left = min(data_manager.get_product(str(FIRST_ID + 1 + i))['stock'] for i in range(THREADS))
+    return sum(sold), elapsed, left
+
+if __name__ == '__main__':
+    for backend in backends_from_argv():
+        for name, buy in (('comprobar y descontar (antes)', check_then_adjust), ('purchase_stock', purchase)):
+            with temp_data_dir(backend):
+                sold, elapsed, left = run(buy, True)
+                print(f"[{backend}] {name}, mismo producto: {sold} vendidas de {SHARED_STOCK}, stock final {left}")
+                sold, elapsed, left = run(buy, False)
+                print(f"[{backend}] {name}, productos distintos: {sold} de {THREADS * PER_THREAD}, "
+                      f"stock mínimo {left}, {sold / elapsed:.0f} compras/s")
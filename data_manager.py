@@ -1,10 +1,16 @@
 # data_manager.py
 
+import bisect
 import json
 import os
 from datetime import datetime
 import secrets
 import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+import storage
 
 # Configuración del logging para data_manager
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,68 +30,192 @@ USER_CARTS_FILE = os.path.join(DATA_DIR, 'user_carts.json')
 USER_PURCHASES_FILE = os.path.join(DATA_DIR, 'user_purchases.json')
 REPORTS_FILE = os.path.join(DATA_DIR, 'reports.json')
 
+# Índice secundario {email normalizado: username}; se mantiene en cada escritura de usuarios
+# para que el login por email y la comprobación de duplicados no recorran todos los usuarios.
+USERS_BY_EMAIL_FILE = os.path.join(DATA_DIR, 'users_by_email.json')
+# {username: [[order_date, order_id], ...]} ordenado por fecha: el historial de un usuario
+# se sirve sin recorrer ni ordenar todos los pedidos de la tienda.
+ORDERS_BY_USER_FILE = os.path.join(DATA_DIR, 'orders_by_user.json')
+# {order_id: posición en user_purchases.json}; la posición se verifica antes de usarla.
+PURCHASE_POSITIONS_FILE = os.path.join(DATA_DIR, 'user_purchases_positions.json')
+# {'version': n, 'changes': [[version, product_id], ...]}: cada escritura del catálogo sube la
+# versión y anota el producto tocado (None = todo el catálogo), así los índices y cachés
+# derivados del catálogo se actualizan solo con lo que cambió.
+CATALOG_VERSION_FILE = os.path.join(DATA_DIR, 'catalog_version.json')
+CATALOG_CHANGES_KEPT = 500
+# Contadores del panel de administración y las últimas notificaciones, mantenidos en cada
+# escritura para que /admin no tenga que recorrer usuarios, productos, pedidos y notificaciones.
+STATS_FILE = os.path.join(DATA_DIR, 'stats.json')
+RECENT_NOTIFICATIONS_KEPT = 20
+# Notificaciones para todos los usuarios: se guardan una sola vez ({id: difusión}) y cada
+# usuario solo guarda qué difusiones ha leído o descartado ({username: {'read': [...], 'dismissed': [...]}}).
+BROADCASTS_FILE = os.path.join(DATA_DIR, 'broadcasts.json')
+BROADCAST_MARKERS_FILE = os.path.join(DATA_DIR, 'broadcast_markers.json')
+# Notificaciones propias: un archivo por usuario (una lista), en lugar de un único
+# notifications.json con todos; NOTIFICATIONS_FILE se migra aquí automáticamente.
+NOTIFICATIONS_DIR = os.path.join(DATA_DIR, 'notifications')
+# {username: número de notificaciones sin leer (propias y difusiones)}, mantenido en cada escritura.
+# Su ruta se ordena después de las de NOTIFICATIONS_DIR (ver _notifications_guard).
+UNREAD_COUNTS_FILE = os.path.join(DATA_DIR, 'notifications_unread.json')
+# Reservas de stock al abrir el checkout: {product_id: {username: {'quantity': n, 'expires': epoch}}}.
+# Una reserva vigente descuenta unidades del stock disponible para los demás compradores.
+RESERVATIONS_FILE = os.path.join(DATA_DIR, 'stock_reservations.json')
+RESERVATION_SECONDS = 10 * 60
+# {'next': n}: siguiente ID de producto libre. Se reserva con una escritura atómica, así dos
+# altas simultáneas nunca reciben el mismo ID ni hace falta leer el catálogo para calcularlo.
+PRODUCT_IDS_FILE = os.path.join(DATA_DIR, 'product_ids.json')
+
 # Asegurarse de que el directorio DATA_DIR exista
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
 
 # --- Funciones de Carga y Guardado Genéricas ---
+# La E/S real (caché, bloqueo entre procesos y escritura atómica) vive en storage.py.
 
 def _load_data(filepath, default_value={}):
-    """Carga datos desde un archivo JSON. Retorna el valor por defecto si el archivo no existe o está vacío."""
-    if not os.path.exists(filepath):
-        logger.info(f"Archivo no encontrado: {filepath}. Se creará con valor por defecto.")
-        _save_data(filepath, default_value) # Crear el archivo vacío
-        return default_value
+    """
+    Carga datos desde un archivo JSON. Retorna el valor por defecto si el archivo no existe o está vacío.
+    El resultado siempre es una copia: el llamador puede modificarlo sin afectar a la caché.
+    """
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Asegurarse de que el tipo de dato cargado coincide con el valor por defecto
-            if not isinstance(data, type(default_value)):
-                logger.warning(f"Contenido de {filepath} no es del tipo esperado. Se inicializará con valor por defecto.")
-                return default_value
-            return data
-    except json.JSONDecodeError:
-        logger.error(f"Error al decodificar JSON desde {filepath}. El archivo podría estar corrupto. Se reiniciará con valor por defecto.")
-        return default_value # Reiniciar si el JSON está corrupto
+        return storage.load_json(filepath, default_value)
     except Exception as e:
         logger.error(f"Error inesperado al cargar {filepath}: {e}. Se reiniciará con valor por defecto.")
-        return default_value
+        return storage.clone_json(default_value)
 
 def _save_data(filepath, data):
-    """Guarda datos en un archivo JSON."""
+    """Guarda datos en un archivo JSON de forma atómica."""
+    return storage.save_json(filepath, data)
+
+def _update_data(filepath, default_value, mutator):
+    """
+    Lectura-modificación-escritura de un archivo JSON manteniendo el bloqueo exclusivo
+    durante toda la operación. Retorna True si tuvo éxito.
+    """
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4)
+        storage.update_json(filepath, default_value, mutator)
         return True
     except Exception as e:
-        logger.error(f"Error al guardar datos en {filepath}: {e}")
+        logger.error(f"Error al actualizar datos en {filepath}: {e}")
         return False
 
+get_cache_stats = storage.get_cache_stats
+clear_cache = storage.clear_cache
+
+# Unidad de trabajo: dentro de 'with transaction():' cada archivo se lee como mucho una vez,
+# los cambios se acumulan y al final se escribe cada archivo modificado una sola vez
+# (o nada, si ocurre una excepción). Ver storage.transaction.
+transaction = storage.transaction
+
+# Operaciones sobre un solo registro (get/put/delete por clave) de cualquier archivo tipo
+# diccionario. Con STORAGE_BACKEND=sqlite tocan una sola fila en vez de todo el archivo.
+get_record = storage.get_record
+put_record = storage.put_record
+delete_record = storage.delete_record
+
 # --- Funciones Específicas de Carga y Guardado ---
 
 def load_users():
     return _load_data(USERS_FILE, default_value={})
 
 def save_users(users):
-    return _save_data(USERS_FILE, users)
+    """Reemplaza todos los usuarios y reconstruye el índice por email en la misma transacción."""
+    try:
+        with storage.transaction():
+            storage.save_json(USERS_FILE, users)
+            storage.save_json(USERS_BY_EMAIL_FILE, _build_email_index(users))
+            _replace_stats(_sum_stats(_user_stats, users))
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar los usuarios: {e}")
+        return False
 
 def load_products():
     return _load_data(PRODUCTS_FILE, default_value={})
 
 def save_products(products):
-    return _save_data(PRODUCTS_FILE, products)
+    try:
+        with storage.transaction():
+            storage.save_json(PRODUCTS_FILE, products)
+            bump_catalog_version()
+            _replace_stats(_sum_stats(_product_stats, products))
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar los productos: {e}")
+        return False
+
+def bump_catalog_version(product_id=None):
+    """Registra un cambio en el catálogo (product_id=None si cambió todo). Retorna la nueva versión."""
+    def _bump(meta):
+        meta['version'] = meta.get('version', 0) + 1
+        meta['updated_at'] = int(time.time())  # Para Last-Modified de las páginas del catálogo
+        changes = meta.setdefault('changes', [])
+        changes.append([meta['version'], None if product_id is None else str(product_id)])
+        del changes[:-CATALOG_CHANGES_KEPT]
+        return meta['version']
+
+    return storage.update_json(CATALOG_VERSION_FILE, {}, _bump)
+
+def get_catalog_version():
+    """Versión actual del catálogo (0 si nunca se ha modificado)."""
+    return storage.get_record(CATALOG_VERSION_FILE, 'version') or 0
+
+def get_catalog_state():
+    """Retorna (versión del catálogo, momento del último cambio en segundos epoch o None si no consta)."""
+    meta = storage.load_json(CATALOG_VERSION_FILE, {}, create=False)
+    return meta.get('version', 0), meta.get('updated_at')
+
+def get_catalog_changes(since_version):
+    """
+    Retorna (versión actual, ids de productos cambiados desde 'since_version'). Los ids son None
+    si hay que releer todo el catálogo: cambio global o historial insuficiente.
+    """
+    meta = storage.load_json(CATALOG_VERSION_FILE, {}, create=False)
+    version = meta.get('version', 0)
+    if version == since_version:
+        return version, []
+    changes = [c for c in meta.get('changes', []) if c[0] > since_version]
+    if version < since_version or len(changes) != version - since_version or any(pid is None for _, pid in changes):
+        return version, None
+    return version, list(dict.fromkeys(pid for _, pid in changes))
 
 def load_orders():
     return _load_data(ORDERS_FILE, default_value={})
 
 def save_orders(orders):
-    return _save_data(ORDERS_FILE, orders)
+    """Reemplaza todos los pedidos y reconstruye el índice por usuario en la misma transacción."""
+    try:
+        with storage.transaction():
+            storage.save_json(ORDERS_FILE, orders)
+            storage.save_json(ORDERS_BY_USER_FILE, _build_orders_by_user(orders))
+            _replace_stats(_sum_stats(_order_stats, orders))
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar los pedidos: {e}")
+        return False
 
 def load_notifications():
-    return _load_data(NOTIFICATIONS_FILE, default_value={})
+    """Devuelve {usuario: [notificaciones propias]} de todos los usuarios (sin las difusiones)."""
+    _ensure_notifications_migrated()
+    result = {}
+    for path in storage.list_json(NOTIFICATIONS_DIR):
+        notifications = _load_data(path, default_value=[])
+        if notifications:
+            result[_username_from_notifications_path(path)] = notifications
+    return result
 
 def save_notifications(notifications):
-    return _save_data(NOTIFICATIONS_FILE, notifications)
+    """Reemplaza las notificaciones de los usuarios indicados ({usuario: [notificaciones]})."""
+    _ensure_notifications()
+    try:
+        with storage.transaction():
+            for username, user_notifications in notifications.items():
+                storage.save_json(_notifications_path(username), user_notifications)
+                storage.put_record(UNREAD_COUNTS_FILE, username, _unread_count(username))
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar las notificaciones: {e}")
+        return False
 
 def load_payment_methods():
     return _load_data(PAYMENT_METHODS_FILE, default_value={})
@@ -104,8 +234,56 @@ def load_user_purchases():
     return _load_data(USER_PURCHASES_FILE, default_value=[])
 
 def save_user_purchases(user_purchases):
-    """Guarda el historial de compras de todos los usuarios como una lista."""
-    return _save_data(USER_PURCHASES_FILE, user_purchases)
+    """Guarda el historial de compras de todos los usuarios como una lista (y reconstruye su índice)."""
+    try:
+        with storage.transaction():
+            storage.save_json(USER_PURCHASES_FILE, user_purchases)
+            storage.save_json(PURCHASE_POSITIONS_FILE, _build_purchase_positions(user_purchases))
+        return True
+    except Exception as e:
+        logger.error(f"Error al guardar el historial de compras: {e}")
+        return False
+
+def _build_purchase_positions(purchases):
+    positions = {}
+    for pos, purchase in enumerate(purchases):
+        if isinstance(purchase, dict) and purchase.get('order_id'):
+            positions.setdefault(purchase['order_id'], pos)
+    return positions
+
+def _add_user_purchase(purchase):
+    with storage.transaction():
+        position = storage.append_item(USER_PURCHASES_FILE, purchase)
+        if purchase.get('order_id'):
+            storage.put_record(PURCHASE_POSITIONS_FILE, purchase['order_id'], position)
+
+def add_user_purchase(purchase):
+    """Añade una compra al final del historial de compras."""
+    _ensure_index(PURCHASE_POSITIONS_FILE, lambda: _build_purchase_positions(storage.load_json(USER_PURCHASES_FILE, [], create=False)))
+    return _safe_write(f"registrar la compra {purchase.get('order_id')}", _add_user_purchase, purchase)[0]
+
+def _remove_user_purchase(order_id):
+    with storage.transaction():
+        hint = storage.get_record(PURCHASE_POSITIONS_FILE, order_id)
+        shifted = {}
+
+        def _shift(pos, following):
+            # Solo se desplazan las compras posteriores; los pedidos cancelables son recientes
+            shifted.clear()
+            shifted.update((p.get('order_id'), i) for i, p in enumerate(following, start=pos) if p.get('order_id'))
+
+        # Si la posición es desconocida u obsoleta (p. ej. el archivo se editó a mano) se busca
+        removed = storage.remove_item(USER_PURCHASES_FILE, lambda p: p.get('order_id') == order_id, hint, _shift)
+        # Las posiciones son una pista: remove_item comprueba el elemento y, si no coincide, lo busca
+        storage.delete_record(PURCHASE_POSITIONS_FILE, order_id)
+        for shifted_id, position in shifted.items():
+            storage.put_record(PURCHASE_POSITIONS_FILE, shifted_id, position)
+        return removed is not None
+
+def remove_user_purchase(order_id):
+    """Elimina la compra de un pedido del historial usando el índice de posiciones. Retorna True si existía."""
+    _ensure_index(PURCHASE_POSITIONS_FILE, lambda: _build_purchase_positions(storage.load_json(USER_PURCHASES_FILE, [], create=False)))
+    return bool(_safe_write(f"eliminar la compra {order_id}", _remove_user_purchase, order_id)[1])
 
 def load_reports():
     return _load_data(REPORTS_FILE, default_value={})
@@ -113,24 +291,774 @@ def load_reports():
 def save_reports(reports):
     return _save_data(REPORTS_FILE, reports)
 
+# --- Accesores por Registro (Usuarios, Pedidos y Productos) ---
+# Leen o modifican un único registro en lugar de cargar y guardar el archivo completo.
+
+def _safe_write(description, operation, *args):
+    """Ejecuta una escritura de storage registrando el error; retorna (ok, resultado)."""
+    try:
+        return True, operation(*args)
+    except Exception as e:
+        logger.error(f"Error al {description}: {e}")
+        return False, None
+
+def normalize_email(email):
+    """Forma canónica de un email para comparaciones e índice (sin espacios y en minúsculas)."""
+    if not isinstance(email, str):
+        return None
+    return email.strip().lower() or None
+
+def _build_email_index(users):
+    index = {}
+    for username, user in users.items():
+        key = normalize_email((user or {}).get('email'))
+        if key:
+            index.setdefault(key, username)
+    return index
+
+_ready_indexes = set()
+
+def _ensure_index(index_file, build):
+    """
+    Crea un índice (o resumen) derivado con build() si todavía no existe; se comprueba una vez por proceso.
+    build() se ejecuta sin bloquear el índice (los escritores bloquean en orden de ruta y aquí el
+    orden sería el inverso) y solo se guarda si nadie lo creó entre medias. Las escrituras que usan
+    el índice llaman antes a esta función, así que ninguna puede quedar fuera de la primera copia.
+    Dentro de una transacción el índice solo cuenta como creado cuando esta se confirma: si se
+    descarta, la siguiente llamada lo vuelve a construir en vez de aplicar deltas a un archivo vacío.
+    """
+    if index_file in _ready_indexes:
+        return
+    if not storage.json_exists(index_file):
+        snapshot = build()
+
+        def _fill(index):
+            if storage.json_exists(index_file):
+                return storage.SKIP_WRITE
+            index.update(snapshot)
+
+        storage.update_json(index_file, {}, _fill)
+        logger.info(f"Índice creado en {index_file}.")
+    storage.after_commit(lambda: _ready_indexes.add(index_file))
+
+def _ensure_email_index():
+    _ensure_index(USERS_BY_EMAIL_FILE, lambda: _build_email_index(storage.load_json(USERS_FILE, {}, create=False)))
+
+def _reindex_user_email(username, old_user, new_user):
+    """Actualiza el índice por email tras escribir un usuario (se llama dentro de una transacción)."""
+    old_key = normalize_email((old_user or {}).get('email'))
+    new_key = normalize_email((new_user or {}).get('email'))
+    if old_key == new_key:
+        return
+    if old_key and storage.get_record(USERS_BY_EMAIL_FILE, old_key) == username:
+        storage.delete_record(USERS_BY_EMAIL_FILE, old_key)
+    if new_key:
+        storage.put_record(USERS_BY_EMAIL_FILE, new_key, username)
+
+def rebuild_email_index():
+    """Reconstruye el índice por email desde cero (p. ej. tras editar users.json a mano)."""
+    try:
+        with storage.transaction():
+            storage.save_json(USERS_BY_EMAIL_FILE, _build_email_index(storage.load_json(USERS_FILE, {}, create=False)))
+        return True
+    except Exception as e:
+        logger.error(f"Error al reconstruir el índice de emails: {e}")
+        return False
+
+def get_user(username):
+    """Retorna los datos de un usuario o None si no existe."""
+    if not username:
+        return None
+    return storage.get_record(USERS_FILE, username)
+
+def get_username_by_email(email):
+    """Retorna el nombre del usuario con ese email (sin distinguir mayúsculas) o None."""
+    key = normalize_email(email)
+    if not key:
+        return None
+    _ensure_email_index()
+    return storage.get_record(USERS_BY_EMAIL_FILE, key)
+
+def get_user_by_email(email):
+    """Retorna los datos del usuario con ese email o None. Descarta entradas obsoletas del índice."""
+    user = get_user(get_username_by_email(email))
+    if user and normalize_email(user.get('email')) == normalize_email(email):
+        return user
+    return None
+
+def email_in_use(email, exclude_username=None):
+    """True si otro usuario (distinto de 'exclude_username') ya usa ese email."""
+    user = get_user_by_email(email)
+    return user is not None and user.get('username') != exclude_username
+
+def _put_user(username, user):
+    with storage.transaction():
+        previous = storage.put_record(USERS_FILE, username, user)
+        _reindex_user_email(username, previous, user)
+        _apply_stats_delta(_user_stats(previous), _user_stats(user))
+        if previous is None or previous.get('role') != user.get('role'):
+            # Las difusiones que ve el usuario dependen de su rol y su fecha de registro
+            storage.put_record(UNREAD_COUNTS_FILE, username, _unread_count(username))
+
+def put_user(username, user):
+    """Crea o reemplaza un usuario (y su entrada en el índice por email)."""
+    _ensure_email_index()
+    _ensure_stats()
+    _ensure_notifications()
+    return _safe_write(f"guardar el usuario {username}", _put_user, username, user)[0]
+
+def _update_user(username, mutator):
+    with storage.transaction():
+        previous = storage.get_record(USERS_FILE, username)
+        if previous is None:
+            return None
+        user = storage.update_record(USERS_FILE, username, mutator)
+        _reindex_user_email(username, previous, user)
+        _apply_stats_delta(_user_stats(previous), _user_stats(user))
+        if previous.get('role') != user.get('role'):
+            storage.put_record(UNREAD_COUNTS_FILE, username, _unread_count(username))
+        return user
+
+def update_user_fields(username, **fields):
+    """Actualiza solo los campos indicados de un usuario. Retorna el usuario actualizado o None si no existe."""
+    if not username:
+        return None
+
+    def _update(user):
+        if user is None:
+            return storage.SKIP_WRITE
+        user.update(fields)
+        return user
+
+    if 'email' not in fields and 'role' not in fields:
+        return _safe_write(f"actualizar el usuario {username}", storage.update_record, USERS_FILE, username, _update)[1]
+    # Un cambio de email o de rol toca también el índice y las estadísticas: se escriben juntos
+    _ensure_email_index()
+    _ensure_stats()
+    _ensure_notifications()
+    return _safe_write(f"actualizar el usuario {username}", _update_user, username, _update)[1]
+
+def _delete_user(username):
+    with _notifications_guard(username):
+        removed = storage.delete_record(USERS_FILE, username)
+        _reindex_user_email(username, removed, None)
+        _apply_stats_delta(_user_stats(removed), {})
+        storage.delete_record(BROADCAST_MARKERS_FILE, username)
+        storage.delete_record(UNREAD_COUNTS_FILE, username)
+        if storage.json_exists(_notifications_path(username)):
+            storage.save_json(_notifications_path(username), [])
+        return removed
+
+def delete_user(username):
+    """Elimina un usuario (y su entrada en el índice por email). Retorna True si existía y se eliminó."""
+    _ensure_email_index()
+    _ensure_stats()
+    _ensure_notifications()
+    ok, removed = _safe_write(f"eliminar el usuario {username}", _delete_user, username)
+    return ok and removed is not None
+
+def get_order(order_id):
+    """Retorna un pedido o None si no existe."""
+    if not order_id:
+        return None
+    return storage.get_record(ORDERS_FILE, order_id)
+
+def _build_orders_by_user(orders):
+    index = {}
+    for order_id, order in orders.items():
+        if isinstance(order, dict) and order.get('username'):
+            index.setdefault(order['username'], []).append([order.get('order_date') or '', order_id])
+    for entries in index.values():
+        entries.sort()
+    return index
+
+def _ensure_orders_index():
+    _ensure_index(ORDERS_BY_USER_FILE, lambda: _build_orders_by_user(storage.load_json(ORDERS_FILE, {}, create=False)))
+
+def _reindex_user_order(order_id, old_order, new_order):
+    """Mueve el pedido entre las listas por usuario si cambió su dueño o su fecha."""
+    old_entry = (old_order['username'], [old_order.get('order_date') or '', order_id]) if old_order and old_order.get('username') else None
+    new_entry = (new_order['username'], [new_order.get('order_date') or '', order_id]) if new_order and new_order.get('username') else None
+    if old_entry == new_entry:
+        return
+    if old_entry:
+        def _remove(entries):
+            if not entries or old_entry[1] not in entries:
+                return storage.SKIP_WRITE
+            entries.remove(old_entry[1])
+            return entries
+
+        storage.update_record(ORDERS_BY_USER_FILE, old_entry[0], _remove)
+    if new_entry:
+        def _insert(entries):
+            entries = entries or []
+            if new_entry[1] in entries:
+                return storage.SKIP_WRITE
+            # Los pedidos nuevos son los más recientes: normalmente se añaden al final
+            bisect.insort(entries, new_entry[1])
+            return entries
+
+        storage.update_record(ORDERS_BY_USER_FILE, new_entry[0], _insert)
+
+def _put_order(order):
+    with storage.transaction():
+        previous = storage.put_record(ORDERS_FILE, order['order_id'], order)
+        _reindex_user_order(order['order_id'], previous, order)
+        _apply_stats_delta(_order_stats(previous), _order_stats(order))
+
+def put_order(order):
+    """Crea o reemplaza un pedido (la clave es order['order_id']) y actualiza el índice por usuario."""
+    _ensure_orders_index()
+    _ensure_stats()
+    return _safe_write(f"guardar el pedido {order.get('order_id')}", _put_order, order)[0]
+
+def _delete_order(order_id):
+    with storage.transaction():
+        removed = storage.delete_record(ORDERS_FILE, order_id)
+        _reindex_user_order(order_id, removed, None)
+        _apply_stats_delta(_order_stats(removed), {})
+        return removed
+
+def delete_order(order_id):
+    """Elimina un pedido (y su entrada en el índice por usuario). Retorna True si existía y se eliminó."""
+    _ensure_orders_index()
+    _ensure_stats()
+    ok, removed = _safe_write(f"eliminar el pedido {order_id}", _delete_order, order_id)
+    return ok and removed is not None
+
+def get_user_orders(username):
+    """Pedidos de un usuario, del más reciente al más antiguo, leídos a través del índice por usuario."""
+    if not username:
+        return []
+    _ensure_orders_index()
+    orders = []
+    for _, order_id in reversed(storage.get_record(ORDERS_BY_USER_FILE, username) or []):
+        order = get_order(order_id)
+        if order:
+            orders.append(order)
+    return orders
+
+def get_product(product_id):
+    """Retorna un producto o None si no existe. El ID puede ser int o str."""
+    if product_id is None:
+        return None
+    return storage.get_record(PRODUCTS_FILE, str(product_id))
+
+class ProductConflictError(Exception):
+    """El producto cambió desde que se leyó (su 'version' ya no es la esperada)."""
+
+class OutOfStockError(Exception):
+    """No hay stock disponible suficiente (descontando las reservas de otros usuarios)."""
+
+    def __init__(self, product_id, available):
+        super().__init__(f"Stock insuficiente para el producto {product_id} (disponible: {available})")
+        self.product_id = str(product_id)
+        self.available = available
+
+def _put_product(product, expected_version, create):
+    def _replace(current):
+        # Se vuelve a comprobar al confirmar, sobre el contenido actual: compare-and-swap por producto
+        if create and current is not None:
+            raise ProductConflictError(f"Ya existe un producto con el ID {product['id']}")
+        if expected_version is not None and (current or {}).get('version', 0) != expected_version:
+            raise ProductConflictError(f"El producto {product['id']} cambió mientras se editaba")
+        return dict(product, version=(current or {}).get('version', 0) + 1)
+
+    with storage.transaction():
+        previous = storage.get_record(PRODUCTS_FILE, str(product['id']))
+        saved = storage.update_record(PRODUCTS_FILE, str(product['id']), _replace)
+        bump_catalog_version(product['id'])
+        _apply_stats_delta(_product_stats(previous), _product_stats(saved))
+
+def put_product(product, expected_version=None, create=False):
+    """
+    Crea o reemplaza un producto (la clave es str(product['id'])) y sube su 'version'.
+    Con 'expected_version' solo se guarda si nadie lo modificó desde que se leyó con esa
+    versión, y con create=True solo si el ID no existe; si no, lanza ProductConflictError.
+    Retorna True si se guardó.
+    """
+    _ensure_stats()
+    try:
+        _put_product(product, expected_version, create)
+        return True
+    except ProductConflictError:
+        raise
+    except Exception as e:
+        logger.error(f"Error al guardar el producto {product.get('id')}: {e}")
+        return False
+
+def allocate_product_id():
+    """
+    Reserva y retorna un ID de producto nuevo (entero). La primera vez parte del mayor ID
+    numérico del catálogo; después solo se lee y escribe el contador. Fuera de transacciones:
+    el ID queda reservado aunque el alta que lo usa falle después.
+    """
+    def _next(counter):
+        if 'next' not in counter:
+            ids = [int(key) for key, _ in storage.iter_records(PRODUCTS_FILE) if str(key).isdigit()]
+            counter['next'] = max(ids, default=0) + 1
+        product_id = counter['next']
+        counter['next'] += 1
+        return product_id
+
+    return storage.update_json(PRODUCT_IDS_FILE, {}, _next)
+
+def _delete_product(product_id):
+    with storage.transaction():
+        removed = storage.delete_record(PRODUCTS_FILE, str(product_id))
+        if removed is not None:
+            bump_catalog_version(product_id)
+            _apply_stats_delta(_product_stats(removed), {})
+        return removed
+
+def delete_product(product_id):
+    """Elimina un producto. Retorna True si existía y se eliminó."""
+    _ensure_stats()
+    ok, removed = _safe_write(f"eliminar el producto {product_id}", _delete_product, product_id)
+    return ok and removed is not None
+
+def adjust_product_stock(product_id, delta):
+    """Suma 'delta' (negativo para descontar) al stock de un producto. Retorna el producto actualizado o None."""
+    def _adjust(product):
+        if product is None:
+            return storage.SKIP_WRITE
+        product['stock'] = product.get('stock', 0) + delta
+        product['version'] = product.get('version', 0) + 1
+        return product
+
+    def _adjust_and_bump():
+        with storage.transaction():
+            product = storage.update_record(PRODUCTS_FILE, str(product_id), _adjust)
+            if product is not None:
+                bump_catalog_version(product_id)
+            return product
+
+    return _safe_write(f"actualizar el stock del producto {product_id}", _adjust_and_bump)[1]
+
+# --- Reservas de stock y compra ---
+# El stock disponible de un producto es su 'stock' menos las reservas vigentes de otros
+# usuarios. Reservar y comprar son lecturas-modificaciones de un solo registro que se
+# vuelven a comprobar al confirmar la transacción (sobre el contenido actual, con los
+# archivos bloqueados), así que dos compradores del mismo producto nunca venden de más y
+# los de productos distintos no se esperan más que lo que dura la escritura.
+
+def _live_reservations(entries, now):
+    return {username: r for username, r in (entries or {}).items() if r.get('expires', 0) > now}
+
+def _reserved_by_others(product_id, username, now):
+    entries = _live_reservations(storage.get_record(RESERVATIONS_FILE, str(product_id)), now)
+    return sum(r.get('quantity', 0) for user, r in entries.items() if user != username)
+
+def _available_stock(product_id, username, now):
+    product = storage.get_record(PRODUCTS_FILE, str(product_id))
+    if product is None:
+        return 0
+    return product.get('stock', 0) - _reserved_by_others(product_id, username, now)
+
+def available_stock(product_id, username=None):
+    """Unidades que 'username' puede comprar ahora: el stock menos las reservas vigentes de los demás."""
+    return max(_available_stock(product_id, username, time.time()), 0)
+
+def reserve_stock(username, quantities):
+    """
+    Reserva durante RESERVATION_SECONDS las cantidades {product_id: cantidad} para 'username'
+    (al abrir el checkout). Es todo o nada: si algún producto no tiene stock disponible lanza
+    OutOfStockError y no se reserva ninguno. Retorna la hora de caducidad (epoch).
+    """
+    now = time.time()
+    expires = now + RESERVATION_SECONDS
+
+    def _reserve(product_id, quantity):
+        def _mutate(entries):
+            available = _available_stock(product_id, username, now)
+            if available < quantity:
+                raise OutOfStockError(product_id, max(available, 0))
+            entries = _live_reservations(entries, now)
+            entries[username] = {'quantity': quantity, 'expires': expires}
+            return entries
+        return _mutate
+
+    # El stock no se modifica aquí: el bloqueo compartido de products.json impide que una
+    # compra lo cambie entre la comprobación y la confirmación (con JSON; SQLite ya lo garantiza).
+    with storage.shared_access(PRODUCTS_FILE), storage.transaction():
+        for product_id, quantity in quantities.items():
+            storage.update_record(RESERVATIONS_FILE, str(product_id), _reserve(product_id, quantity))
+    return expires
+
+def purchase_stock(username, product_id, quantity):
+    """
+    Descuenta 'quantity' del stock de un producto para una compra de 'username' y libera su
+    reserva. Lanza OutOfStockError si el stock menos las reservas de otros no alcanza; la
+    comprobación se repite al confirmar, de modo que dentro de una transacción (checkout)
+    un fallo deshace el pedido completo. La versión del catálogo solo sube si la venta agota
+    el producto. Retorna el producto actualizado.
+    """
+    now = time.time()
+    sold_out = []  # Lo anota la última ejecución de _decrement (la de la confirmación)
+
+    def _decrement(product):
+        if product is None:
+            raise OutOfStockError(product_id, 0)
+        available = product.get('stock', 0) - _reserved_by_others(product_id, username, now)
+        if available < quantity:
+            raise OutOfStockError(product_id, max(available, 0))
+        product['stock'] = product.get('stock', 0) - quantity
+        product['version'] = product.get('version', 0) + 1
+        sold_out[:] = [product['stock'] <= 0]
+        return product
+
+    def _bump_if_sold_out():
+        # Las páginas del catálogo solo muestran si hay stock, no cuántas unidades: una venta
+        # cambia lo que se ve (y vacía sus cachés) únicamente cuando agota el producto
+        if sold_out and sold_out[0]:
+            bump_catalog_version(product_id)
+
+    def _release(entries):
+        live = _live_reservations(entries, now)
+        live.pop(username, None)
+        if live == (entries or {}):
+            return storage.SKIP_WRITE
+        return live or None
+
+    with storage.transaction():
+        product = storage.update_record(PRODUCTS_FILE, str(product_id), _decrement)
+        storage.update_record(RESERVATIONS_FILE, str(product_id), _release)
+        storage.after_commit(_bump_if_sold_out)
+        return product
+
+# --- Estadísticas del Panel de Administración ---
+# Cada escritura de usuarios, productos y pedidos suma a los contadores la diferencia entre
+# la aportación del registro nuevo y la del anterior, en la misma transacción que el registro.
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _user_stats(user):
+    if user is None:
+        return {}
+    return {'users': 1, 'admins': 1 if user.get('role') == 'admin' else 0}
+
+def _product_stats(product):
+    if product is None:
+        return {}
+    return {
+        'products': 1,
+        'active_products': 1 if product.get('is_active', False) else 0,
+        'price_sum': _number(product.get('price')),
+    }
+
+def _order_stats(order):
+    if order is None:
+        return {}
+    status = order.get('status')
+    return {
+        'orders': 1,
+        'pending_orders': 1 if status == 'pending' else 0,
+        'completed_orders': 1 if status == 'completed' else 0,
+        'revenue': _number(order.get('total_price')) if status == 'completed' else 0,
+    }
+
+def _sum_stats(contribution, records):
+    totals = {}
+    for record in records.values():
+        for key, value in contribution(record).items():
+            totals[key] = totals.get(key, 0) + value
+    # Si no hay registros los contadores quedan en 0 (no se omiten)
+    for key in contribution({}):
+        totals.setdefault(key, 0)
+    return totals
+
+def _round_stat(value):
+    return round(value, 2) if isinstance(value, float) else value
+
+def _apply_stats_delta(old, new):
+    delta = {key: new.get(key, 0) - old.get(key, 0) for key in set(old) | set(new)}
+    delta = {key: value for key, value in delta.items() if value}
+    if not delta:
+        return
+
+    def _add(stats):
+        for key, value in delta.items():
+            stats[key] = _round_stat(stats.get(key, 0) + value)
+
+    storage.update_json(STATS_FILE, {}, _add)
+
+def _replace_stats(values):
+    def _set(stats):
+        stats.update({key: _round_stat(value) for key, value in values.items()})
+
+    storage.update_json(STATS_FILE, {}, _set)
+
+def _record_recent_notification(notification):
+    def _push(stats):
+        recent = stats.setdefault('recent_notifications', [])
+        recent.append(notification)
+        del recent[:-RECENT_NOTIFICATIONS_KEPT]
+
+    storage.update_json(STATS_FILE, {}, _push)
+
+def _build_stats():
+    """Calcula las estadísticas desde cero recorriendo todos los datos."""
+    stats = {}
+    stats.update(_sum_stats(_user_stats, storage.load_json(USERS_FILE, {}, create=False)))
+    stats.update(_sum_stats(_product_stats, storage.load_json(PRODUCTS_FILE, {}, create=False)))
+    stats.update(_sum_stats(_order_stats, storage.load_json(ORDERS_FILE, {}, create=False)))
+    recent = []
+    for username, notifications in load_notifications().items():
+        if isinstance(notifications, list):
+            recent.extend(dict(n, username=username) for n in notifications if isinstance(n, dict))
+    recent.extend(dict(b, username='*') for b in storage.load_json(BROADCASTS_FILE, {}, create=False).values()
+                  if isinstance(b, dict))
+    recent.sort(key=lambda n: n.get('timestamp', ''))
+    stats['recent_notifications'] = recent[-RECENT_NOTIFICATIONS_KEPT:]
+    return {key: _round_stat(value) for key, value in stats.items()}
+
+def _ensure_stats():
+    _ensure_index(STATS_FILE, _build_stats)
+
+def rebuild_stats():
+    """Recalcula las estadísticas desde cero (recuperación: 'flask rebuild-stats'). Retorna las estadísticas."""
+    stats = _build_stats()
+    storage.save_json(STATS_FILE, stats)
+    return stats
+
+def get_stats():
+    """Retorna las estadísticas del panel (contadores y últimas notificaciones) sin recorrer los datos."""
+    _ensure_stats()
+    return storage.load_json(STATS_FILE, {}, create=False)
+
 # --- Funciones de Utilidad (Notificaciones y Carrito) ---
 
+# Cada usuario tiene su archivo de notificaciones propias y un contador de no leídas en
+# UNREAD_COUNTS_FILE: el contador que consultan las páginas (get_unread_notifications_count)
+# se responde sin leer ninguna notificación, y marcar como leídas solo escribe si algo cambia.
+
+_notifications_migration_lock = threading.Lock()
+_notifications_migrated = False
+
+def _notifications_path(username):
+    """Archivo de notificaciones de un usuario; el nombre se codifica como en los logs del chat."""
+    name = quote(username, safe='')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return os.path.join(NOTIFICATIONS_DIR, name + '.json')
+
+def _username_from_notifications_path(path):
+    return unquote(os.path.basename(path)[:-len('.json')])
+
+def _ensure_notifications_migrated():
+    """Pasa las notificaciones de notifications.json a los archivos por usuario (una vez por proceso)."""
+    global _notifications_migrated
+    if _notifications_migrated:
+        return
+    with _notifications_migration_lock:
+        if _notifications_migrated:
+            return
+        with storage.file_lock(NOTIFICATIONS_FILE, exclusive=True):
+            legacy = storage.load_json(NOTIFICATIONS_FILE, {}, create=False)
+            pending = {u: n for u, n in legacy.items() if not u.startswith('_') and isinstance(n, list)}
+            for username, notifications in pending.items():
+                path = _notifications_path(username)
+                # Si el archivo ya existe, este usuario se migró en una ejecución anterior
+                if not storage.json_exists(path) and not storage.save_json(path, notifications):
+                    return  # Se reintenta en la siguiente llamada; notifications.json sigue intacto
+            if pending:
+                storage.save_json(NOTIFICATIONS_FILE, {u: v for u, v in legacy.items() if u not in pending})
+        _notifications_migrated = True
+
+def _unread_count(username):
+    """Cuenta las no leídas de un usuario recorriendo sus notificaciones (reconstrucción del contador)."""
+    personal = storage.load_json(_notifications_path(username), [], create=False)
+    return (sum(1 for n in personal if not n.get('read', False))
+            + sum(1 for n in _broadcasts_for(username) if not n['read']))
+
+def _build_unread_counts():
+    usernames = set(load_users()) | set(load_notifications())
+    counts = {username: _unread_count(username) for username in sorted(usernames)}
+    return {username: count for username, count in counts.items() if count}
+
+def _ensure_notifications():
+    _ensure_notifications_migrated()
+    _ensure_index(UNREAD_COUNTS_FILE, _build_unread_counts)
+
+def rebuild_unread_counts():
+    """Recalcula los contadores de no leídas desde cero (p. ej. tras editar los archivos a mano)."""
+    _ensure_notifications_migrated()
+    return storage.save_json(UNREAD_COUNTS_FILE, _build_unread_counts())
+
+@contextmanager
+def _notifications_guard(username):
+    """
+    Transacción sobre las notificaciones de un usuario con su archivo bloqueado desde antes de
+    leerlo, así el cambio del contador se calcula sobre datos que ningún otro proceso está
+    modificando. No hay interbloqueos: al confirmar, los archivos se bloquean en orden de ruta
+    y UNREAD_COUNTS_FILE va después de NOTIFICATIONS_DIR.
+    """
+    with storage.exclusive_access(_notifications_path(username)), storage.transaction():
+        yield
+
+def _add_unread(username, delta):
+    if delta:
+        storage.update_record(UNREAD_COUNTS_FILE, username, lambda count: max((count or 0) + delta, 0))
+
 def add_notification(username, message, notif_type='info', title=None):
     """Añade una notificación para un usuario específico."""
-    notifications = load_notifications()
-    if username not in notifications:
-        notifications[username] = []
-    new_notification = {
+    # Tipos: 'info', 'success', 'warning', 'error', 'actualizacion', 'registro'
+    new_notification = _new_notification(message, notif_type, title)
+
+    def _add():
+        with _notifications_guard(username):
+            storage.append_item(_notifications_path(username), new_notification)
+            _add_unread(username, 1)
+            _record_recent_notification(dict(new_notification, username=username))
+
+    _ensure_notifications()
+    _ensure_stats()
+    return _safe_write(f"añadir la notificación para {username}", _add)[0]
+
+def _new_notification(message, notif_type, title):
+    notification = {
         'id': str(secrets.token_hex(4)),
         'message': message,
-        'type': notif_type, # 'info', 'success', 'warning', 'error', 'actualizacion', 'registro'
+        'type': notif_type,
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         'read': False
     }
     if title:
-        new_notification['title'] = title
-    notifications[username].append(new_notification)
-    return save_notifications(notifications)
+        notification['title'] = title
+    return notification
+
+def add_broadcast(message, notif_type='info', title=None):
+    """
+    Envía una notificación a todos los usuarios (no administradores) que aceptan notificaciones.
+    Se guarda una sola vez; los usuarios que no aceptaban notificaciones en este momento quedan
+    excluidos, y los que se registren después no la verán. Retorna el id o None si falla.
+    """
+    broadcast = _new_notification(message, notif_type, title)
+    broadcast.pop('read')
+    broadcast['broadcast'] = True
+    # Una sola lectura de los usuarios para fijar la audiencia (la opción puede cambiar después)
+    recipients, excluded = [], []
+    for username, user in load_users().items():
+        if user.get('role') != 'admin':
+            (recipients if user.get('notifications_enabled', True) else excluded).append(username)
+    broadcast['excluded'] = sorted(excluded)
+
+    def _count(counts):
+        for username in recipients:
+            counts[username] = counts.get(username, 0) + 1
+
+    def _add():
+        with storage.transaction():
+            storage.put_record(BROADCASTS_FILE, broadcast['id'], broadcast)
+            if recipients:
+                storage.update_json(UNREAD_COUNTS_FILE, {}, _count)
+            _record_recent_notification(dict(broadcast, username='*'))
+
+    _ensure_notifications()
+    _ensure_stats()
+    ok = _safe_write("enviar la notificación a todos los usuarios", _add)[0]
+    return broadcast['id'] if ok else None
+
+def _broadcasts_for(username):
+    """Difusiones dirigidas a 'username', como notificaciones con su marca de leída (sin las descartadas)."""
+    user = get_user(username)
+    if not user or user.get('role') == 'admin':
+        return []
+    broadcasts = storage.load_json(BROADCASTS_FILE, {}, create=False)
+    if not broadcasts:
+        return []
+    markers = storage.get_record(BROADCAST_MARKERS_FILE, username) or {}
+    read, dismissed = set(markers.get('read', [])), set(markers.get('dismissed', []))
+    registered = user.get('registration_date') or ''
+    result = []
+    for broadcast in broadcasts.values():
+        if broadcast['id'] in dismissed or username in broadcast.get('excluded', ()):
+            continue
+        if registered and registered > broadcast.get('timestamp', ''):
+            continue
+        notification = {k: v for k, v in broadcast.items() if k != 'excluded'}
+        notification['read'] = broadcast['id'] in read
+        result.append(notification)
+    return result
+
+def get_user_notifications(username):
+    """Notificaciones propias del usuario más las difusiones que le corresponden."""
+    if not username:
+        return []
+    _ensure_notifications_migrated()
+    personal = storage.load_json(_notifications_path(username), [], create=False)
+    return personal + _broadcasts_for(username)
+
+def count_unread_notifications(username):
+    """Número de notificaciones sin leer, leído del contador (sin cargar las notificaciones)."""
+    if not username:
+        return 0
+    _ensure_notifications()
+    return storage.get_record(UNREAD_COUNTS_FILE, username) or 0
+
+def _mark_broadcasts(username, key, broadcast_ids):
+    def _mark(markers):
+        markers = markers or {}
+        known = set(markers.get(key, []))
+        new_ids = [bid for bid in broadcast_ids if bid not in known]
+        if not new_ids:
+            return storage.SKIP_WRITE
+        markers[key] = markers.get(key, []) + new_ids
+        return markers
+
+    storage.update_record(BROADCAST_MARKERS_FILE, username, _mark)
+
+def mark_notifications_read(username, notification_id=None):
+    """
+    Marca como leídas las notificaciones del usuario (todas, o solo 'notification_id').
+    Solo escribe si había algo sin leer. Retorna True si la notificación existía.
+    """
+    found = {'personal': False}
+
+    def _mark(notifications):
+        marked = 0
+        for notif in notifications:
+            if notification_id is None or notif.get('id') == notification_id:
+                found['personal'] = True
+                if not notif.get('read', False):
+                    notif['read'] = True
+                    marked += 1
+        return marked or storage.SKIP_WRITE
+
+    def _apply():
+        with _notifications_guard(username):
+            marked = storage.update_json(_notifications_path(username), [], _mark) or 0
+            broadcasts = [n for n in _broadcasts_for(username) if notification_id is None or n['id'] == notification_id]
+            unread_broadcasts = [n['id'] for n in broadcasts if not n['read']]
+            if unread_broadcasts:
+                _mark_broadcasts(username, 'read', unread_broadcasts)
+            _add_unread(username, -(marked + len(unread_broadcasts)))
+            return bool(broadcasts)
+
+    _ensure_notifications()
+    ok, found_broadcast = _safe_write(f"marcar notificaciones de {username}", _apply)
+    return ok and (notification_id is None or found['personal'] or found_broadcast)
+
+def dismiss_notification(username, notification_id):
+    """Elimina una notificación propia o descarta una difusión para este usuario. Retorna True si existía."""
+    def _apply():
+        with _notifications_guard(username):
+            broadcast = next((n for n in _broadcasts_for(username) if n['id'] == notification_id), None)
+            if broadcast is not None:
+                _mark_broadcasts(username, 'dismissed', [notification_id])
+                removed = broadcast
+            else:
+                removed = storage.remove_item(_notifications_path(username), lambda n: n.get('id') == notification_id)
+            if removed is not None and not removed.get('read', False):
+                _add_unread(username, -1)
+            return removed is not None
+
+    _ensure_notifications()
+    return bool(_safe_write(f"eliminar la notificación {notification_id}", _apply)[1])
 
 def get_cart(username=None):
     """
@@ -150,11 +1078,11 @@ def add_to_cart(product_id, quantity=1, username=None):
     from flask import session # Importar aquí para evitar importación circular
 
     if username:
-        user_carts = load_user_carts()
-        cart = user_carts.get(username, {})
-        cart[product_id] = cart.get(product_id, 0) + quantity
-        user_carts[username] = cart
-        return save_user_carts(user_carts)
+        def _add(user_carts):
+            cart = user_carts.setdefault(username, {})
+            cart[product_id] = cart.get(product_id, 0) + quantity
+
+        return _update_data(USER_CARTS_FILE, {}, _add)
     else:
         cart = session.get('cart', {})
         cart[product_id] = cart.get(product_id, 0) + quantity
@@ -166,12 +1094,11 @@ def remove_from_cart(product_id, username=None):
     from flask import session # Importar aquí para evitar importación circular
 
     if username:
-        user_carts = load_user_carts()
-        cart = user_carts.get(username, {})
-        if product_id in cart:
-            del cart[product_id]
-        user_carts[username] = cart
-        return save_user_carts(user_carts)
+        def _remove(user_carts):
+            cart = user_carts.setdefault(username, {})
+            cart.pop(product_id, None)
+
+        return _update_data(USER_CARTS_FILE, {}, _remove)
     else:
         cart = session.get('cart', {})
         if product_id in cart:
@@ -192,11 +1119,10 @@ def update_cart_quantity(product_id, new_quantity, username=None):
         return remove_from_cart(product_id, username)
     
     if username:
-        user_carts = load_user_carts()
-        cart = user_carts.get(username, {})
-        cart[product_id] = new_quantity
-        user_carts[username] = cart
-        return save_user_carts(user_carts)
+        def _set_quantity(user_carts):
+            user_carts.setdefault(username, {})[product_id] = new_quantity
+
+        return _update_data(USER_CARTS_FILE, {}, _set_quantity)
     else:
         cart = session.get('cart', {})
         cart[product_id] = new_quantity
@@ -207,8 +1133,9 @@ def clear_user_persistent_cart(username):
     """Limpia el carrito persistente de un usuario."""
     if not username:
         return False
-    user_carts = load_user_carts()
-    if username in user_carts:
+    def _clear(user_carts):
+        if username not in user_carts:
+            return storage.SKIP_WRITE
         user_carts[username] = {} # Establece el carrito del usuario como vacío
-        return save_user_carts(user_carts)
-    return True # Considerar exitoso si no había carrito para el usuario
\ No newline at end of file
+
+    return _update_data(USER_CARTS_FILE, {}, _clear) # Considerar exitoso si no había carrito para el usuario
\ No newline at end of file
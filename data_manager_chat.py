@@ -1,52 +1,330 @@
 import os
 import json
+import logging
+import secrets
+import threading
+import time
 from datetime import datetime
+from urllib.parse import quote, unquote
 
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Archivo antiguo: un único JSON {usuario: [mensajes]} que se reescribía entero en cada mensaje.
+# Se migra automáticamente a CHAT_DIR y después solo conserva las claves de ejemplo ('_...').
 CHAT_FILE = os.path.join('data', 'chat_messages.json')
 
+# Un log de solo-anexado (JSON Lines) por usuario: enviar un mensaje es una sola escritura al final.
+CHAT_DIR = os.path.join('data', 'chat')
+
+# Resumen de cada conversación, mantenido en cada mensaje para que las páginas de chats del
+# administrador no lean los logs: {usuario: {'last_text', 'last_from', 'last_timestamp',
+# 'count', 'unread_admin', 'order_ids'}}.
+CHAT_SUMMARIES_FILE = os.path.join('data', 'chat_summaries.json')
+PREVIEW_LENGTH = 80
+
+# Las páginas de chat muestran los últimos CHAT_PAGE_SIZE mensajes y cargan los anteriores a
+# petición; el historial de pedidos muestra los últimos ORDER_CHAT_LIMIT de cada pedido.
+CHAT_PAGE_SIZE = 50
+ORDER_CHAT_LIMIT = 10
+
+# Entrega incremental: quien espera mensajes nuevos se bloquea en _changes (sin gastar CPU)
+# hasta que add_chat_message confirma uno en este proceso; los de otros procesos se detectan
+# comprobando el resumen de la conversación cada CHANGE_POLL_SECONDS.
+CHANGE_POLL_SECONDS = 2
+_changes = threading.Condition()
+_change_counter = 0
+
+_migration_lock = threading.Lock()
+_migrated = False
+_summaries_ready = False
+
+def _chat_log_path(username):
+    """Ruta del log de un usuario; el nombre se codifica para que sea seguro como nombre de archivo."""
+    name = quote(username, safe='')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    return os.path.join(CHAT_DIR, name + '.jsonl')
+
+def _username_from_path(path):
+    return unquote(os.path.basename(path)[:-len('.jsonl')])
+
+def _ensure_migrated():
+    """Pasa los chats del archivo antiguo a los logs por usuario (una vez por proceso)."""
+    global _migrated
+    if _migrated:
+        return
+    with _migration_lock:
+        if _migrated:
+            return
+        with storage.file_lock(CHAT_FILE, exclusive=True):
+            legacy = storage.load_json(CHAT_FILE, {}, create=False)
+            pending = {u: msgs for u, msgs in legacy.items() if not u.startswith('_') and isinstance(msgs, list)}
+            for username, msgs in pending.items():
+                path = _chat_log_path(username)
+                # Si el log ya existe, la migración de este usuario se completó en una ejecución anterior
+                if not storage.log_exists(path):
+                    storage.rewrite_log(path, msgs)
+            if pending:
+                storage.save_json(CHAT_FILE, {u: v for u, v in legacy.items() if u not in pending},
+                                  indent=2, ensure_ascii=False)
+        _migrated = True
+
+def _preview(msg):
+    text = (msg.get('text') or '').strip()
+    if not text:
+        return '[Imagen]' if msg.get('image_url') else ''
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 1] + '…'
+
+def _add_to_summary(summary, msg):
+    summary = summary or {'count': 0, 'unread_admin': 0, 'order_ids': []}
+    summary['count'] += 1
+    summary['last_text'] = _preview(msg)
+    summary['last_from'] = msg.get('from')
+    summary['last_timestamp'] = msg.get('timestamp', '')
+    if msg.get('from') == 'admin':
+        summary['unread_admin'] = 0  # Si el administrador responde, ya leyó la conversación
+    elif msg.get('from') == 'user':
+        summary['unread_admin'] += 1
+    order_id = msg.get('order_id')
+    if order_id and order_id not in summary['order_ids']:
+        summary['order_ids'].append(order_id)
+    return summary
+
+def _summarize(msgs):
+    """Resumen de una conversación completa (reconstrucción); None si no tiene mensajes."""
+    summary = None
+    for msg in msgs:
+        summary = _add_to_summary(summary, msg)
+    return summary
+
+def _put_summary(username, msgs):
+    summary = _summarize(msgs)
+    if summary is None:
+        storage.delete_record(CHAT_SUMMARIES_FILE, username)
+    else:
+        storage.put_record(CHAT_SUMMARIES_FILE, username, summary)
+
+def _build_summaries():
+    summaries = {}
+    for path in storage.list_logs(CHAT_DIR):
+        summary = _summarize(storage.read_log(path))
+        if summary is not None:
+            summaries[_username_from_path(path)] = summary
+    return summaries
+
+def _mark_summaries_ready():
+    global _summaries_ready
+    _summaries_ready = True
+
+def _ensure_summaries():
+    """
+    Crea los resúmenes a partir de los logs si todavía no existen (se comprueba una vez por proceso).
+    Dentro de una transacción solo cuentan como creados cuando esta se confirma.
+    """
+    if _summaries_ready:
+        return
+    _ensure_migrated()
+    if not storage.json_exists(CHAT_SUMMARIES_FILE):
+        snapshot = _build_summaries()
+
+        def _fill(summaries):
+            if storage.json_exists(CHAT_SUMMARIES_FILE):
+                return storage.SKIP_WRITE
+            summaries.update(snapshot)
+
+        storage.update_json(CHAT_SUMMARIES_FILE, {}, _fill, ensure_ascii=False)
+    storage.after_commit(_mark_summaries_ready)
+
+def rebuild_chat_summaries():
+    """Recalcula los resúmenes desde los logs (los no leídos cuentan desde la última respuesta del administrador)."""
+    _ensure_migrated()
+    return storage.save_json(CHAT_SUMMARIES_FILE, _build_summaries(), ensure_ascii=False)
+
+def get_chat_summaries():
+    """Resúmenes de todas las conversaciones ordenados por actividad (la más reciente primero)."""
+    _ensure_summaries()
+    summaries = storage.load_json(CHAT_SUMMARIES_FILE, {}, create=False)
+    ordered = sorted(summaries.items(), key=lambda item: item[1].get('last_timestamp', ''), reverse=True)
+    return [dict(summary, username=username) for username, summary in ordered]
+
+def mark_chat_read_by_admin(username):
+    """Pone a cero los mensajes sin leer del administrador en la conversación (solo escribe si había)."""
+    _ensure_summaries()
+
+    def _mark(summary):
+        if not summary or not summary.get('unread_admin'):
+            return storage.SKIP_WRITE
+        summary['unread_admin'] = 0
+        return summary
+
+    storage.update_record(CHAT_SUMMARIES_FILE, username, _mark, ensure_ascii=False)
+
 def load_chat_messages():
-    if not os.path.exists(CHAT_FILE):
-        return {}
-    with open(CHAT_FILE, 'r', encoding='utf-8') as f:
-        try:
-            return json.load(f)
-        except Exception:
-            return {}
+    """Devuelve {usuario: [mensajes]} con todos los chats (compatibilidad con la estructura anterior)."""
+    _ensure_migrated()
+    return {_username_from_path(path): storage.read_log(path) for path in storage.list_logs(CHAT_DIR)}
 
 def save_chat_messages(messages):
-    with open(CHAT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(messages, f, indent=2, ensure_ascii=False)
+    """Reemplaza los chats de los usuarios indicados en 'messages' ({usuario: [mensajes]})."""
+    _ensure_summaries()
+    for username, msgs in messages.items():
+        if username.startswith('_'):
+            continue
+        storage.rewrite_log(_chat_log_path(username), msgs)
+        _put_summary(username, msgs)
 
-def add_chat_message(username, sender, text, image_url=None, order_id=None):
-    messages = load_chat_messages()
-    if username not in messages:
-        messages[username] = []
+def add_chat_message(username, sender, text, image_url=None, order_id=None, thumb_url=None):
+    _ensure_summaries()
     msg = {
+        'id': secrets.token_hex(8),
         'from': sender,
         'text': text,
         'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     if image_url:
         msg['image_url'] = image_url
+        if thumb_url:
+            msg['thumb_url'] = thumb_url  # Miniatura para mostrar; image_url es el original
     if order_id:
         msg['order_id'] = order_id
-    messages[username].append(msg)
-    save_chat_messages(messages)
+    # El mensaje y el resumen se confirman juntos (dentro de la transacción del llamador, si la hay)
+    with storage.transaction():
+        storage.append_log(_chat_log_path(username), msg)
+        storage.update_record(CHAT_SUMMARIES_FILE, username, lambda summary: _add_to_summary(summary, msg),
+                              ensure_ascii=False)
+        storage.after_commit(_notify_change)
+        storage.after_commit(lambda: _compact_if_needed(username))
     return True
 
+def _compact_if_needed(username):
+    """Compacta el log si tiene líneas ilegibles; se llama al escribir, nunca desde las lecturas."""
+    if storage.log_needs_compaction(_chat_log_path(username)):
+        try:
+            compact_user_chat(username)
+        except Exception as e:
+            logger.error(f"Error al compactar el chat de {username}: {e}")
+
+# --- Entrega incremental de mensajes ---
+
+def _notify_change():
+    global _change_counter
+    with _changes:
+        _change_counter += 1
+        _changes.notify_all()
+
+def chat_cursor(msgs):
+    """Cursor que corresponde a haber visto 'msgs': el id del último mensaje ('' si no tiene)."""
+    return msgs[-1].get('id', '') if msgs else ''
+
+def _cursor_position(msgs, after):
+    """
+    Posición siguiente al mensaje del cursor, o None si no está en 'msgs'. Los mensajes
+    anteriores a los ids no tienen cursor propio: con after='' se entregan los que siguen al
+    último mensaje sin id (todos los nuevos lo tienen).
+    """
+    for i in range(len(msgs) - 1, -1, -1):
+        msg_id = msgs[i].get('id')
+        if (msg_id == after) if after else not msg_id:
+            return i + 1
+    return None
+
+def get_chat_messages_after(username, after=''):
+    """
+    Mensajes de un usuario posteriores al cursor 'after'. Lee el log desde el final y solo
+    amplía la lectura si el cursor no está entre los últimos mensajes. Retorna (mensajes, reset):
+    reset es True si el cursor ya no existe (p. ej. se compactó) y hay que recargar el chat entero.
+    """
+    _ensure_migrated()
+    path = _chat_log_path(username)
+    limit = 32
+    while True:
+        msgs = storage.read_log(path, tail=limit)
+        start = _cursor_position(msgs, after)
+        if start is not None:
+            return msgs[start:], False
+        if len(msgs) < limit:
+            return msgs, bool(after)
+        limit *= 8
+
+def wait_for_chat_messages(username, after='', timeout=0):
+    """
+    Como get_chat_messages_after, pero si no hay mensajes nuevos espera hasta 'timeout'
+    segundos a que llegue alguno (long-poll). Retorna ([], False) si no llega ninguno.
+    """
+    _ensure_summaries()
+    deadline = time.monotonic() + timeout
+    while True:
+        with _changes:
+            seen = _change_counter
+        summary = storage.get_record(CHAT_SUMMARIES_FILE, username)
+        msgs, reset = get_chat_messages_after(username, after)
+        if msgs or reset:
+            return msgs, reset
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], False
+            with _changes:
+                woken = _changes.wait_for(lambda: _change_counter != seen, timeout=min(remaining, CHANGE_POLL_SECONDS))
+            if woken or storage.get_record(CHAT_SUMMARIES_FILE, username) != summary:
+                break
+
 # Devuelve todos los mensajes de un usuario
 # (Unificada para evitar conflicto de definiciones)
 def get_user_chat(username, order_id=None):
-    messages = load_chat_messages()
-    user_msgs = messages.get(username, [])
+    _ensure_migrated()
+    user_msgs = storage.read_log(_chat_log_path(username))
     if order_id:
         return [m for m in user_msgs if m.get('order_id') == order_id]
     return user_msgs
 
+def get_user_chat_tail(username, limit):
+    """Devuelve solo los últimos 'limit' mensajes de un usuario, leyendo el log desde el final."""
+    _ensure_migrated()
+    return storage.read_log(_chat_log_path(username), tail=limit)
+
+def get_user_chat_page(username, before=None, limit=CHAT_PAGE_SIZE):
+    """
+    Los últimos 'limit' mensajes de un usuario, o los anteriores al cursor 'before', leyendo el
+    log desde el final. Retorna (mensajes, cursor de la página anterior o None, reset): reset es
+    True si el cursor quedó obsoleto (el log se compactó) y hay que recargar el chat.
+    """
+    _ensure_migrated()
+    try:
+        msgs, cursor = storage.read_log_page(_chat_log_path(username), limit, before)
+    except ValueError as e:
+        logger.info(f"Cursor de chat no válido para {username}: {e}")
+        return [], None, True
+    return msgs, cursor, False
+
+def get_recent_chats_by_order(username, orders, limit=ORDER_CHAT_LIMIT):
+    """
+    Los últimos 'limit' mensajes de cada pedido de 'orders' ({order_id: [mensajes]}). Recorre el
+    log hacia atrás por páginas y se detiene cuando cada pedido tiene sus mensajes o la lectura
+    ya pasó su fecha (un pedido no tiene mensajes anteriores a su creación).
+    """
+    pending = {order['order_id']: order.get('order_date') or '' for order in orders if order.get('order_id')}
+    chats = {}
+    before = None
+    while pending:
+        msgs, before, _ = get_user_chat_page(username, before, limit=CHAT_PAGE_SIZE)
+        for msg in reversed(msgs):
+            oid = msg.get('order_id')
+            if oid in pending:
+                chats.setdefault(oid, []).insert(0, msg)
+                if len(chats[oid]) >= limit:
+                    del pending[oid]
+        if before is None or not msgs:
+            break
+        oldest = msgs[0].get('timestamp', '')
+        pending = {oid: date for oid, date in pending.items() if not (oldest and date and oldest < date)}
+    return chats
+
 # Devuelve todos los mensajes de un usuario agrupados por order_id
 def get_user_chats_by_order(username):
-    messages = load_chat_messages()
-    user_msgs = messages.get(username, [])
+    user_msgs = get_user_chat(username)
     chats = {}
     for msg in user_msgs:
         oid = msg.get('order_id')
@@ -58,19 +336,66 @@ def get_user_chats_by_order(username):
     return chats
 
 def get_all_user_chats():
-    """Devuelve un dict {username: [mensajes]} con todos los chats agrupados por usuario (compatible con la estructura actual del JSON)."""
-    messages = load_chat_messages()
-    user_chats = {}
-    # Si el archivo es un dict con claves de usuario
-    if isinstance(messages, dict):
-        for username, msgs in messages.items():
-            if username.startswith('_'):  # Ignorar ejemplos u otros metadatos
+    """Devuelve un dict {username: [mensajes]} con todos los chats agrupados por usuario."""
+    return load_chat_messages()
+
+def iter_chat_messages(page_size=500):
+    """
+    Recorre los mensajes de todos los chats como pares (username, mensaje) sin cargar ningún
+    log entero: cada log se lee hacia atrás por páginas. Si un log se compacta mientras se lee,
+    se vuelve a leer desde el final (puede repetir mensajes, pero no se salta ninguno).
+    """
+    _ensure_migrated()
+    for path in storage.list_logs(CHAT_DIR):
+        username = _username_from_path(path)
+        before = None
+        while True:
+            try:
+                msgs, before = storage.read_log_page(path, page_size, before)
+            except ValueError:
+                before = None
                 continue
-            user_chats[username] = msgs
-    # Si es una lista de mensajes individuales (estructura alternativa)
-    elif isinstance(messages, list):
-        for msg in messages:
-            username = msg.get('username')
-            if username:
-                user_chats.setdefault(username, []).append(msg)
-    return user_chats
+            for msg in reversed(msgs):
+                yield username, msg
+            if before is None:
+                break
+
+# --- Compactación ---
+
+def compact_user_chat(username, keep=None):
+    """
+    Reescribe el log de un usuario descartando líneas ilegibles (escrituras cortadas) y los
+    mensajes para los que keep(mensaje) es False, y recalcula su resumen con los que quedan.
+    Retorna cuántos mensajes se eliminaron.
+    """
+    _ensure_summaries()
+    path = _chat_log_path(username)
+    # El log queda bloqueado hasta actualizar el resumen: los mensajes nuevos esperan a que termine
+    with storage.exclusive_access(path):
+        removed = storage.compact_log(path, keep)
+        if removed:
+            kept = storage.read_log(path)
+
+            def _recount(summary):
+                if not summary:
+                    return storage.SKIP_WRITE
+                # Con JSON el resumen se confirma antes que el anexado: los mensajes que cuenta y
+                # aún no están en el log son posteriores a los conservados y mandan en 'last_*'
+                pending = summary['count'] - removed - len(kept)
+                if pending <= 0:
+                    fresh = _summarize(kept)
+                    if fresh:
+                        # Quitar mensajes no añade no leídos (el administrador pudo leerlos sin responder)
+                        fresh['unread_admin'] = min(fresh['unread_admin'], summary.get('unread_admin', 0))
+                    return fresh
+                summary['count'] = len(kept) + pending
+                return summary
+
+            storage.update_record(CHAT_SUMMARIES_FILE, username, _recount, ensure_ascii=False)
+    return removed
+
+def compact_chat_logs(keep=None):
+    """Compacta los logs de todos los usuarios (lo ejecuta clean_chat_messages.py periódicamente)."""
+    _ensure_summaries()
+    return {_username_from_path(path): compact_user_chat(_username_from_path(path), keep)
+            for path in storage.list_logs(CHAT_DIR)}
@@ -0,0 +1,89 @@
+# http_cache.py - GET condicional (ETag / Last-Modified / 304) para las páginas del catálogo
+#
+# El HTML de la portada, /products y /product/<id> solo depende de la versión del catálogo
+# (data_manager.bump_catalog_version, que se incrementa en cada cambio de productos y cuando una
+# venta agota uno: las páginas muestran si hay stock, no cuántas unidades),
+# del tipo de sesión (la cabecera cambia si hay usuario o administrador conectado) y de las
+# plantillas. Con eso se calcula el ETag antes de llamar a la vista: si el navegador o el
+# proxy ya tienen esa versión se responde 304 sin cargar productos ni renderizar nada. Si no,
+# la página anónima se sirve desde render_cache cuando ya se renderizó para esta versión; a
+# los usuarios conectados se les cachean los fragmentos (ver render_cache.cached_fragment).
+
+import hashlib
+import os
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import g, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+from data_manager import get_catalog_state
+import render_cache
+
+# Segundos que un proxy compartido puede servir la página anónima sin revalidar; el navegador
+# revalida siempre (max-age=0) y un usuario conectado nunca se guarda en el proxy (private).
+SHARED_MAX_AGE = 30
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+# CSS y JS cuentan como plantillas: las páginas los enlazan con ?v=<fecha> (static_files.py)
+ASSET_DIRS = [os.path.join(os.path.dirname(TEMPLATES_DIR), 'static', name) for name in ('css', 'js')]
+
+def _templates_version():
+    """Huella de plantillas, CSS y JS al arrancar: un despliegue que cambie alguno cambia los ETag."""
+    mtimes = []
+    for directory in [TEMPLATES_DIR] + ASSET_DIRS:
+        for root, _, files in os.walk(directory):
+            mtimes.extend(os.stat(os.path.join(root, name)).st_mtime_ns for name in files)
+    return max(mtimes, default=0)
+
+_TEMPLATES_MTIME_NS = _templates_version()
+_TEMPLATES_VERSION = format(_TEMPLATES_MTIME_NS, 'x')
+
+def _session_variant():
+    if session.get('admin_logged_in'):
+        return 'admin'
+    if session.get('user_logged_in'):
+        return 'user'
+    return 'anon'
+
+def _cache_headers(response, etag, last_modified, variant):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if variant == 'anon':
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        response.cache_control.s_maxage = SHARED_MAX_AGE
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+def catalog_cache(view):
+    """Decorador: ETag, Last-Modified y 304 para una vista cuyo HTML depende solo del catálogo."""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+            # Hay mensajes flash que mostrar: la página es única y no se cachea
+            return view(*args, **kwargs)
+        version, updated_at = get_catalog_state()
+        variant = _session_variant()
+        digest = hashlib.sha1(f'{version}:{variant}:{_TEMPLATES_VERSION}'.encode()).hexdigest()[:20]
+        etag = f'c{version}-{digest}'
+        last_modified = datetime.fromtimestamp(max(updated_at or 0, _TEMPLATES_MTIME_NS // 10**9), timezone.utc)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            return _cache_headers(make_response('', 304), etag, last_modified, variant)
+        page_key = ('page', request.full_path)
+        if variant == 'anon':
+            html = render_cache.get_page(page_key, version)
+            if html is not None:
+                return _cache_headers(make_response(html), etag, last_modified, variant)
+        else:
+            g.fragment_cache_version = version
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            if variant == 'anon':
+                render_cache.put_page(page_key, response.get_data(), version)
+            _cache_headers(response, etag, last_modified, variant)
+        return response
+    return decorated_function
@@ -0,0 +1,48 @@
+# import_data_to_sqlite.py - Migra los archivos JSON de 'data/' a la base de datos SQLite
+#
+# Uso:
+#   python import_data_to_sqlite.py [directorio_datos] [ruta_sqlite]
+#
+# Cada archivo se lee en streaming (elemento a elemento) y se inserta por lotes, así la
+# memoria no crece con el tamaño de los datos. Después, arrancar la app con
+# STORAGE_BACKEND=sqlite (y SQLITE_PATH si se usa una ruta distinta a la por defecto).
+
+import json
+import os
+import sys
+
+import sqlite_store
+import storage
+
+def import_directory(data_dir, db_path):
+    total = 0
+    for root, dirs, files in os.walk(data_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            filepath = os.path.join(root, filename)
+            # Logs de solo-anexado (p. ej. data/chat/<usuario>.jsonl): un registro por línea
+            if filename.endswith('.jsonl'):
+                name = storage.collection_name(os.path.join('data', os.path.relpath(filepath, data_dir)))
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    count = sqlite_store.import_log(db_path, name, (json.loads(line) for line in f if line.strip()))
+                print(f"{filepath} -> {name}: {count} registros (log)")
+                total += count
+                continue
+            if not filename.endswith('.json'):
+                continue
+            kind = storage.json_kind(filepath)
+            if kind is None:
+                print(f"Omitido (no es un objeto ni una lista JSON): {filepath}")
+                continue
+            # El nombre de la colección es el mismo que usa la app para 'data/<ruta>.json'
+            name = storage.collection_name(os.path.join('data', os.path.relpath(filepath, data_dir)))
+            count = sqlite_store.import_items(db_path, name, kind, storage.iter_json_items(filepath))
+            print(f"{filepath} -> {name}: {count} registros")
+            total += count
+    return total
+
+if __name__ == '__main__':
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    db_path = sys.argv[2] if len(sys.argv) > 2 else storage.SQLITE_PATH
+    total = import_directory(data_dir, db_path)
+    print(f"Importación completada: {total} registros en {db_path}")
@@ -0,0 +1,71 @@
+# pagination.py - Paginación de los listados (catálogo y tablas de administración)
+#
+# Cada listado acepta ?page=N (y opcionalmente ?per_page=M). Los enlaces a la página
+# siguiente llevan además ?after=<clave>, un cursor con la clave del último registro
+# mostrado: así el backend continúa desde ese registro en lugar de saltar N*M filas.
+# Solo se copian y renderizan los registros de la página; el total sale de
+# storage.count_records (len() del dict en caché o un contador en SQLite).
+
+import math
+
+from flask import request, url_for
+
+import storage
+
+DEFAULT_PER_PAGE = 24
+MAX_PER_PAGE = 100
+
+class Pagination:
+    """Una página de resultados más lo necesario para dibujar los enlaces."""
+
+    def __init__(self, items, page, per_page, total, next_cursor=None):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.next_cursor = next_cursor
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(self.total / self.per_page))
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def first_index(self):
+        """Número (1-based) del primer elemento de la página, para mostrar 'x-y de total'."""
+        return (self.page - 1) * self.per_page + 1 if self.items else 0
+
+    @property
+    def last_index(self):
+        return (self.page - 1) * self.per_page + len(self.items)
+
+def get_page_args(default_per_page=DEFAULT_PER_PAGE):
+    """Lee page, per_page y after de la query string (con límites razonables)."""
+    page = max(request.args.get('page', 1, type=int) or 1, 1)
+    per_page = request.args.get('per_page', default_per_page, type=int) or default_per_page
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+    return page, per_page, request.args.get('after') or None
+
+def paginate_records(filepath, default_per_page=DEFAULT_PER_PAGE, reverse=False):
+    """Pagina una colección de storage en orden de inserción (o inverso con reverse=True)."""
+    page, per_page, after = get_page_args(default_per_page)
+    total = storage.count_records(filepath)
+    rows = storage.page_records(filepath, per_page, offset=(page - 1) * per_page, after=after, reverse=reverse)
+    next_cursor = str(rows[-1][0]) if len(rows) == per_page else None
+    return Pagination([value for _, value in rows], page, per_page, total, next_cursor)
+
+def page_url(page, cursor=None):
+    """URL del listado actual en otra página, conservando el resto de parámetros (búsqueda, filtros)."""
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args['page'] = page
+    if cursor:
+        args['after'] = cursor
+    return url_for(request.endpoint, **dict(request.view_args or {}, **args))
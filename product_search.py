@@ -0,0 +1,170 @@
+# product_search.py - Índice invertido en memoria para la búsqueda del catálogo (/products)
+#
+# Tokeniza nombre, descripción y categoría de cada producto (sin acentos y en minúsculas),
+# admite coincidencia por prefijo ("elec" encuentra "electrónicos") y ordena por relevancia.
+# El índice se sincroniza con la versión del catálogo (data_manager.get_catalog_changes):
+# solo se reindexan los productos que cambiaron desde la última consulta, también si el
+# cambio lo hizo otro proceso.
+
+import bisect
+import heapq
+import itertools
+import re
+import threading
+import unicodedata
+
+from data_manager import PRODUCTS_FILE, get_product, get_catalog_changes
+import storage
+
+DEFAULT_CATEGORY = 'Sin categoría'
+
+# Peso de cada campo en la relevancia; una coincidencia exacta vale el doble que un prefijo
+FIELD_WEIGHTS = {'name': 3, 'category': 2, 'description': 1}
+PREFIX_FACTOR = 0.5
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def fold(text):
+    """Minúsculas y sin acentos: 'Electrónicos' -> 'electronicos'."""
+    decomposed = unicodedata.normalize('NFKD', str(text or ''))
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold(text))
+
+def product_category(product):
+    return product.get('category') or DEFAULT_CATEGORY
+
+class _Index:
+    def __init__(self):
+        self.version = None
+        self.postings = {}      # token -> {product_id: peso}
+        self.tokens = []        # tokens ordenados, para buscar por prefijo con bisect
+        self.doc_tokens = {}    # product_id -> tokens del producto (para poder quitarlo)
+        self.categories = {}    # categoría -> set(product_id)
+        self.doc_category = {}  # product_id -> categoría
+        self.order = {}         # product_id -> posición en el catálogo (orden de presentación)
+        self.next_order = 0
+
+    def remove(self, pid, keep_order=False):
+        for token in self.doc_tokens.pop(pid, ()):
+            docs = self.postings.get(token)
+            if docs is None:
+                continue
+            docs.pop(pid, None)
+            if not docs:
+                del self.postings[token]
+                i = bisect.bisect_left(self.tokens, token)
+                if i < len(self.tokens) and self.tokens[i] == token:
+                    self.tokens.pop(i)
+        category = self.doc_category.pop(pid, None)
+        if category is not None:
+            members = self.categories[category]
+            members.discard(pid)
+            if not members:
+                del self.categories[category]
+        if not keep_order:
+            self.order.pop(pid, None)
+
+    def add(self, pid, product):
+        self.remove(pid, keep_order=True)
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            value = product_category(product) if field == 'category' else product.get(field)
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0) + weight
+        for token, weight in weights.items():
+            docs = self.postings.get(token)
+            if docs is None:
+                docs = self.postings[token] = {}
+                bisect.insort(self.tokens, token)
+            docs[pid] = weight
+        self.doc_tokens[pid] = list(weights)
+        category = product_category(product)
+        self.categories.setdefault(category, set()).add(pid)
+        self.doc_category[pid] = category
+        if pid not in self.order:
+            self.order[pid] = self.next_order
+            self.next_order += 1
+
+    def matches(self, term):
+        """Retorna {product_id: puntuación} para un término (coincidencia exacta o por prefijo)."""
+        scores = {}
+        i = bisect.bisect_left(self.tokens, term)
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            token = self.tokens[i]
+            factor = 1 if token == term else PREFIX_FACTOR
+            for pid, weight in self.postings[token].items():
+                scores[pid] = max(scores.get(pid, 0), weight * factor)
+            i += 1
+        return scores
+
+_index = _Index()
+_lock = threading.Lock()
+
+def _rebuild():
+    index = _Index()
+    for pid, product in storage.load_json(PRODUCTS_FILE, {}, create=False).items():
+        if isinstance(product, dict):
+            index.add(str(pid), product)
+    return index
+
+def refresh():
+    """Pone el índice al día con la versión actual del catálogo. Retorna la versión."""
+    global _index
+    with _lock:
+        since = -1 if _index.version is None else _index.version
+        version, changed = get_catalog_changes(since)
+        if changed is None:
+            # La versión se lee antes que los productos: si algo cambia entre medias, la siguiente
+            # consulta lo vuelve a aplicar (reindexar un producto es idempotente).
+            _index = _rebuild()
+        else:
+            for pid in changed:
+                product = get_product(pid)
+                if product is None:
+                    _index.remove(pid)
+                else:
+                    _index.add(pid, product)
+        _index.version = version
+        return version
+
+def search(query='', category='', offset=0, limit=None):
+    """
+    Busca productos. Retorna (ids de la página pedida, total de resultados, {categoría: número de resultados}).
+    Todos los términos deben coincidir (exactos o por prefijo); sin términos se retorna el
+    catálogo en su orden original. Las facetas cuentan los resultados de la búsqueda antes de
+    aplicar el filtro de categoría, para poder cambiar de categoría sin perder la búsqueda.
+    Con 'limit' solo se ordenan los primeros offset+limit resultados (heap) en vez de todos.
+    """
+    refresh()
+    stop = None if limit is None else offset + limit
+    with _lock:
+        terms = tokenize(query)
+        if terms:
+            scores = None
+            for term in dict.fromkeys(terms):
+                term_scores = _index.matches(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores}
+                if not scores:
+                    break
+            facets = {}
+            for pid in scores:
+                cat = _index.doc_category[pid]
+                facets[cat] = facets.get(cat, 0) + 1
+            if category:
+                scores = {pid: score for pid, score in scores.items() if _index.doc_category[pid] == category}
+            key = lambda pid: (-scores[pid], _index.order[pid])
+            ranked = sorted(scores, key=key) if stop is None else heapq.nsmallest(stop, scores, key=key)
+            return ranked[offset:stop], len(scores), facets
+        facets = {cat: len(members) for cat, members in _index.categories.items()}
+        if category:
+            members = _index.categories.get(category, ())
+            ranked = (sorted(members, key=_index.order.__getitem__) if stop is None
+                      else heapq.nsmallest(stop, members, key=_index.order.__getitem__))
+            return ranked[offset:stop], len(members), facets
+        # _index.order conserva el orden de inserción, que es el orden del catálogo
+        return list(itertools.islice(_index.order, offset, stop)), len(_index.order), facets
@@ -0,0 +1,97 @@
+# render_cache.py - Caché en memoria del HTML renderizado del catálogo
+#
+# Guarda páginas completas (visitantes anónimos) y fragmentos como la cuadrícula de productos
+# (usuarios conectados, cuya cabecera cambia pero la cuadrícula no). Las entradas dependen de
+# la versión del catálogo: cuando cambia (p. ej. al editar un producto en admin_products) la
+# caché se vacía entera, también si el cambio lo hizo otro proceso. El tamaño está acotado en
+# bytes y se desalojan primero las entradas usadas hace más tiempo (LRU).
+
+import threading
+from collections import OrderedDict
+
+from flask import g, request
+from markupsafe import Markup
+
+MAX_BYTES = 8 * 1024 * 1024
+MAX_ENTRY_BYTES = MAX_BYTES // 8  # Una página enorme no debe desalojar toda la caché
+
+class _LRU:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # clave -> (valor, bytes)
+        self.bytes = 0
+        self.version = None
+        self.stats = {'page_hits': 0, 'page_misses': 0, 'fragment_hits': 0, 'fragment_misses': 0,
+                      'evictions': 0, 'invalidations': 0}
+        self.lock = threading.Lock()
+
+    def _sync(self, version):
+        if version != self.version:
+            if self.entries:
+                self.stats['invalidations'] += 1
+            self.entries.clear()
+            self.bytes = 0
+            self.version = version
+
+    def get(self, kind, key, version):
+        with self.lock:
+            self._sync(version)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats[f'{kind}_misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats[f'{kind}_hits'] += 1
+            return entry[0]
+
+    def put(self, key, value, size, version):
+        if size > MAX_ENTRY_BYTES:
+            return
+        with self.lock:
+            self._sync(version)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.stats['evictions'] += 1
+
+_cache = _LRU(MAX_BYTES)
+
+def get_page(key, version):
+    """HTML (bytes) de una página completa o None si no está en caché para esta versión del catálogo."""
+    return _cache.get('page', key, version)
+
+def put_page(key, html, version):
+    _cache.put(key, html, len(html), version)
+
+def cached_fragment(name, *key_parts, caller):
+    """
+    Global de Jinja para cachear un fragmento de plantilla:
+        {% call cached_fragment('products-grid', session.get('user_logged_in')) %} ... {% endcall %}
+    La clave incluye la URL (búsqueda, categoría, página) y 'key_parts' con lo que el fragmento
+    use de la sesión. Solo actúa en las vistas con http_cache.catalog_cache y cuando no se
+    cachea ya la página completa; en otro caso renderiza el bloque normalmente.
+    """
+    version = g.get('fragment_cache_version')
+    if version is None:
+        return caller()
+    key = ('fragment', name, request.full_path, key_parts)
+    html = _cache.get('fragment', key, version)
+    if html is None:
+        html = str(caller())
+        _cache.put(key, html, len(html.encode('utf-8')), version)
+    return Markup(html)
+
+def get_render_cache_stats():
+    """Contadores de aciertos/fallos por tipo, desalojos, invalidaciones y ocupación."""
+    with _cache.lock:
+        return dict(_cache.stats, entries=len(_cache.entries), bytes=_cache.bytes, max_bytes=_cache.max_bytes)
+
+def clear_render_cache():
+    with _cache.lock:
+        _cache.entries.clear()
+        _cache.bytes = 0
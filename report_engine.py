@@ -0,0 +1,189 @@
+# report_engine.py - Reporte de ventas generado a partir del historial de compras
+#
+# Recorre user_purchases.json (una entrada por pedido, en orden de compra, con sus productos,
+# total, fecha y cliente) una sola vez y en streaming, acumulando ventas por día, semana y
+# mes, ingresos por categoría, productos más vendidos, ticket medio y valor de vida de cada
+# cliente. El resultado se guarda en reports.json bajo SALES_REPORT_ID con 'generated_at' y
+# un punto de control (compras procesadas y id de la última) para que la siguiente ejecución
+# solo procese las compras nuevas. La memoria depende del número de días, productos y
+# clientes distintos, no del número de compras: nunca se carga el historial completo.
+
+import heapq
+import logging
+import threading
+from datetime import date, datetime
+
+from data_manager import REPORTS_FILE, USER_PURCHASES_FILE, get_product
+from product_search import product_category
+import storage
+
+logger = logging.getLogger(__name__)
+
+SALES_REPORT_ID = 'ventas'
+TOP_PRODUCTS = 10
+TOP_CUSTOMERS = 10
+UNKNOWN_DATE = 'sin fecha'
+
+# Un solo generador a la vez: _run_lock entre hilos y el bloqueo de archivo entre procesos
+_run_lock = threading.Lock()
+_ENGINE_LOCK = REPORTS_FILE + '.engine'
+_worker = None
+_worker_guard = threading.Lock()
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _quantity(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def _empty_report():
+    """Acumuladores del reporte; se guardan con él para poder continuar desde el punto de control."""
+    return {
+        'processed_purchases': 0,
+        'last_order_id': None,
+        'totals': {'orders': 0, 'units': 0, 'revenue': 0.0},
+        'orders_by_status': {},
+        'sales_by_day': {},         # {YYYY-MM-DD: {'orders', 'units', 'revenue'}}
+        'revenue_by_category': {},  # {categoría: {'units', 'revenue'}}
+        'sales_by_product': {},     # {product_id: {'product_name', 'total_quantity', 'total_revenue'}}
+        'customers': {},            # {username: {'orders', 'revenue'}}; 'revenue' es el valor de vida
+    }
+
+def _add(bucket, key, **amounts):
+    entry = bucket.setdefault(key, {name: 0 for name in amounts})
+    for name, amount in amounts.items():
+        entry[name] = entry.get(name, 0) + amount
+    return entry
+
+def _accumulate(report, purchase, categories):
+    """Suma una compra a los acumuladores. 'categories' guarda la categoría de cada producto ya visto."""
+    units = 0
+    items_revenue = 0.0
+    for item in purchase.get('items') or []:
+        pid = str(item.get('product_id'))
+        quantity = _quantity(item.get('quantity'))
+        revenue = _number(item.get('price')) * quantity
+        units += quantity
+        items_revenue += revenue
+        product = _add(report['sales_by_product'], pid, total_quantity=quantity, total_revenue=revenue)
+        product['product_name'] = item.get('name') or product.get('product_name') or f'ID: {pid}'
+        if pid not in categories:
+            categories[pid] = product_category(get_product(pid) or {})
+        _add(report['revenue_by_category'], categories[pid], units=quantity, revenue=revenue)
+    total = _number(purchase['total_price']) if 'total_price' in purchase else items_revenue
+    day = (purchase.get('order_date') or '')[:10] or UNKNOWN_DATE
+    report['totals']['orders'] += 1
+    report['totals']['units'] += units
+    report['totals']['revenue'] += total
+    status = purchase.get('status') or 'desconocido'
+    report['orders_by_status'][status] = report['orders_by_status'].get(status, 0) + 1
+    _add(report['sales_by_day'], day, orders=1, units=units, revenue=total)
+    _add(report['customers'], purchase.get('username') or 'desconocido', orders=1, revenue=total)
+
+def _period_totals(sales_by_day, period):
+    """Agrupa las ventas diarias por semana ISO ('2025-W27') o por mes ('2025-07')."""
+    result = {}
+    for day, sales in sales_by_day.items():
+        try:
+            parsed = date.fromisoformat(day)
+        except ValueError:
+            key = day
+        else:
+            if period == 'week':
+                year, week, _ = parsed.isocalendar()
+                key = f'{year}-W{week:02d}'
+            else:
+                key = day[:7]
+        _add(result, key, **sales)
+    return dict(sorted(result.items()))
+
+def _round(value):
+    if isinstance(value, float):
+        return round(value, 2)
+    if isinstance(value, dict):
+        return {key: _round(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_round(item) for item in value]
+    return value
+
+def _finish(report):
+    """Calcula los campos derivados de los acumuladores (no hace falta volver a leer compras)."""
+    totals = report['totals']
+    totals['average_order_value'] = totals['revenue'] / totals['orders'] if totals['orders'] else 0.0
+    report['sales_by_day'] = dict(sorted(report['sales_by_day'].items()))
+    report['sales_by_week'] = _period_totals(report['sales_by_day'], 'week')
+    report['sales_by_month'] = _period_totals(report['sales_by_day'], 'month')
+    products = report['sales_by_product']
+    report['top_products_by_units'] = [
+        dict(products[pid], product_id=pid)
+        for pid in heapq.nlargest(TOP_PRODUCTS, products, key=lambda pid: products[pid]['total_quantity'])
+    ]
+    report['top_products_by_revenue'] = [
+        dict(products[pid], product_id=pid)
+        for pid in heapq.nlargest(TOP_PRODUCTS, products, key=lambda pid: products[pid]['total_revenue'])
+    ]
+    customers = report['customers']
+    report['average_customer_value'] = totals['revenue'] / len(customers) if customers else 0.0
+    report['top_customers'] = [
+        dict(customers[username], username=username)
+        for username in heapq.nlargest(TOP_CUSTOMERS, customers, key=lambda username: customers[username]['revenue'])
+    ]
+    report['generated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return _round(report)
+
+def generate_sales_report(full=False):
+    """
+    Genera o pone al día el reporte de ventas y lo guarda en reports.json. Solo procesa las
+    compras posteriores al punto de control; con full=True, o si el historial cambió antes de
+    ese punto (p. ej. se canceló un pedido ya contado), recalcula desde el principio.
+    Retorna el reporte o None si falla.
+    """
+    try:
+        with _run_lock, storage.file_lock(_ENGINE_LOCK, exclusive=True):
+            report = None if full else storage.get_record(REPORTS_FILE, SALES_REPORT_ID)
+            if not isinstance(report, dict) or 'processed_purchases' not in report:
+                report = _empty_report()
+            processed = report['processed_purchases']
+            # La compra del punto de control debe seguir en su sitio; si no, las posiciones cambiaron
+            records = storage.iter_records(USER_PURCHASES_FILE, start=max(processed - 1, 0))
+            if processed:
+                _, checkpoint = next(records, (None, None))
+                if not isinstance(checkpoint, dict) or checkpoint.get('order_id') != report['last_order_id']:
+                    logger.info("El historial de compras cambió antes del punto de control; se recalcula el reporte.")
+                    report = _empty_report()
+                    records = storage.iter_records(USER_PURCHASES_FILE)
+            categories = {}
+            new_purchases = 0
+            for position, purchase in records:
+                if isinstance(purchase, dict):
+                    _accumulate(report, purchase, categories)
+                    report['last_order_id'] = purchase.get('order_id')
+                report['processed_purchases'] = position + 1
+                new_purchases += 1
+            report = _finish(report)
+            storage.put_record(REPORTS_FILE, SALES_REPORT_ID, report)
+            logger.info(f"Reporte de ventas actualizado: {new_purchases} compras nuevas, "
+                        f"{report['processed_purchases']} en total.")
+            return report
+    except Exception as e:
+        logger.error(f"Error al generar el reporte de ventas: {e}")
+        return None
+
+def start_sales_report(full=False):
+    """Genera el reporte en un hilo de fondo. Retorna False si ya hay una generación en curso en este proceso."""
+    global _worker
+    with _worker_guard:
+        if is_generating():
+            return False
+        _worker = threading.Thread(target=generate_sales_report, args=(full,), name='sales-report', daemon=True)
+        _worker.start()
+        return True
+
+def is_generating():
+    return _worker is not None and _worker.is_alive()
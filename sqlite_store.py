@@ -0,0 +1,361 @@
+# sqlite_store.py - Backend SQLite (modo WAL) para la capa de almacenamiento
+#
+# Cada archivo JSON de 'data/' se guarda como una "colección": una fila por clave
+# (diccionarios) o por elemento (listas) en la tabla 'records'. Así una operación sobre
+# un solo registro (get/put/delete) no necesita leer ni reescribir todo el conjunto.
+# Se activa con STORAGE_BACKEND=sqlite (ver storage.py).
+
+import json
+import os
+import sqlite3
+import threading
+
+_local = threading.local()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS collections (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,         -- 'dict' o 'list'
+    size INTEGER NOT NULL DEFAULT 0  -- Número de registros (evita COUNT(*) al paginar)
+);
+CREATE TABLE IF NOT EXISTS records (
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    pos INTEGER NOT NULL,       -- Conserva el orden de inserción del JSON original
+    value TEXT NOT NULL,
+    PRIMARY KEY (collection, key)
+);
+CREATE INDEX IF NOT EXISTS records_pos ON records (collection, pos);
+CREATE TABLE IF NOT EXISTS log_entries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    log TEXT NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS log_entries_log ON log_entries (log, seq);
+"""
+
+def get_connection(db_path):
+    """Retorna la conexión del hilo actual (una por hilo y por base de datos)."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: las transacciones se controlan con BEGIN IMMEDIATE explícito
+        conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        connections[db_path] = conn
+    return conn
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK; reentrante dentro de la misma conexión."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.outer = False
+
+    def __enter__(self):
+        if not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.outer = True
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.outer:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+def write_transaction(db_path):
+    return _Transaction(get_connection(db_path))
+
+def _kind(conn, name):
+    row = conn.execute('SELECT kind FROM collections WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else None
+
+def _rows_to_data(kind, rows):
+    if kind == 'list':
+        return [json.loads(value) for _, value in rows]
+    return {key: json.loads(value) for key, value in rows}
+
+def load_collection(db_path, name):
+    """Retorna la colección completa (dict o list) o None si no existe."""
+    conn = get_connection(db_path)
+    kind = _kind(conn, name)
+    if kind is None:
+        return None
+    rows = conn.execute('SELECT key, value FROM records WHERE collection = ? ORDER BY pos', (name,)).fetchall()
+    return _rows_to_data(kind, rows)
+
+def collection_exists(db_path, name):
+    return _kind(get_connection(db_path), name) is not None
+
+def list_collections(db_path, prefix):
+    """Nombres de las colecciones cuyo nombre empieza por 'prefix'."""
+    rows = get_connection(db_path).execute(
+        "SELECT name FROM collections WHERE name >= ? AND name < ? ORDER BY name", (prefix, prefix + '\uffff')
+    ).fetchall()
+    return [name for (name,) in rows]
+
+def _items(data):
+    if isinstance(data, list):
+        return ((str(i), v) for i, v in enumerate(data))
+    return data.items()
+
+def _replace_collection(conn, name, data):
+    kind = 'list' if isinstance(data, list) else 'dict'
+    conn.execute('INSERT OR REPLACE INTO collections (name, kind, size) VALUES (?, ?, ?)', (name, kind, len(data)))
+    conn.execute('DELETE FROM records WHERE collection = ?', (name,))
+    conn.executemany(
+        'INSERT INTO records (collection, key, pos, value) VALUES (?, ?, ?, ?)',
+        ((name, key, pos, json.dumps(value, ensure_ascii=False)) for pos, (key, value) in enumerate(_items(data)))
+    )
+
+def save_collection(db_path, name, data):
+    with write_transaction(db_path) as conn:
+        _replace_collection(conn, name, data)
+
+def update_collection(db_path, name, default_value, mutator, skip_marker):
+    """
+    Lectura-modificación-escritura de la colección dentro de una transacción de escritura.
+    'default_value' debe ser una copia propia: se entrega al mutator si la colección no existe.
+    """
+    with write_transaction(db_path) as conn:
+        data = load_collection(db_path, name)
+        if data is None or not isinstance(data, type(default_value)):
+            data = default_value
+        result = mutator(data)
+        if result is skip_marker:
+            return None
+        _replace_collection(conn, name, data)
+        return result
+
+def get_record(db_path, name, key):
+    """Retorna el valor guardado bajo 'key' o None."""
+    row = get_connection(db_path).execute(
+        'SELECT value FROM records WHERE collection = ? AND key = ?', (name, str(key))
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+def put_record(db_path, name, key, value):
+    """Inserta o reemplaza un registro de una colección tipo dict. Retorna el valor anterior."""
+    key = str(key)
+    with write_transaction(db_path) as conn:
+        if _kind(conn, name) is None:
+            conn.execute('INSERT INTO collections (name, kind) VALUES (?, ?)', (name, 'dict'))
+        row = conn.execute('SELECT value, pos FROM records WHERE collection = ? AND key = ?', (name, key)).fetchone()
+        encoded = json.dumps(value, ensure_ascii=False)
+        if row:
+            conn.execute('UPDATE records SET value = ? WHERE collection = ? AND key = ?', (encoded, name, key))
+            return json.loads(row[0])
+        (pos,) = conn.execute('SELECT COALESCE(MAX(pos), -1) + 1 FROM records WHERE collection = ?', (name,)).fetchone()
+        conn.execute('INSERT INTO records (collection, key, pos, value) VALUES (?, ?, ?, ?)', (name, key, pos, encoded))
+        conn.execute('UPDATE collections SET size = size + 1 WHERE name = ?', (name,))
+        return None
+
+def update_record(db_path, name, key, mutator, skip_marker):
+    """
+    Modifica un registro dentro de una transacción de escritura. 'mutator' recibe el valor
+    (o None si no existe) y retorna el nuevo valor; si retorna skip_marker no se escribe,
+    y si retorna None el registro se elimina (igual que con los archivos JSON).
+    """
+    with write_transaction(db_path):
+        current = get_record(db_path, name, key)
+        value = mutator(current)
+        if value is skip_marker:
+            return current
+        if value is None:
+            delete_record(db_path, name, key)
+        else:
+            put_record(db_path, name, key, value)
+        return value
+
+def delete_record(db_path, name, key):
+    """Elimina un registro. Retorna el valor eliminado o None si no existía."""
+    key = str(key)
+    with write_transaction(db_path) as conn:
+        row = conn.execute('SELECT value FROM records WHERE collection = ? AND key = ?', (name, key)).fetchone()
+        if not row:
+            return None
+        conn.execute('DELETE FROM records WHERE collection = ? AND key = ?', (name, key))
+        conn.execute('UPDATE collections SET size = size - 1 WHERE name = ?', (name,))
+        return json.loads(row[0])
+
+def append_item(db_path, name, value):
+    """Añade un elemento al final de una colección tipo lista. Retorna su posición."""
+    with write_transaction(db_path) as conn:
+        if _kind(conn, name) is None:
+            conn.execute('INSERT INTO collections (name, kind) VALUES (?, ?)', (name, 'list'))
+        (pos,) = conn.execute('SELECT COALESCE(MAX(pos), -1) + 1 FROM records WHERE collection = ?', (name,)).fetchone()
+        conn.execute('INSERT INTO records (collection, key, pos, value) VALUES (?, ?, ?, ?)',
+                     (name, str(pos), pos, json.dumps(value, ensure_ascii=False)))
+        conn.execute('UPDATE collections SET size = size + 1 WHERE name = ?', (name,))
+        return pos
+
+def find_item(db_path, name, match, hint=None, with_tail=False):
+    """
+    Busca en una lista el primer elemento con match(elemento), probando antes la posición 'hint'.
+    Retorna (posición, elemento, elementos posteriores si with_tail) o None si no hay ninguno.
+    """
+    conn = get_connection(db_path)
+    found = None
+    if isinstance(hint, int):
+        row = conn.execute('SELECT value FROM records WHERE collection = ? AND pos = ?', (name, hint)).fetchone()
+        if row and match(json.loads(row[0])):
+            found = (hint, json.loads(row[0]))
+    if found is None:
+        for pos, value in conn.execute('SELECT pos, value FROM records WHERE collection = ? ORDER BY pos', (name,)):
+            item = json.loads(value)
+            if match(item):
+                found = (pos, item)
+                break
+    if found is None:
+        return None
+    tail = None
+    if with_tail:
+        rows = conn.execute('SELECT value FROM records WHERE collection = ? AND pos > ? ORDER BY pos',
+                            (name, found[0])).fetchall()
+        tail = [json.loads(value) for (value,) in rows]
+    return found[0], found[1], tail
+
+def remove_item(db_path, name, match, hint=None, on_removed=None):
+    """
+    Elimina de una lista el primer elemento con match(elemento) y adelanta una posición los
+    posteriores (solo se actualizan esas filas). Retorna el elemento eliminado o None.
+    """
+    with write_transaction(db_path) as conn:
+        found = find_item(db_path, name, match, hint, on_removed is not None)
+        if found is None:
+            return None
+        pos, removed, tail = found
+        conn.execute('DELETE FROM records WHERE collection = ? AND pos = ?', (name, pos))
+        # En dos pasos para no chocar con la clave primaria mientras se renumeran
+        conn.execute("UPDATE records SET key = '~' || key WHERE collection = ? AND pos > ?", (name, pos))
+        conn.execute('UPDATE records SET pos = pos - 1, key = CAST(pos - 1 AS TEXT) WHERE collection = ? AND pos > ?',
+                     (name, pos))
+        conn.execute('UPDATE collections SET size = size - 1 WHERE name = ?', (name,))
+        if on_removed is not None:
+            on_removed(pos, tail)
+        return removed
+
+def count_records(db_path, name):
+    row = get_connection(db_path).execute('SELECT size FROM collections WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+def page_records(db_path, name, limit, offset=0, after=None, reverse=False):
+    """
+    Porción de una colección en orden de inserción (o inverso) como lista de pares (clave, valor).
+    Con 'after' (clave del último registro ya mostrado) se continúa desde ese registro usando el
+    índice por posición, sin recorrer las filas anteriores; si la clave ya no existe se usa 'offset'.
+    """
+    conn = get_connection(db_path)
+    kind = _kind(conn, name)
+    if kind is None:
+        return []
+    order, compare = ('DESC', '<') if reverse else ('ASC', '>')
+    row = None
+    if after is not None:
+        row = conn.execute('SELECT pos FROM records WHERE collection = ? AND key = ?', (name, str(after))).fetchone()
+    if row:
+        rows = conn.execute(
+            f'SELECT key, value FROM records WHERE collection = ? AND pos {compare} ? ORDER BY pos {order} LIMIT ?',
+            (name, row[0], limit)
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            f'SELECT key, value FROM records WHERE collection = ? ORDER BY pos {order} LIMIT ? OFFSET ?',
+            (name, limit, offset)
+        ).fetchall()
+    return [(int(key) if kind == 'list' else key, json.loads(value)) for key, value in rows]
+
+# --- Logs de solo-anexado ---
+
+def append_log(db_path, name, record):
+    with write_transaction(db_path) as conn:
+        conn.execute('INSERT INTO log_entries (log, value) VALUES (?, ?)', (name, json.dumps(record, ensure_ascii=False)))
+
+def read_log(db_path, name, tail=None):
+    """Registros del log en orden de inserción; con 'tail', solo los últimos 'tail'."""
+    conn = get_connection(db_path)
+    if tail is None:
+        rows = conn.execute('SELECT value FROM log_entries WHERE log = ? ORDER BY seq', (name,)).fetchall()
+    else:
+        rows = conn.execute('SELECT value FROM log_entries WHERE log = ? ORDER BY seq DESC LIMIT ?', (name, tail)).fetchall()
+        rows.reverse()
+    return [json.loads(value) for (value,) in rows]
+
+def read_log_page(db_path, name, limit, before=None):
+    """Los 'limit' registros anteriores a la fila 'before' (o los últimos), como [(seq, registro)] en orden."""
+    conn = get_connection(db_path)
+    if before is None:
+        rows = conn.execute('SELECT seq, value FROM log_entries WHERE log = ? ORDER BY seq DESC LIMIT ?',
+                            (name, limit)).fetchall()
+    else:
+        rows = conn.execute('SELECT seq, value FROM log_entries WHERE log = ? AND seq < ? ORDER BY seq DESC LIMIT ?',
+                            (name, before, limit)).fetchall()
+    rows.reverse()
+    return [(seq, json.loads(value)) for seq, value in rows]
+
+def log_exists(db_path, name):
+    return get_connection(db_path).execute('SELECT 1 FROM log_entries WHERE log = ? LIMIT 1', (name,)).fetchone() is not None
+
+def list_logs(db_path, prefix):
+    """Nombres de los logs cuyo nombre empieza por 'prefix'."""
+    rows = get_connection(db_path).execute(
+        "SELECT DISTINCT log FROM log_entries WHERE log >= ? AND log < ? ORDER BY log", (prefix, prefix + '\uffff')
+    ).fetchall()
+    return [name for (name,) in rows]
+
+def rewrite_log(db_path, name, records):
+    with write_transaction(db_path) as conn:
+        conn.execute('DELETE FROM log_entries WHERE log = ?', (name,))
+        conn.executemany('INSERT INTO log_entries (log, value) VALUES (?, ?)',
+                         ((name, json.dumps(r, ensure_ascii=False)) for r in records))
+
+def import_log(db_path, name, records, batch_size=500):
+    """Importa un log a partir de un iterador de registros, en lotes. Retorna el número de registros."""
+    conn = get_connection(db_path)
+    with write_transaction(db_path):
+        conn.execute('DELETE FROM log_entries WHERE log = ?', (name,))
+    count = 0
+    batch = []
+    for record in records:
+        batch.append((name, json.dumps(record, ensure_ascii=False)))
+        count += 1
+        if len(batch) >= batch_size:
+            with write_transaction(db_path):
+                conn.executemany('INSERT INTO log_entries (log, value) VALUES (?, ?)', batch)
+            batch = []
+    if batch:
+        with write_transaction(db_path):
+            conn.executemany('INSERT INTO log_entries (log, value) VALUES (?, ?)', batch)
+    return count
+
+def import_items(db_path, name, kind, items, batch_size=500):
+    """
+    Importa una colección a partir de un iterador de pares (clave, valor), en lotes,
+    sin necesidad de tener toda la colección en memoria. Retorna el número de registros.
+    """
+    conn = get_connection(db_path)
+    count = 0
+    with write_transaction(db_path):
+        conn.execute('INSERT OR REPLACE INTO collections (name, kind) VALUES (?, ?)', (name, kind))
+        conn.execute('DELETE FROM records WHERE collection = ?', (name,))
+    batch = []
+    for key, value in items:
+        batch.append((name, str(key), count, json.dumps(value, ensure_ascii=False)))
+        count += 1
+        if len(batch) >= batch_size:
+            with write_transaction(db_path):
+                conn.executemany('INSERT INTO records (collection, key, pos, value) VALUES (?, ?, ?, ?)', batch)
+            batch = []
+    if batch:
+        with write_transaction(db_path):
+            conn.executemany('INSERT INTO records (collection, key, pos, value) VALUES (?, ?, ?, ?)', batch)
+    with write_transaction(db_path):
+        conn.execute('UPDATE collections SET size = ? WHERE name = ?', (count, name))
+    return count
@@ -0,0 +1,97 @@
+# static_files.py - Envío de los archivos de static/ (CSS, JS e imágenes subidas)
+#
+# Sustituye la vista del endpoint 'static' de Flask. STATIC_SEND_MODE elige quién transfiere
+# los bytes:
+#   'direct' (por defecto): Werkzeug, con Range y peticiones condicionales (ETag/304). El
+#       archivo se entrega con wsgi.file_wrapper, que en gunicorn usa os.sendfile: los bytes no
+#       pasan por Python.
+#   'x-sendfile': solo la cabecera X-Sendfile con la ruta (Apache mod_xsendfile, lighttpd).
+#   'x-accel': solo la cabecera X-Accel-Redirect hacia STATIC_ACCEL_PREFIX + ruta relativa
+#       (nginx, con un location 'internal' que apunte a static/).
+# En los dos últimos la aplicación solo resuelve la ruta y responde los 304; el proxy envía el
+# archivo, atiende los Range y el hilo del servidor queda libre enseguida.
+#
+# Caché: las imágenes guardadas por contenido (uploads/<aa>/<hash>.ext y sus miniaturas) no
+# cambian nunca y se sirven como immutable durante un año. url_for('static', ...) añade
+# ?v=<fecha del archivo> a CSS y JS, así que esas URLs también se cachean un año (solo si la
+# versión coincide con la actual); el resto de archivos (p. ej. las subidas antiguas, o una ?v=
+# obsoleta) usa STATIC_MAX_AGE y se revalida con el ETag.
+
+import os
+import re
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.security import safe_join
+from werkzeug.utils import send_from_directory
+
+SEND_MODES = ('direct', 'x-sendfile', 'x-accel')
+SEND_MODE = os.environ.get('STATIC_SEND_MODE', 'direct')
+ACCEL_PREFIX = os.environ.get('STATIC_ACCEL_PREFIX', '/_static/')
+STATIC_MAX_AGE = 3600
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_CONTENT_ADDRESSED_RE = re.compile(r'^uploads/(thumbs/)?[0-9a-f]{2}/[0-9a-f]{64}\.[a-z]+$')
+
+_versions = {}  # {filename: versión para ?v=}; se fija la primera vez, como la huella de http_cache
+
+def init_app(app):
+    """Instala la vista de static/ y el parámetro de versión de sus URLs."""
+    app.config.setdefault('STATIC_SEND_MODE', SEND_MODE)
+    app.config.setdefault('STATIC_ACCEL_PREFIX', ACCEL_PREFIX)
+    app.config.setdefault('STATIC_MAX_AGE', STATIC_MAX_AGE)
+    if app.config['STATIC_SEND_MODE'] not in SEND_MODES:
+        raise ValueError(f"STATIC_SEND_MODE debe ser uno de {SEND_MODES}: {app.config['STATIC_SEND_MODE']!r}")
+    app.view_functions['static'] = send_static
+    app.url_defaults(_add_static_version)
+
+def _static_version(filename):
+    version = _versions.get(filename)
+    if version is None:
+        path = safe_join(current_app.static_folder, filename)
+        try:
+            version = format(os.stat(path).st_mtime_ns // 10**6, 'x') if path else ''
+        except OSError:
+            version = ''
+        _versions[filename] = version
+    return version
+
+def _add_static_version(endpoint, values):
+    if endpoint == 'static' and 'v' not in values and not str(values.get('filename', '')).startswith('uploads/'):
+        version = _static_version(values.get('filename', ''))
+        if version:
+            values['v'] = version
+
+def _max_age(filename):
+    if _CONTENT_ADDRESSED_RE.match(filename):
+        return IMMUTABLE_MAX_AGE
+    # Solo la versión que genera url_for es inmutable: una ?v= antigua o inventada se revalida
+    version = request.args.get('v')
+    if version and not filename.startswith('uploads/') and version == _static_version(filename):
+        return IMMUTABLE_MAX_AGE
+    return current_app.config['STATIC_MAX_AGE']
+
+def send_static(filename):
+    """Vista de /static/<filename> (ver cabecera del módulo)."""
+    config = current_app.config
+    mode = config['STATIC_SEND_MODE']
+    max_age = _max_age(filename)
+    if mode == 'direct':
+        response = send_from_directory(current_app.static_folder, filename, request.environ, max_age=max_age,
+                                       response_class=current_app.response_class)
+    else:
+        # Las condiciones se resuelven aquí; los Range los atiende el proxy con el archivo completo
+        response = send_from_directory(current_app.static_folder, filename, request.environ, max_age=max_age,
+                                       response_class=current_app.response_class, use_x_sendfile=True,
+                                       conditional=False)
+        response = response.make_conditional(request.environ, accept_ranges=False)
+        path = response.headers.pop('X-Sendfile')
+        response.headers.pop('Content-Length', None)
+        if response.status_code != 304:
+            if mode == 'x-accel':
+                response.headers['X-Accel-Redirect'] = config['STATIC_ACCEL_PREFIX'] + quote(filename)
+            else:
+                response.headers['X-Sendfile'] = path
+    if max_age == IMMUTABLE_MAX_AGE:
+        response.cache_control.immutable = True
+    return response
@@ -0,0 +1,1001 @@
+# storage.py - Capa de almacenamiento de los archivos JSON de datos
+#
+# Todas las lecturas y escrituras de los archivos de 'data/' pasan por aquí:
+#  - Escrituras atómicas: se escribe en un archivo temporal del mismo directorio y se
+#    renombra con os.replace, así un lector nunca ve un archivo a medio escribir.
+#  - Bloqueo lector/escritor entre procesos (fcntl.flock) sobre un archivo '.lock' al lado
+#    del de datos, para que varios workers de gunicorn no pierdan actualizaciones.
+#  - Caché de lectura en memoria invalidada por la firma del archivo (mtime, tamaño, inodo).
+#  - Backend configurable: STORAGE_BACKEND=json (por defecto, archivos en 'data/') o
+#    STORAGE_BACKEND=sqlite (base de datos en SQLITE_PATH, ver sqlite_store.py). Las rutas
+#    de archivo siguen identificando cada colección, así el resto de la app no cambia.
+
+import itertools
+import json
+import os
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager, ExitStack, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin fcntl solo se serializan los hilos del proceso actual
+    fcntl = None
+
+import sqlite_store
+
+logger = logging.getLogger(__name__)
+
+# --- Configuración del backend ---
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json').lower()
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join('data', 'store.sqlite3'))
+
+def use_sqlite():
+    return STORAGE_BACKEND == 'sqlite'
+
+def collection_name(filepath):
+    """Nombre de la colección SQLite para una ruta de datos: 'data/users.json' -> 'data/users'."""
+    return os.path.splitext(os.path.normpath(filepath))[0].replace(os.sep, '/')
+
+# Valor que puede devolver un 'mutator' de update_json para indicar que no hubo cambios
+SKIP_WRITE = object()
+
+# --- Bloqueo entre procesos ---
+
+_local = threading.local()
+_thread_locks = {}  # Respaldo sin fcntl: un RLock por archivo
+_thread_locks_guard = threading.Lock()
+
+def _held_locks():
+    if not hasattr(_local, 'held'):
+        _local.held = {}  # {lockpath: [exclusivo, profundidad]}
+    return _local.held
+
+def _fallback_lock(lockpath):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(lockpath, threading.RLock())
+
+@contextmanager
+def file_lock(filepath, exclusive=True):
+    """
+    Bloquea 'filepath' para lectura (compartido) o escritura (exclusivo) entre procesos.
+    El bloqueo es reentrante dentro del mismo hilo; no se permite pasar de compartido a exclusivo.
+    """
+    lockpath = filepath + '.lock'
+    held = _held_locks()
+    current = held.get(lockpath)
+    if current is not None:
+        if exclusive and not current[0]:
+            raise RuntimeError(f"No se puede pasar de bloqueo compartido a exclusivo en {filepath}")
+        current[1] += 1
+        try:
+            yield
+        finally:
+            current[1] -= 1
+        return
+
+    directory = os.path.dirname(lockpath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if fcntl is None:
+        lock = _fallback_lock(lockpath)
+        lock.acquire()
+        held[lockpath] = [exclusive, 1]
+        try:
+            yield
+        finally:
+            del held[lockpath]
+            lock.release()
+        return
+
+    fd = os.open(lockpath, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        held[lockpath] = [exclusive, 1]
+        try:
+            yield
+        finally:
+            del held[lockpath]
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+# --- Caché de lectura en memoria ---
+
+_cache = {}  # {filepath: (firma, datos)}
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+
+def _signature(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def file_signature(filepath):
+    """Retorna la firma (mtime, tamaño, inodo) del archivo o None si no existe."""
+    try:
+        return _signature(os.stat(filepath))
+    except OSError:
+        return None
+
+def clone_json(value):
+    """Copia profunda de un objeto JSON (dict/list/escalares), más rápida que copy.deepcopy."""
+    if isinstance(value, dict):
+        return {k: clone_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [clone_json(v) for v in value]
+    return value
+
+def _cache_get(filepath, signature):
+    with _cache_lock:
+        entry = _cache.get(filepath)
+        if entry is not None and entry[0] == signature:
+            _cache_stats['hits'] += 1
+            return entry[1]
+        _cache_stats['misses'] += 1
+        return None
+
+def _cache_put(filepath, signature, data):
+    with _cache_lock:
+        if signature is None:
+            _cache.pop(filepath, None)
+        else:
+            _cache[filepath] = (signature, data)
+
+def get_cache_stats():
+    """Retorna los contadores de aciertos/fallos de la caché de lectura."""
+    with _cache_lock:
+        return dict(_cache_stats, entries=len(_cache))
+
+def clear_cache():
+    """Vacía la caché de lectura (por ejemplo, tras restaurar una copia de seguridad)."""
+    with _cache_lock:
+        _cache.clear()
+
+# --- Lectura y escritura ---
+
+def _read_shared(filepath, default_value):
+    """
+    Retorna los datos parseados del archivo (objeto compartido de la caché, NO modificar),
+    o None si el archivo no existe. La firma se toma del descriptor abierto, así siempre
+    corresponde exactamente al contenido leído.
+    """
+    signature = file_signature(filepath)
+    if signature is None:
+        return None
+    cached = _cache_get(filepath, signature)
+    if cached is not None:
+        return cached
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            signature = _signature(os.fstat(f.fileno()))
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        logger.error(f"Error al decodificar JSON desde {filepath}. El archivo podría estar corrupto. Se usará el valor por defecto.")
+        return default_value
+    if not isinstance(data, type(default_value)):
+        logger.warning(f"Contenido de {filepath} no es del tipo esperado. Se usará el valor por defecto.")
+        return default_value
+    _cache_put(filepath, signature, data)
+    return data
+
+def _prepare_temp(filepath, data, indent, ensure_ascii):
+    """Escribe 'data' en un temporal del mismo directorio que 'filepath' y retorna su ruta."""
+    directory = os.path.dirname(filepath) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filepath) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, ensure_ascii=ensure_ascii)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(filepath).st_mode & 0o777)
+        except OSError:
+            os.chmod(tmp_path, 0o644)
+    except BaseException:
+        _discard_temp(tmp_path)
+        raise
+    return tmp_path
+
+def _discard_temp(tmp_path):
+    try:
+        os.unlink(tmp_path)
+    except OSError:
+        pass
+
+def _install_temp(tmp_path, filepath, data):
+    """Renombra el temporal sobre 'filepath' y deja 'data' en la caché."""
+    os.replace(tmp_path, filepath)
+    _cache_put(filepath, file_signature(filepath), clone_json(data))
+
+def _write_atomic(filepath, data, indent, ensure_ascii):
+    """Escribe 'data' en un temporal del mismo directorio y lo renombra sobre 'filepath'."""
+    tmp_path = _prepare_temp(filepath, data, indent, ensure_ascii)
+    try:
+        _install_temp(tmp_path, filepath, data)
+    except BaseException:
+        _discard_temp(tmp_path)
+        raise
+
+# --- Operaciones ---
+# Toda modificación se expresa como una operación, para poder aplicarla directamente o
+# registrarla en una unidad de trabajo (ver transaction()) y repetirla al confirmar:
+#   ('replace', datos) | ('mutate', mutator) | ('put', clave, valor) | ('delete', clave)
+#   | ('update', clave, mutator) | ('append', valor) | ('remove', match, hint, on_removed)
+# 'append' y 'remove' son para colecciones tipo lista (ver append_item y remove_item).
+
+def _find_item(items, match, hint):
+    """Posición del primer elemento con match(elemento), probando antes la posición 'hint'; None si no hay."""
+    if isinstance(hint, int) and 0 <= hint < len(items) and match(items[hint]):
+        return hint
+    return next((i for i, item in enumerate(items) if match(item)), None)
+
+def _apply_op(data, op):
+    """Aplica 'op' sobre los datos completos. Retorna (datos, resultado, hubo_cambio)."""
+    kind = op[0]
+    if kind == 'replace':
+        return clone_json(op[1]), True, True
+    if kind == 'mutate':
+        result = op[1](data)
+        if result is SKIP_WRITE:
+            return data, None, False
+        return data, result, True
+    if kind == 'append':
+        data.append(clone_json(op[1]))
+        return data, len(data) - 1, True
+    if kind == 'remove':
+        _, match, hint, on_removed = op
+        pos = _find_item(data, match, hint)
+        if pos is None:
+            return data, None, False
+        removed = data.pop(pos)
+        if on_removed is not None:
+            on_removed(pos, data[pos:])
+        return data, removed, True
+    key = str(op[1])
+    value, result, changed = _apply_record_op(data.get(key), op)
+    if changed:
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+    return data, result, changed
+
+def _apply_record_op(value, op):
+    """Aplica una operación por clave sobre un solo valor. Retorna (nuevo_valor, resultado, hubo_cambio)."""
+    kind = op[0]
+    if kind == 'put':
+        return clone_json(op[2]), value, True
+    if kind == 'delete':
+        return None, value, value is not None
+    new_value = op[2](clone_json(value))
+    if new_value is SKIP_WRITE:
+        return value, value, False
+    return new_value, new_value, True
+
+def _load_fresh(filepath, default_value):
+    """Copia propia del contenido actual, sin crear el archivo si no existe."""
+    if use_sqlite():
+        data = sqlite_store.load_collection(SQLITE_PATH, collection_name(filepath))
+    else:
+        with file_lock(filepath, exclusive=False):
+            data = clone_json(_read_shared(filepath, default_value))
+    if data is None or not isinstance(data, type(default_value)):
+        return clone_json(default_value)
+    return data
+
+def _get_record_fresh(filepath, key):
+    if use_sqlite():
+        return sqlite_store.get_record(SQLITE_PATH, collection_name(filepath), key)
+    with file_lock(filepath, exclusive=False):
+        data = _read_shared(filepath, {})
+    if not isinstance(data, dict):
+        return None
+    return clone_json(data.get(str(key)))
+
+def _run_sqlite_op(name, default_value, op):
+    kind = op[0]
+    if kind == 'replace':
+        sqlite_store.save_collection(SQLITE_PATH, name, op[1])
+        return True
+    if kind == 'mutate':
+        return sqlite_store.update_collection(SQLITE_PATH, name, clone_json(default_value), op[1], SKIP_WRITE)
+    if kind == 'put':
+        return sqlite_store.put_record(SQLITE_PATH, name, op[1], op[2])
+    if kind == 'delete':
+        return sqlite_store.delete_record(SQLITE_PATH, name, op[1])
+    if kind == 'append':
+        return sqlite_store.append_item(SQLITE_PATH, name, op[1])
+    if kind == 'remove':
+        return sqlite_store.remove_item(SQLITE_PATH, name, *op[1:])
+    return sqlite_store.update_record(SQLITE_PATH, name, op[1], op[2], SKIP_WRITE)
+
+def _run_op(filepath, default_value, op, indent, ensure_ascii):
+    """Aplica una operación: dentro de la unidad de trabajo activa o directamente en disco."""
+    uow = getattr(_local, 'uow', None)
+    if uow is not None:
+        return uow.apply(filepath, default_value, op, indent, ensure_ascii)
+    if use_sqlite():
+        return _run_sqlite_op(collection_name(filepath), default_value, op)
+    with file_lock(filepath, exclusive=True):
+        if op[0] == 'replace':
+            _write_atomic(filepath, op[1], indent, ensure_ascii)
+            return True
+        data = _read_shared(filepath, default_value)
+        data = clone_json(default_value if data is None else data)
+        data, result, changed = _apply_op(data, op)
+        if changed:
+            _write_atomic(filepath, data, indent, ensure_ascii)
+        return result
+
+# --- Unidad de trabajo ---
+
+class _PendingFile:
+    """Estado de un archivo dentro de una unidad de trabajo: copia de trabajo y operaciones pendientes."""
+
+    def __init__(self, filepath, default_value, indent, ensure_ascii):
+        self.filepath = filepath
+        self.default_value = default_value
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        self.data = None     # Copia completa (solo si se pidió el archivo entero)
+        self.records = {}    # Registros sueltos leídos mientras no haya copia completa
+        self.ops = []
+        self.list_delta = 0  # Elementos añadidos menos quitados mientras no haya copia completa
+
+    def full(self):
+        if self.data is None:
+            data = _load_fresh(self.filepath, self.default_value)
+            for op in self.ops:
+                data = _apply_op(data, op)[0]
+            self.data = data
+            self.records = {}
+        return self.data
+
+    def record(self, key):
+        key = str(key)
+        if self.data is not None:
+            return self.data.get(key) if isinstance(self.data, dict) else None
+        if key not in self.records:
+            # Mientras no hay copia completa todas las operaciones registradas son por clave
+            value = _get_record_fresh(self.filepath, key)
+            for op in self.ops:
+                if str(op[1]) == key:
+                    value = _apply_record_op(value, op)[0]
+            self.records[key] = value
+        return self.records[key]
+
+    def _apply_list_op(self, op):
+        """
+        Con SQLite y sin copia completa, 'append' y el primer 'remove' se resuelven con consultas
+        sobre la lista guardada en vez de cargarla entera. Retorna (resultado, hubo_cambio) o
+        None si hay que usar la copia completa.
+        """
+        name = collection_name(self.filepath)
+        if op[0] == 'append':
+            position = sqlite_store.count_records(SQLITE_PATH, name) + self.list_delta
+            self.list_delta += 1
+            return position, True
+        if self.ops:
+            return None  # La lista guardada ya no es la de trabajo
+        _, match, hint, on_removed = op
+        found = sqlite_store.find_item(SQLITE_PATH, name, match, hint, on_removed is not None)
+        if found is None:
+            return None, False
+        pos, removed, tail = found
+        if on_removed is not None:
+            on_removed(pos, tail)
+        self.list_delta -= 1
+        return removed, True
+
+    def apply(self, op):
+        if op[0] in ('append', 'remove') and self.data is None and use_sqlite():
+            applied = self._apply_list_op(op)
+            if applied is not None:
+                result, changed = applied
+                if changed:
+                    self.ops.append(op)
+                return result
+        if op[0] in ('replace', 'mutate', 'append', 'remove') or self.data is not None:
+            self.data, result, changed = _apply_op(self.full(), op)
+        else:
+            key = str(op[1])
+            self.records[key], result, changed = _apply_record_op(self.record(key), op)
+        if changed:
+            self.ops.append(op)
+        return result
+
+class UnitOfWork:
+    """
+    Agrupa las lecturas y escrituras de una petición:
+      - Mapa de identidad: cada archivo se lee como mucho una vez.
+      - Las modificaciones se acumulan como operaciones sobre una copia de trabajo.
+      - commit() escribe cada archivo modificado exactamente una vez; si algo falla antes,
+        no se escribe nada.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.appends = []  # [(filepath, registro)] para los logs de solo-anexado
+        self.callbacks = []  # Funciones a llamar después de confirmar (ver after_commit)
+
+    def _state(self, filepath, default_value, indent=4, ensure_ascii=True):
+        state = self.files.get(filepath)
+        if state is None:
+            state = self.files[filepath] = _PendingFile(filepath, default_value, indent, ensure_ascii)
+        return state
+
+    def load(self, filepath, default_value):
+        return clone_json(self._state(filepath, default_value).full())
+
+    def get(self, filepath, key):
+        return clone_json(self._state(filepath, {}).record(key))
+
+    def apply(self, filepath, default_value, op, indent, ensure_ascii):
+        state = self._state(filepath, default_value, indent, ensure_ascii)
+        state.indent, state.ensure_ascii = indent, ensure_ascii
+        return clone_json(state.apply(op))
+
+    def pending_appends(self, filepath):
+        return [record for path, record in self.appends if path == filepath]
+
+    def commit(self):
+        dirty = sorted(((fp, st) for fp, st in self.files.items() if st.ops), key=lambda item: item[0])
+        if use_sqlite():
+            # Una sola transacción SQLite: todo o nada
+            with sqlite_store.write_transaction(SQLITE_PATH):
+                for filepath, state in dirty:
+                    for op in state.ops:
+                        _run_sqlite_op(collection_name(filepath), state.default_value, op)
+                for filepath, record in self.appends:
+                    append_log(filepath, record)
+        else:
+            self._commit_files(dirty)
+            # Los anexados van después de los archivos: un log nunca referencia datos no confirmados
+            for filepath, record in self.appends:
+                append_log(filepath, record)
+        for callback in self.callbacks:
+            callback()
+
+    def _commit_files(self, dirty):
+        if not dirty:
+            return
+        # JSON: bloqueos exclusivos en orden fijo (sin interbloqueos), se rehacen las operaciones
+        # sobre el contenido actual (sin perder escrituras de otros procesos), se preparan todos
+        # los temporales y solo entonces se renombran.
+        with ExitStack() as stack:
+            for filepath, _ in dirty:
+                stack.enter_context(file_lock(filepath, exclusive=True))
+            prepared = []
+            try:
+                for filepath, state in dirty:
+                    data = _read_shared(filepath, state.default_value)
+                    data = clone_json(state.default_value if data is None else data)
+                    for op in state.ops:
+                        data = _apply_op(data, op)[0]
+                    prepared.append((filepath, _prepare_temp(filepath, data, state.indent, state.ensure_ascii), data))
+            except BaseException:
+                for _, tmp_path, _ in prepared:
+                    _discard_temp(tmp_path)
+                raise
+            for filepath, tmp_path, data in prepared:
+                _install_temp(tmp_path, filepath, data)
+
+@contextmanager
+def transaction():
+    """
+    Unidad de trabajo para el hilo actual. Dentro del bloque, todas las funciones de este
+    módulo leen de la copia de trabajo y acumulan los cambios; al salir sin errores se
+    confirman, y si hay una excepción se descartan. Las transacciones anidadas se unen a la exterior.
+    """
+    if getattr(_local, 'uow', None) is not None:
+        yield _local.uow
+        return
+    uow = _local.uow = UnitOfWork()
+    try:
+        yield uow
+    except BaseException:
+        _local.uow = None
+        raise
+    _local.uow = None
+    uow.commit()
+
+def _current_uow():
+    return getattr(_local, 'uow', None)
+
+def after_commit(callback):
+    """
+    Llama a callback() cuando los cambios ya estén confirmados: al terminar la transacción en
+    curso (no se llama si se descarta) o de inmediato si no hay ninguna.
+    """
+    uow = _current_uow()
+    if uow is None:
+        callback()
+    else:
+        uow.callbacks.append(callback)
+
+# --- Logs de solo-anexado (JSON Lines) ---
+# Un registro por línea; añadir es una sola escritura al final del archivo en lugar de
+# reescribirlo entero. Con SQLite cada registro es una fila de 'log_entries'.
+
+_log_garbage = {}  # {filepath: líneas ilegibles vistas en la última lectura completa}
+
+def _encode_line(record):
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+def append_log(filepath, record):
+    """Añade un registro al final del log. Dentro de una transacción se aplaza hasta el commit."""
+    uow = _current_uow()
+    if uow is not None:
+        uow.appends.append((filepath, clone_json(record)))
+        return
+    if use_sqlite():
+        sqlite_store.append_log(SQLITE_PATH, collection_name(filepath), record)
+        return
+    directory = os.path.dirname(filepath)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    line = _encode_line(record)
+    with file_lock(filepath, exclusive=True):
+        with open(filepath, 'a+b') as f:
+            # Si un proceso murió a mitad de una línea, empezar en una línea nueva (y anotar que
+            # el log tiene una línea ilegible, para compactarlo)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    line = '\n' + line
+                    _log_garbage[filepath] = _log_garbage.get(filepath, 0) + 1
+            f.write(line.encode('utf-8'))
+
+def _parse_lines(filepath, lines):
+    records = []
+    garbage = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            garbage += 1
+    if garbage:
+        logger.warning(f"{garbage} líneas ilegibles en {filepath}; se eliminarán al compactar.")
+    return records, garbage
+
+def _read_log_tail(filepath, limit, block_size=65536):
+    """Lee hacia atrás desde el final del archivo hasta tener 'limit' líneas completas."""
+    with open(filepath, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        buf = b''
+        while position > 0 and buf.count(b'\n') <= limit:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            buf = f.read(step) + buf
+    lines = buf.decode('utf-8', errors='replace').splitlines()
+    if position > 0:
+        lines = lines[1:]  # La primera línea del búfer puede estar cortada
+    records, _ = _parse_lines(filepath, lines[-(limit * 2):])  # Margen por si hay líneas ilegibles
+    return records[-limit:]
+
+def read_log(filepath, tail=None):
+    """
+    Retorna los registros del log (copias propias). Con 'tail' solo los últimos 'tail'
+    registros, leyendo el archivo desde el final sin parsear el historial completo.
+    """
+    if tail is not None and tail <= 0:
+        return []
+    uow = _current_uow()
+    pending = uow.pending_appends(filepath) if uow is not None else []
+    if use_sqlite():
+        records = sqlite_store.read_log(SQLITE_PATH, collection_name(filepath), tail)
+    elif tail is not None:
+        with file_lock(filepath, exclusive=False):
+            try:
+                records = _read_log_tail(filepath, tail)
+            except FileNotFoundError:
+                records = []
+    else:
+        with file_lock(filepath, exclusive=False):
+            signature = file_signature(filepath)
+            if signature is None:
+                records = []
+            else:
+                cached = _cache_get(filepath, signature)
+                if cached is None:
+                    with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+                        signature = _signature(os.fstat(f.fileno()))
+                        cached, _log_garbage[filepath] = _parse_lines(filepath, f)
+                    _cache_put(filepath, signature, cached)
+                records = clone_json(cached)
+    records.extend(clone_json(pending))
+    if tail is not None:
+        return records[-tail:]
+    return records
+
+def _read_log_before(filepath, limit, end, block_size=65536):
+    """
+    Lee hacia atrás desde el byte 'end' (o el final) hasta tener 'limit' registros.
+    Retorna [(posición de inicio de la línea, registro)].
+    """
+    with open(filepath, 'rb') as f:
+        if end is None:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+        position = end
+        buf = b''
+        while position > 0 and buf.count(b'\n') <= limit:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            buf = f.read(step) + buf
+    entries = []
+    offset = position
+    for i, line in enumerate(buf.split(b'\n')):
+        start, offset = offset, offset + len(line) + 1
+        if (i == 0 and position > 0) or not line.strip():
+            continue  # La primera línea del búfer puede estar cortada
+        records, _ = _parse_lines(filepath, [line.decode('utf-8', errors='replace')])
+        entries.extend((start, record) for record in records)
+    return entries[-limit:]
+
+def read_log_page(filepath, limit, before=None):
+    """
+    Una página del log leída hacia atrás: los 'limit' registros anteriores al cursor 'before'
+    (los últimos si es None), sin parsear el resto del historial. Retorna (registros, cursor de
+    la página anterior o None si no hay más). El cursor es opaco: posición en el archivo (JSON)
+    o fila (SQLite). Lanza ValueError si no es válido o quedó obsoleto porque el log se reescribió.
+    """
+    if use_sqlite():
+        name = collection_name(filepath)
+        # Una fila de más para saber si quedan registros anteriores
+        rows = sqlite_store.read_log_page(SQLITE_PATH, name, limit + 1, int(before) if before is not None else None)
+        if before is not None and not rows:
+            raise ValueError(f"Cursor obsoleto para {filepath}: {before}")
+        more = len(rows) > limit
+        rows = rows[-limit:] if limit > 0 else []
+        records = [record for _, record in rows]
+        cursor = str(rows[0][0]) if rows and more else None
+    else:
+        end = None
+        if before is not None:
+            inode, _, offset = str(before).partition(':')
+            end = int(offset)
+        with file_lock(filepath, exclusive=False):
+            try:
+                inode_now = os.stat(filepath).st_ino
+                if before is not None and str(inode_now) != inode:
+                    raise ValueError(f"Cursor obsoleto para {filepath}: {before}")
+                entries = _read_log_before(filepath, limit, end)
+            except FileNotFoundError:
+                if before is not None:
+                    raise ValueError(f"Cursor obsoleto para {filepath}: {before}")
+                entries = []
+        records = [record for _, record in entries]
+        cursor = f'{inode_now}:{entries[0][0]}' if entries and entries[0][0] > 0 else None
+    if before is None:
+        uow = _current_uow()
+        if uow is not None:
+            records.extend(clone_json(uow.pending_appends(filepath)))
+    return records, cursor
+
+def log_needs_compaction(filepath):
+    """
+    True si la última lectura completa encontró líneas ilegibles o un anexado encontró una línea
+    cortada (una escritura interrumpida) en este proceso.
+    """
+    return bool(_log_garbage.get(filepath))
+
+def log_exists(filepath):
+    if use_sqlite():
+        return sqlite_store.log_exists(SQLITE_PATH, collection_name(filepath))
+    return os.path.exists(filepath)
+
+def list_logs(directory):
+    """Retorna las rutas de todos los logs '.jsonl' de un directorio."""
+    if use_sqlite():
+        prefix = collection_name(os.path.join(directory, 'x'))[:-1]
+        return [name + '.jsonl' for name in sqlite_store.list_logs(SQLITE_PATH, prefix)]
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names) if name.endswith('.jsonl')]
+
+def rewrite_log(filepath, records):
+    """Reemplaza el contenido completo del log de forma atómica (compactación, migración)."""
+    if use_sqlite():
+        sqlite_store.rewrite_log(SQLITE_PATH, collection_name(filepath), records)
+        return
+    directory = os.path.dirname(filepath) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with file_lock(filepath, exclusive=True):
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(filepath) + '.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(_encode_line(record))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            _discard_temp(tmp_path)
+            raise
+        _log_garbage.pop(filepath, None)
+
+def exclusive_access(filepath):
+    """
+    Acceso exclusivo a 'filepath' entre procesos para una lectura-modificación-escritura que
+    abarca varias llamadas: bloqueo exclusivo del archivo (JSON) o transacción de escritura (SQLite).
+    """
+    return sqlite_store.write_transaction(SQLITE_PATH) if use_sqlite() else file_lock(filepath, exclusive=True)
+
+def shared_access(filepath):
+    """
+    Impide que otro proceso modifique 'filepath' mientras dura el bloque (bloqueo compartido),
+    para una transacción que escribe otros archivos a partir de su contenido. Con SQLite no hace
+    falta: la confirmación de la transacción ya lee y escribe dentro de una misma transacción.
+    """
+    return nullcontext() if use_sqlite() else file_lock(filepath, exclusive=False)
+
+def compact_log(filepath, keep=None):
+    """
+    Compacta un log bajo bloqueo exclusivo: descarta líneas ilegibles y, si se indica,
+    los registros para los que keep(registro) es False. Retorna cuántos registros se eliminaron.
+    """
+    with exclusive_access(filepath):
+        records = read_log(filepath)
+        kept = [r for r in records if keep is None or keep(r)]
+        removed = len(records) - len(kept)
+        if removed or log_needs_compaction(filepath):
+            rewrite_log(filepath, kept)
+        return removed
+
+# --- API pública de lectura y escritura ---
+
+def load_json(filepath, default_value, create=True, indent=4, ensure_ascii=True):
+    """
+    Carga un archivo JSON bajo bloqueo compartido. Siempre retorna una copia que el llamador
+    puede modificar libremente. Si el archivo no existe y 'create' es True se crea con el
+    valor por defecto.
+    """
+    uow = _current_uow()
+    if uow is not None:
+        return uow.load(filepath, default_value)
+    if use_sqlite():
+        data = sqlite_store.load_collection(SQLITE_PATH, collection_name(filepath))
+        if data is None or not isinstance(data, type(default_value)):
+            return clone_json(default_value)
+        return data
+    with file_lock(filepath, exclusive=False):
+        data = _read_shared(filepath, default_value)
+    if data is None:
+        if create:
+            logger.info(f"Archivo no encontrado: {filepath}. Se creará con valor por defecto.")
+            save_json(filepath, default_value, indent=indent, ensure_ascii=ensure_ascii)
+        return clone_json(default_value)
+    return clone_json(data)
+
+def save_json(filepath, data, indent=4, ensure_ascii=True):
+    """Guarda 'data' de forma atómica bajo bloqueo exclusivo. Retorna True si tuvo éxito."""
+    try:
+        _run_op(filepath, data, ('replace', data), indent, ensure_ascii)
+        return True
+    except Exception as e:
+        _cache_put(filepath, None, None)
+        logger.error(f"Error al guardar datos en {filepath}: {e}")
+        return False
+
+def update_json(filepath, default_value, mutator, indent=4, ensure_ascii=True):
+    """
+    Lectura-modificación-escritura atómica: mantiene el bloqueo exclusivo durante toda la
+    operación, así dos procesos no pueden pisarse las actualizaciones.
+    'mutator' recibe los datos (copia propia), los modifica en sitio y su valor de retorno
+    se devuelve al llamador. Si retorna SKIP_WRITE no se escribe nada (y se retorna None).
+    Dentro de una transacción el mutator se aplica a la copia de trabajo y se vuelve a
+    ejecutar sobre el contenido actual al confirmar. Los errores de E/S se propagan.
+    """
+    return _run_op(filepath, default_value, ('mutate', mutator), indent, ensure_ascii)
+
+def json_exists(filepath):
+    """True si el archivo (o la colección, con SQLite) ya existe."""
+    if use_sqlite():
+        return sqlite_store.collection_exists(SQLITE_PATH, collection_name(filepath))
+    return os.path.exists(filepath)
+
+def list_json(directory):
+    """Retorna las rutas de todos los archivos '.json' de un directorio (colecciones, con SQLite)."""
+    if use_sqlite():
+        prefix = collection_name(os.path.join(directory, 'x'))[:-1]
+        return [name + '.json' for name in sqlite_store.list_collections(SQLITE_PATH, prefix)]
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names) if name.endswith('.json')]
+
+# --- Operaciones por registro (colecciones tipo diccionario) ---
+# Con SQLite tocan una sola fila; con JSON se sirven desde la caché copiando solo el registro
+# pedido, y las escrituras son una lectura-modificación-escritura bajo bloqueo.
+
+def get_record(filepath, key):
+    """Retorna una copia del registro 'key' o None si no existe."""
+    uow = _current_uow()
+    if uow is not None:
+        return uow.get(filepath, key)
+    return _get_record_fresh(filepath, key)
+
+def put_record(filepath, key, value, indent=4, ensure_ascii=True):
+    """Inserta o reemplaza el registro 'key'. Retorna el valor anterior (o None)."""
+    return _run_op(filepath, {}, ('put', key, value), indent, ensure_ascii)
+
+def update_record(filepath, key, mutator, indent=4, ensure_ascii=True):
+    """
+    Lectura-modificación-escritura atómica de un solo registro. 'mutator' recibe una copia
+    del valor actual (o None si no existe) y retorna el nuevo valor; si retorna SKIP_WRITE
+    no se escribe nada y si retorna None el registro se elimina. Retorna el valor resultante.
+    """
+    return _run_op(filepath, {}, ('update', key, mutator), indent, ensure_ascii)
+
+def delete_record(filepath, key, indent=4, ensure_ascii=True):
+    """Elimina el registro 'key'. Retorna el valor eliminado o None si no existía."""
+    return _run_op(filepath, {}, ('delete', key), indent, ensure_ascii)
+
+# --- Operaciones por elemento (colecciones tipo lista) ---
+# Con SQLite añadir o quitar un elemento toca solo esa fila (y, al quitar, las posiciones de las
+# posteriores) en lugar de reescribir la lista; con JSON son una lectura-modificación-escritura.
+
+def append_item(filepath, value, indent=4, ensure_ascii=True):
+    """Añade 'value' al final de una colección tipo lista. Retorna su posición."""
+    return _run_op(filepath, [], ('append', value), indent, ensure_ascii)
+
+def remove_item(filepath, match, hint=None, on_removed=None, indent=4, ensure_ascii=True):
+    """
+    Elimina de una lista el primer elemento con match(elemento) verdadero, probando antes la
+    posición 'hint'. Retorna el elemento eliminado o None si no había ninguno. Si se indica,
+    on_removed(posición, elementos posteriores) se llama cada vez que se aplica la operación
+    (dentro de una transacción, también al rehacerla al confirmar, como un mutator).
+    """
+    return _run_op(filepath, [], ('remove', match, hint, on_removed), indent, ensure_ascii)
+
+# --- Paginación ---
+
+def count_records(filepath):
+    """Número de registros de una colección (dict o list) sin copiar su contenido."""
+    if use_sqlite():
+        return sqlite_store.count_records(SQLITE_PATH, collection_name(filepath))
+    with file_lock(filepath, exclusive=False):
+        data = _read_shared(filepath, {})
+    return len(data) if isinstance(data, (dict, list)) else 0
+
+def page_records(filepath, limit, offset=0, after=None, reverse=False):
+    """
+    Retorna una porción de la colección como lista de pares (clave, valor), en orden de
+    inserción (o inverso con reverse=True). Para las listas la clave es el índice.
+    'after' es un cursor: la clave del último registro de la página anterior. Si no se
+    indica, o ya no existe, se salta 'offset' registros. Solo se copian los registros
+    de la página.
+    """
+    if use_sqlite():
+        return sqlite_store.page_records(SQLITE_PATH, collection_name(filepath), limit, offset, after, reverse)
+    with file_lock(filepath, exclusive=False):
+        data = _read_shared(filepath, {})
+    if not isinstance(data, (dict, list)) or not data:
+        return []
+    keys = range(len(data)) if isinstance(data, list) else data.keys()
+    ordered = lambda: reversed(keys) if reverse else iter(keys)
+    start = offset
+    if after is not None:
+        after = str(after)
+        # En memoria saltar 'offset' claves es barato: el cursor solo se busca si el registro
+        # anterior a la página ya no es el que indica (se insertó o borró algo entre medias)
+        previous = list(itertools.islice(ordered(), offset - 1, offset)) if offset > 0 else []
+        if not previous or str(previous[0]) != after:
+            found = next((i for i, key in enumerate(ordered()) if str(key) == after), None)
+            if found is not None:
+                start = found + 1
+    page = list(itertools.islice(ordered(), start, start + limit))
+    return [(key, clone_json(data[key])) for key in page]
+
+# --- Lectura en streaming ---
+
+def iter_records(filepath, start=0, batch_size=500):
+    """
+    Recorre una colección desde la posición 'start' sin cargarla entera, como pares
+    (clave, valor) igual que page_records. Con JSON se lee el archivo en streaming: el
+    archivo abierto es una versión completa aunque otro proceso lo reemplace mientras tanto
+    (las escrituras renombran uno nuevo). Con SQLite se lee por lotes de 'batch_size' filas.
+    """
+    if use_sqlite():
+        rows = page_records(filepath, batch_size, offset=start)
+        while rows:
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            rows = page_records(filepath, batch_size, after=rows[-1][0])
+        return
+    if not os.path.exists(filepath):
+        return
+    yield from itertools.islice(iter_json_items(filepath), start, None)
+
+def iter_json_items(filepath, chunk_size=65536):
+    """
+    Recorre el objeto o la lista de primer nivel de un archivo JSON sin cargarlo entero.
+    Produce pares (clave, valor) para objetos y (índice, valor) para listas; la memoria
+    usada es la de un elemento más el búfer de lectura.
+    """
+    decoder = json.JSONDecoder()
+    with open(filepath, 'r', encoding='utf-8') as f:
+        buf = ''
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n':
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def decode():
+            # Un valor que termina justo al final del búfer podría estar truncado (p. ej. un número)
+            nonlocal pos
+            while True:
+                skip_ws()
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        def expect(chars):
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buf) or buf[pos] not in chars:
+                raise ValueError(f"JSON inesperado en {filepath}: se esperaba uno de {chars!r}")
+            pos += 1
+            return buf[pos - 1]
+
+        opening = expect('{[')
+        closing = '}' if opening == '{' else ']'
+        skip_ws()
+        if pos < len(buf) and buf[pos] == closing:
+            return
+        index = 0
+        while True:
+            if opening == '{':
+                key = decode()
+                expect(':')
+            else:
+                key = index
+            yield key, decode()
+            index += 1
+            if expect(',' + closing) == closing:
+                return
+
+def json_kind(filepath):
+    """Retorna 'dict' o 'list' según el primer carácter significativo del archivo."""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                break
+    return {'{': 'dict', '[': 'list'}.get(ch)
@@ -0,0 +1,25 @@
+# template_registry.py - Plantillas definidas en código (cadenas) servidas por el cargador de Jinja
+#
+# Algunas vistas de administración guardan su HTML en constantes de Python. Registrarlas aquí
+# con un nombre permite renderizarlas con render_template: Jinja las compila una sola vez y las
+# guarda en su caché, como a las de templates/, en vez de recompilarlas en cada petición con
+# render_template_string. También se pueden extender o incluir por su nombre, y un archivo de
+# templates/ con el mismo nombre tiene prioridad sobre la versión registrada. Los nombres
+# llevan el prefijo 'inline/' para no chocar con los archivos existentes.
+
+from jinja2 import ChoiceLoader, DictLoader
+
+_sources = {}  # {nombre: código fuente}
+
+def register_template(name, source):
+    """Registra el código de una plantilla con 'name'. Retorna el nombre, para usarlo en render_template."""
+    if _sources.get(name, source) != source:
+        raise ValueError(f"Ya hay otra plantilla registrada como '{name}'")
+    _sources[name] = source
+    return name
+
+def init_app(app):
+    """Añade las plantillas registradas al cargador de la aplicación y las compila."""
+    app.jinja_loader = ChoiceLoader([app.jinja_loader, DictLoader(_sources)])
+    for name in _sources:
+        app.jinja_env.get_template(name)
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+from support import BACKENDS, use_data_dir
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return request.param
+
+@pytest.fixture
+def data_dir(tmp_path, backend):
+    """Directorio de datos vacío para la prueba, con cada uno de los backends."""
+    cwd = os.getcwd()
+    use_data_dir(str(tmp_path), backend)
+    yield tmp_path
+    os.chdir(cwd)
@@ -0,0 +1,46 @@
+# support.py - Utilidades comunes de las pruebas
+#
+# Cada prueba trabaja en un directorio vacío con su propia carpeta 'data/' (las rutas de
+# data_manager son relativas al directorio actual) y con el backend indicado. use_data_dir
+# también la llaman los procesos hijos de las pruebas de concurrencia antes de empezar.
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import storage
+import data_manager
+import data_manager_chat
+
+BACKENDS = ['json', 'sqlite']
+
+def use_data_dir(root, backend):
+    """Trabaja sobre root/data con el backend 'json' o 'sqlite' y sin estado de pruebas anteriores."""
+    os.makedirs(os.path.join(root, 'data'), exist_ok=True)
+    os.chdir(root)
+    storage.STORAGE_BACKEND = backend
+    storage.SQLITE_PATH = os.path.join(root, 'data', 'store.sqlite3')
+    storage.clear_cache()
+    data_manager._ready_indexes.clear()
+    data_manager._notifications_migrated = False
+    data_manager_chat._migrated = False
+    data_manager_chat._summaries_ready = False
+
+def add_product(product_id, stock, price=10.0, name=None):
+    product = {'id': str(product_id), 'name': name or f'Producto {product_id}', 'price': price, 'stock': stock,
+               'category': 'pruebas'}
+    assert data_manager.put_product(product)
+    return product
+
+def checkout(username, order_id, product_id, quantity, price=10.0):
+    """Registra un pedido como la ruta /checkout: pedido, compra y stock en una sola transacción."""
+    order = {'order_id': order_id, 'username': username, 'status': 'pending', 'order_date': f'2025-01-01 00:00:{order_id[-2:]}',
+             'total_price': price * quantity, 'items': [{'product_id': str(product_id), 'quantity': quantity, 'price': price}]}
+    with storage.transaction():
+        assert data_manager.put_order(order)
+        assert data_manager.add_user_purchase(dict(order))
+        data_manager.purchase_stock(username, product_id, quantity)
+    return order
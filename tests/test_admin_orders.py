@@ -0,0 +1,45 @@
+# Borrado de pedidos desde el panel de administración
+import pytest
+
+import data_manager
+import storage
+from support import add_product, checkout
+
+@pytest.fixture
+def admin_client(data_dir):
+    from app import app
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+    return client
+
+def complete(order_id):
+    assert data_manager.put_order(dict(data_manager.get_order(order_id), status='completed'))
+
+def test_admin_deletes_completed_order(admin_client):
+    add_product('1', stock=5)
+    for order_id in ('ord01', 'ord02', 'ord03'):
+        checkout('usuario1', order_id, '1', 1)
+    complete('ord02')
+
+    page = admin_client.get('/admin/orders')
+    assert page.status_code == 200
+    assert b'/admin/orders/delete/ord02' in page.data
+    assert b'/admin/orders/delete/ord01' not in page.data  # Pendiente: sin botón
+
+    response = admin_client.post('/admin/orders/delete/ord02')
+    assert response.status_code == 302
+    assert data_manager.get_order('ord02') is None
+    assert [o['order_id'] for o in data_manager.get_user_orders('usuario1')] == ['ord03', 'ord01']
+    purchases = data_manager.load_user_purchases()
+    assert [p['order_id'] for p in purchases] == ['ord01', 'ord03']
+    assert storage.load_json(data_manager.PURCHASE_POSITIONS_FILE, {}) == data_manager._build_purchase_positions(purchases)
+    assert data_manager.get_stats()['orders'] == 2
+
+def test_admin_cannot_delete_pending_order(admin_client):
+    add_product('1', stock=5)
+    checkout('usuario1', 'ord01', '1', 1)
+    assert admin_client.post('/admin/orders/delete/ord01').status_code == 302
+    assert admin_client.post('/admin/orders/delete/nada').status_code == 302
+    assert data_manager.get_order('ord01') is not None
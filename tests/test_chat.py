@@ -0,0 +1,55 @@
+# Resúmenes de conversación tras compactar el log
+import os
+
+import pytest
+
+import data_manager_chat
+from support import use_data_dir
+
+def summary(username):
+    return next((s for s in data_manager_chat.get_chat_summaries() if s['username'] == username), None)
+
+def test_compaction_recomputes_summary_from_kept_messages(data_dir):
+    for text in ('hola', 'pedido listo', 'borrar 1', 'borrar 2'):
+        data_manager_chat.add_chat_message('usuario1', 'user', text)
+    data_manager_chat.mark_chat_read_by_admin('usuario1')
+
+    assert data_manager_chat.compact_user_chat('usuario1', lambda msg: not msg['text'].startswith('borrar')) == 2
+    current = summary('usuario1')
+    assert current['count'] == 2
+    assert current['last_text'] == 'pedido listo'
+    assert current['unread_admin'] == 0  # Sigue leída
+    rebuilt = data_manager_chat._summarize(data_manager_chat.get_user_chat('usuario1'))
+    assert {k: current[k] for k in ('count', 'last_text', 'last_from', 'last_timestamp')} == \
+        {k: rebuilt[k] for k in ('count', 'last_text', 'last_from', 'last_timestamp')}
+
+def test_compaction_of_every_message_drops_summary(data_dir):
+    data_manager_chat.add_chat_message('usuario1', 'user', 'hola')
+    assert data_manager_chat.compact_user_chat('usuario1', lambda msg: False) == 1
+    assert summary('usuario1') is None
+
+@pytest.fixture
+def json_data_dir(tmp_path):
+    """Solo JSON: las líneas cortadas existen en los logs JSONL, no en SQLite."""
+    cwd = os.getcwd()
+    use_data_dir(str(tmp_path), 'json')
+    yield tmp_path
+    os.chdir(cwd)
+
+def test_torn_line_is_compacted_on_write_not_on_read(json_data_dir):
+    data_manager_chat.add_chat_message('usuario1', 'user', 'hola')
+    path = data_manager_chat._chat_log_path('usuario1')
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"from": "user", "text": "cort')  # Escritura interrumpida
+    with open(path, encoding='utf-8') as f:
+        torn = f.read()
+
+    assert [m['text'] for m in data_manager_chat.get_user_chat('usuario1')] == ['hola']
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == torn  # Leer no reescribe el log
+
+    data_manager_chat.add_chat_message('usuario1', 'admin', 'respuesta')
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2 and 'cort' not in ''.join(lines)
+    assert summary('usuario1')['count'] == 2
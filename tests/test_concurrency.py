@@ -0,0 +1,40 @@
+# Escrituras concurrentes desde varios procesos (como varios workers de gunicorn)
+#
+# Cada proceso añade al carrito y crea notificaciones sobre los mismos archivos; con los
+# bloqueos de storage ninguna actualización se pierde, así que los totales son exactos.
+import multiprocessing
+
+import data_manager
+from support import use_data_dir
+
+PROCESSES = 4
+ROUNDS = 25
+
+def _worker(root, backend, worker_id, start):
+    use_data_dir(root, backend)
+    start.wait()
+    for i in range(ROUNDS):
+        assert data_manager.add_to_cart('1', 1, username='usuario1')
+        assert data_manager.add_to_cart(str(worker_id), 2, username='usuario2')
+        assert data_manager.add_notification('usuario1', f'proceso {worker_id}, aviso {i}')
+
+def test_concurrent_cart_and_notifications(data_dir, backend):
+    # 'spawn': procesos sin el estado del proceso de pruebas, como workers independientes
+    context = multiprocessing.get_context('spawn')
+    start = context.Event()
+    workers = [context.Process(target=_worker, args=(str(data_dir), backend, n, start)) for n in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join(timeout=120)
+        assert worker.exitcode == 0
+
+    use_data_dir(str(data_dir), backend)
+    carts = data_manager.load_user_carts()
+    assert carts['usuario1'] == {'1': PROCESSES * ROUNDS}
+    assert carts['usuario2'] == {str(n): 2 * ROUNDS for n in range(PROCESSES)}
+    notifications = data_manager.get_user_notifications('usuario1')
+    assert len(notifications) == PROCESSES * ROUNDS
+    assert len({n['id'] for n in notifications}) == PROCESSES * ROUNDS
+    assert data_manager.count_unread_notifications('usuario1') == PROCESSES * ROUNDS
@@ -0,0 +1,43 @@
+# Índices derivados (orders_by_user, stats...) creados dentro de una transacción que se descarta
+import pytest
+
+import storage
+import data_manager
+from data_manager import OutOfStockError
+from support import checkout
+
+def seed(orders=2):
+    """Datos escritos sin pasar por data_manager, como un data/ existente sin índices todavía."""
+    storage.save_json(data_manager.USERS_FILE, {'usuario1': {'username': 'usuario1', 'email': 'u1@x.com'},
+                                                 'usuario2': {'username': 'usuario2', 'email': 'u2@x.com'}})
+    storage.save_json(data_manager.PRODUCTS_FILE, {'1': {'id': '1', 'name': 'Tablero', 'price': 10.0, 'stock': 3}})
+    storage.save_json(data_manager.ORDERS_FILE, {
+        f'old{i:02d}': {'order_id': f'old{i:02d}', 'username': 'usuario1', 'status': 'completed',
+                        'order_date': f'2024-12-0{i + 1}', 'total_price': 10.0}
+        for i in range(orders)
+    })
+
+def test_orders_index_survives_rolled_back_checkout(data_dir):
+    seed()
+    with pytest.raises(OutOfStockError):
+        checkout('usuario1', 'new01', '1', 5)
+    assert not storage.json_exists(data_manager.ORDERS_BY_USER_FILE)
+    checkout('usuario1', 'new02', '1', 1)
+
+    orders = data_manager.load_orders()
+    assert len(orders) == 3
+    assert storage.load_json(data_manager.ORDERS_BY_USER_FILE, {}) == data_manager._build_orders_by_user(orders)
+    assert [o['order_id'] for o in data_manager.get_user_orders('usuario1')] == ['new02', 'old01', 'old00']
+
+def counters(stats):
+    return {key: value for key, value in stats.items() if key != 'recent_notifications'}
+
+def test_stats_survive_rolled_back_checkout(data_dir):
+    seed()
+    with pytest.raises(OutOfStockError):
+        checkout('usuario1', 'new01', '1', 5)
+    checkout('usuario1', 'new02', '1', 1)
+
+    stats = counters(data_manager.get_stats())
+    assert stats == counters(data_manager._build_stats())
+    assert stats['orders'] == 3 and stats['pending_orders'] == 1 and stats['users'] == 2 and stats['products'] == 1
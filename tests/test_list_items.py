@@ -0,0 +1,54 @@
+# append_item / remove_item: compras y notificaciones sin reescribir la colección entera
+import storage
+import data_manager
+from support import checkout, add_product
+
+def test_append_and_remove_items(data_dir):
+    path = data_manager.USER_PURCHASES_FILE
+    assert [storage.append_item(path, {'n': n}) for n in range(4)] == [0, 1, 2, 3]
+    moved = []
+    removed = storage.remove_item(path, lambda item: item['n'] == 1, hint=3, on_removed=lambda pos, tail: moved.append((pos, tail)))
+    assert removed == {'n': 1}
+    assert moved == [(1, [{'n': 2}, {'n': 3}])]
+    assert storage.remove_item(path, lambda item: item['n'] == 9) is None
+    assert storage.load_json(path, []) == [{'n': 0}, {'n': 2}, {'n': 3}]
+    assert storage.append_item(path, {'n': 4}) == 3
+
+def test_list_ops_in_transaction(data_dir):
+    path = data_manager.USER_PURCHASES_FILE
+    for n in range(3):
+        storage.append_item(path, {'n': n})
+    try:
+        with storage.transaction():
+            assert storage.append_item(path, {'n': 3}) == 3
+            assert storage.remove_item(path, lambda item: item['n'] == 0) == {'n': 0}
+            assert storage.append_item(path, {'n': 4}) == 3
+            raise RuntimeError('descartar')
+    except RuntimeError:
+        pass
+    assert storage.load_json(path, []) == [{'n': 0}, {'n': 1}, {'n': 2}]
+
+    with storage.transaction():
+        assert storage.remove_item(path, lambda item: item['n'] == 0) == {'n': 0}
+        assert storage.append_item(path, {'n': 3}) == 2
+    assert storage.load_json(path, []) == [{'n': 1}, {'n': 2}, {'n': 3}]
+
+def test_purchase_positions_after_removal(data_dir):
+    add_product('1', stock=10)
+    for i in range(4):
+        checkout('usuario1', f'ord{i:02d}', '1', 1)
+    assert data_manager.remove_user_purchase('ord01')
+    assert not data_manager.remove_user_purchase('ord01')
+
+    purchases = data_manager.load_user_purchases()
+    assert [p['order_id'] for p in purchases] == ['ord00', 'ord02', 'ord03']
+    positions = storage.load_json(data_manager.PURCHASE_POSITIONS_FILE, {})
+    assert positions == data_manager._build_purchase_positions(purchases)
+
+def test_notifications_append_and_dismiss(data_dir):
+    for n in range(3):
+        assert data_manager.add_notification('usuario1', f'aviso {n}')
+    notifications = data_manager.get_user_notifications('usuario1')
+    assert len(notifications) == 3
+    assert data_manager.dismiss_notification('usuario1', notifications[0]['id'])
+    assert len(data_manager.get_user_notifications('usuario1')) == 2
@@ -0,0 +1,50 @@
+# Alta de productos: IDs reservados con un contador, sin leer el catálogo
+import threading
+
+import pytest
+
+import data_manager
+from data_manager import ProductConflictError
+from support import add_product
+
+def test_allocate_product_id_continues_after_existing_ids(data_dir):
+    add_product('7', stock=1)
+    add_product('12', stock=1)
+    assert [data_manager.allocate_product_id() for _ in range(3)] == [13, 14, 15]
+
+def test_concurrent_allocations_are_unique(data_dir):
+    add_product('1', stock=1)
+    ids = []
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        for _ in range(10):
+            ids.append(data_manager.allocate_product_id())
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ids) == list(range(2, 82))
+
+def test_create_never_replaces_existing_product(data_dir):
+    add_product('1', stock=5, name='Original')
+    with pytest.raises(ProductConflictError):
+        data_manager.put_product({'id': '1', 'name': 'Otro', 'price': 1.0, 'stock': 1}, create=True)
+    assert data_manager.get_product('1')['name'] == 'Original'
+    assert data_manager.get_stats()['products'] == 1
+
+def test_admin_add_product(data_dir):
+    from app import app
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+    add_product('3', stock=1)
+    form = {'name': 'Letrero', 'description': 'LED', 'price': '20', 'stock': '4', 'category': 'led'}
+    assert client.post('/admin/products/add', data=form).status_code == 302
+    assert client.post('/admin/products/add', data=dict(form, name='Letrero 2')).status_code == 302
+    assert data_manager.get_product('4')['name'] == 'Letrero'
+    assert data_manager.get_product('5')['name'] == 'Letrero 2'
@@ -0,0 +1,34 @@
+# Caché de los archivos de static/ (static_files)
+import pytest
+
+import static_files
+
+CSS = 'css/admin_chat.css'
+LEGACY_UPLOAD = 'uploads/usuario1_20250702111349_led_2.png'
+
+@pytest.fixture
+def client():
+    from app import app
+    app.config.update(TESTING=True)
+    return app.test_client()
+
+def cache_control(response):
+    return response.headers['Cache-Control']
+
+def test_current_version_is_immutable(client):
+    from app import app
+    with app.test_request_context():
+        url = app.url_for('static', filename=CSS)
+    assert '?v=' in url
+    response = client.get(url)
+    assert response.status_code == 200
+    assert f'max-age={static_files.IMMUTABLE_MAX_AGE}' in cache_control(response)
+    assert 'immutable' in cache_control(response)
+
+@pytest.mark.parametrize('filename', [CSS, LEGACY_UPLOAD])
+def test_other_versions_are_revalidated(client, filename):
+    for query in ('', '?v=0', '?v=inventada'):
+        response = client.get(f'/static/{filename}{query}')
+        assert response.status_code == 200
+        assert f'max-age={static_files.STATIC_MAX_AGE}' in cache_control(response)
+        assert 'immutable' not in cache_control(response)
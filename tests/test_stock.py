@@ -0,0 +1,54 @@
+# purchase_stock desde varios hilos a la vez: nunca se vende más que el stock
+import threading
+
+import data_manager
+import storage
+from data_manager import OutOfStockError
+from support import add_product
+
+THREADS = 8
+ATTEMPTS = 10
+STOCK = 25
+
+def test_concurrent_purchases_never_oversell(data_dir):
+    add_product('1', stock=STOCK)
+    catalog_version = data_manager.get_catalog_version()
+    sold = [0] * THREADS
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def worker(i):
+        start.wait()
+        for _ in range(ATTEMPTS):
+            try:
+                with storage.transaction():
+                    data_manager.purchase_stock(f'usuario{i}', '1', 1)
+                sold[i] += 1
+            except OutOfStockError:
+                pass
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert sum(sold) == STOCK
+    product = data_manager.get_product('1')
+    assert product['stock'] == 0
+    assert product['version'] == STOCK + 1
+    assert data_manager.get_catalog_version() == catalog_version + 1  # Solo la venta que lo agotó
+
+def test_catalog_version_changes_only_when_sold_out(data_dir):
+    add_product('1', stock=3)
+    version = data_manager.get_catalog_version()
+    with storage.transaction():
+        data_manager.purchase_stock('usuario1', '1', 2)
+    assert data_manager.get_catalog_version() == version
+    with storage.transaction():
+        data_manager.purchase_stock('usuario2', '1', 1)
+    assert data_manager.get_catalog_version() == version + 1
+    assert data_manager.get_catalog_changes(version) == (version + 1, ['1'])
@@ -0,0 +1,111 @@
+# Limpieza de imágenes subidas sin referencias (upload_gc)
+import hashlib
+import os
+import time
+
+import data_manager
+import storage
+import upload_gc
+import uploads
+from support import add_product
+
+OLD = 48   # Horas: fuera del periodo de gracia
+RECENT = 1
+
+def digest(name):
+    return hashlib.sha256(name.encode()).hexdigest()
+
+def upload_file(rel, hours_old):
+    """Crea static/uploads/<rel> con una fecha de modificación de hace 'hours_old' horas."""
+    path = os.path.join(uploads.UPLOAD_DIR, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * 10)
+    mtime = time.time() - hours_old * 3600
+    os.utime(path, (mtime, mtime))
+    return rel
+
+def original(name, hours_old=OLD):
+    d = digest(name)
+    return upload_file(f'{d[:2]}/{d}.png', hours_old)
+
+def thumbnail(name, hours_old=OLD):
+    d = digest(name)
+    return upload_file(f'{uploads.THUMBS_SUBDIR}/{d[:2]}/{d}.webp', hours_old)
+
+def url(rel):
+    return f'{uploads.UPLOAD_URL}/{rel}'
+
+def exists(rel):
+    return os.path.exists(os.path.join(uploads.UPLOAD_DIR, rel))
+
+def quarantined(rel):
+    return os.path.exists(os.path.join(upload_gc.QUARANTINE_DIR, rel))
+
+def checkpoint():
+    return storage.load_json(upload_gc.GC_STATE_FILE, {}, create=False).get('checkpoint')
+
+def test_grace_period_keeps_recent_orphans(data_dir):
+    old, recent = original('viejo'), original('nuevo', RECENT)
+    result = upload_gc.collect_garbage(max_shards=None)
+    assert result['removed'] == 1 and result['bytes_reclaimed'] == 10
+    assert not exists(old) and quarantined(old)
+    assert exists(recent)
+
+def test_referenced_original_keeps_its_thumbnail(data_dir):
+    used, used_thumb = original('usado'), thumbnail('usado')
+    orphan_thumb = thumbnail('huerfano')
+    add_product('1', stock=1)
+    data_manager.put_product(dict(data_manager.get_product('1'), image_url=url(used)))
+
+    upload_gc.collect_garbage(max_shards=None, delete=True)
+    assert exists(used) and exists(used_thumb)
+    assert not exists(orphan_thumb) and not quarantined(orphan_thumb)
+
+def test_images_in_order_history_are_kept(data_dir):
+    bought, current = original('comprado'), original('actual')
+    add_product('1', stock=1)
+    data_manager.put_product(dict(data_manager.get_product('1'), image_url=url(current)))
+    order = {'order_id': 'ord01', 'username': 'usuario1', 'status': 'completed', 'order_date': '2025-01-01 00:00:00',
+             'total_price': 10.0, 'items': [{'product_id': '1', 'quantity': 1, 'price': 10.0, 'image_url': url(bought)}]}
+    assert data_manager.put_order(order)
+    assert data_manager.add_user_purchase(dict(order))
+    in_purchase = original('solo en compras')
+    purchase = dict(order, order_id='ord02', items=[dict(order['items'][0], image_url=url(in_purchase))])
+    assert data_manager.add_user_purchase(purchase)
+
+    assert upload_gc.collect_garbage(max_shards=None)['removed'] == 0
+    assert exists(bought) and exists(current) and exists(in_purchase)
+
+def test_stale_temp_files_are_collected(data_dir):
+    stale = upload_file('ab/.subida-1.tmp', OLD)
+    in_progress = upload_file('ab/.subida-2.tmp', RECENT)
+    upload_gc.collect_garbage(max_shards=None)
+    assert not exists(stale) and not quarantined(stale)  # Los temporales se borran, no se apartan
+    assert exists(in_progress)
+
+def test_checkpoint_advances_and_wraps(data_dir):
+    for shard in ('00', '11', '22'):
+        os.makedirs(os.path.join(uploads.UPLOAD_DIR, shard))
+
+    first = upload_gc.collect_garbage(max_shards=2)
+    assert (first['shards'], first['next_shard'], first['cycle_complete']) == (2, '11', False)
+    assert checkpoint() == '00'
+
+    second = upload_gc.collect_garbage(max_shards=2)
+    assert (second['shards'], second['next_shard'], second['cycle_complete']) == (2, None, True)
+    assert checkpoint() is None
+
+    third = upload_gc.collect_garbage(max_shards=2)
+    assert (third['shards'], third['next_shard']) == (2, '11')  # Vuelve a empezar por la raíz
+
+def test_dry_run_changes_nothing(data_dir):
+    os.makedirs(os.path.join(uploads.UPLOAD_DIR, '00'))
+    old = original('viejo')
+    upload_gc.collect_garbage(max_shards=1)
+    state = storage.load_json(upload_gc.GC_STATE_FILE, {}, create=False)
+
+    result = upload_gc.collect_garbage(max_shards=None, dry_run=True)
+    assert result['removed'] == 1
+    assert exists(old) and not quarantined(old)
+    assert storage.load_json(upload_gc.GC_STATE_FILE, {}, create=False) == state
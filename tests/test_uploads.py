@@ -0,0 +1,119 @@
+# Subidas guardadas por contenido y sus miniaturas
+import hashlib
+import io
+import os
+
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import uploads
+
+GIF = b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00' \
+      b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+
+def upload(data, ext):
+    return uploads.save_upload(FileStorage(stream=io.BytesIO(data), filename=f'imagen.{ext}'), ext)
+
+def local_path(url):
+    return os.path.join(uploads.UPLOAD_DIR, url[len(uploads.UPLOAD_URL) + 1:])
+
+def png(size):
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(out, 'PNG')
+    return out.getvalue()
+
+def test_upload_is_stored_by_content(data_dir):
+    url, _ = upload(GIF, 'gif')
+    digest = hashlib.sha256(GIF).hexdigest()
+    assert url == f'{uploads.UPLOAD_URL}/{digest[:2]}/{digest}.gif'
+    with open(local_path(url), 'rb') as f:
+        assert f.read() == GIF
+    assert upload(GIF, 'gif')[0] == url  # La misma imagen reutiliza el archivo
+
+@pytest.mark.skipif(uploads.THUMB_FORMAT is None, reason='Pillow no está instalado')
+def test_thumbnail_generated_after_upload(data_dir):
+    url, thumb_url = upload(png((1200, 800)), 'png')
+    assert thumb_url is not None
+    uploads.wait_for_thumbnails()
+
+    from PIL import Image
+    with Image.open(local_path(thumb_url)) as thumb:
+        assert thumb.format.lower() == uploads.THUMB_FORMAT
+        assert thumb.width <= uploads.THUMB_SIZE[0] and thumb.height <= uploads.THUMB_SIZE[1]
+        assert thumb.width / thumb.height == pytest.approx(1200 / 800, rel=0.02)
+
+
+# --- Recepción en streaming con UploadRequest ---
+
+MAX_BYTES = 64 * 1024
+
+def upload_app():
+    app = Flask(__name__)
+    app.request_class = uploads.UploadRequest
+    app.config['MAX_CONTENT_LENGTH'] = MAX_BYTES
+
+    @app.route('/upload', methods=['POST'])
+    def receive():
+        image = request.files.get('image')
+        url, _ = uploads.save_upload(image, image.stream.ext)
+        return jsonify(url=url)
+
+    return app
+
+class CountingStream(io.BytesIO):
+    """wsgi.input que anota cuántos bytes del cuerpo se llegaron a leer."""
+
+    consumed = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.consumed += len(data)
+        return data
+
+def post_image(data, filename='imagen.png', mimetype='image/png', truncate=0):
+    """Envía 'data' como el campo 'image'. Retorna (código de estado, cuerpo, bytes leídos, bytes enviados)."""
+    environ = EnvironBuilder(method='POST', path='/upload',
+                             data={'image': (io.BytesIO(data), filename, mimetype)}).get_environ()
+    body = environ['wsgi.input'].read()
+    stream = CountingStream(body[:len(body) - truncate])  # Con truncate el cliente corta el envío
+    environ['wsgi.input'] = stream
+    app_iter, status, _ = run_wsgi_app(upload_app(), environ, buffered=True)
+    return int(status.split()[0]), b''.join(app_iter), stream.consumed, len(body)
+
+def temp_files():
+    if not os.path.isdir(uploads.UPLOAD_DIR):
+        return []
+    return [name for name in os.listdir(uploads.UPLOAD_DIR) if name.endswith('.tmp')]
+
+def test_streamed_upload_is_stored(data_dir):
+    status, body, _, _ = post_image(GIF, filename='imagen.gif', mimetype='image/gif')
+    assert status == 200
+    digest = hashlib.sha256(GIF).hexdigest()
+    assert digest.encode() in body
+    assert os.path.exists(os.path.join(uploads.UPLOAD_DIR, digest[:2], f'{digest}.gif'))
+    assert temp_files() == []
+
+def test_bad_signature_is_rejected_early(data_dir):
+    status, _, consumed, sent = post_image(b'esto no es una imagen ' * 2000)
+    assert status == 415
+    assert consumed < sent  # Se corta en el primer bloque, sin leer el resto del cuerpo
+    assert temp_files() == []
+
+def test_bad_extension_is_rejected(data_dir):
+    status, _, _, _ = post_image(GIF, filename='imagen.txt', mimetype='text/plain')
+    assert status == 415
+    assert temp_files() == []
+
+def test_too_large_upload_is_rejected(data_dir):
+    status, _, consumed, _ = post_image(GIF + b'\0' * MAX_BYTES)
+    assert status == 413
+    assert consumed == 0  # MAX_CONTENT_LENGTH se comprueba antes de leer el cuerpo
+    assert temp_files() == []
+
+def test_aborted_upload_leaves_no_temp_file(data_dir):
+    status, _, _, _ = post_image(GIF + b'\0' * 10000, filename='imagen.gif', mimetype='image/gif', truncate=5000)
+    assert status == 400
+    assert temp_files() == []
@@ -0,0 +1,157 @@
+# upload_gc.py - Limpieza de las imágenes subidas que ya no se usan
+#
+# Una pasada en streaming por los mensajes del chat (image_url y thumb_url), el catálogo
+# (image_url de cada producto) y los artículos de pedidos y compras (conservan la imagen que
+# tenía el producto al comprarlo) forma el conjunto de archivos referenciados. Después se revisan
+# las carpetas de static/uploads (la raíz con las subidas antiguas, los shards '00'..'ff' y los
+# de thumbs/): un archivo sin referencias y con más de GRACE_HOURS se mueve a QUARANTINE_DIR
+# (o se borra con delete=True). Una miniatura se conserva mientras su original (mismo hash)
+# esté referenciado; los temporales de subidas interrumpidas también se recogen.
+#
+# Cada ejecución revisa como mucho SHARDS_PER_RUN carpetas y guarda en GC_STATE_FILE la última
+# revisada, así que el recorrido de todos los archivos se reparte entre varias ejecuciones.
+# El periodo de gracia protege las subidas cuyo mensaje aún no se ha guardado: save_upload
+# actualiza la fecha del archivo también cuando reutiliza uno que ya existía.
+
+import logging
+import os
+import posixpath
+import shutil
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from data_manager import DATA_DIR, ORDERS_FILE, PRODUCTS_FILE, USER_PURCHASES_FILE
+from data_manager_chat import iter_chat_messages
+import storage
+import uploads
+
+logger = logging.getLogger(__name__)
+
+GC_STATE_FILE = os.path.join(DATA_DIR, 'upload_gc.json')
+QUARANTINE_DIR = os.path.join(DATA_DIR, 'uploads_quarantine')
+GRACE_HOURS = 24
+SHARDS_PER_RUN = 32
+
+# Una sola limpieza a la vez, también entre procesos
+_RUN_LOCK = GC_STATE_FILE + '.run'
+
+def _upload_path(url):
+    """Ruta relativa a UPLOAD_DIR ('ab/<hash>.png') de una URL de static/uploads, o None si apunta a otro sitio."""
+    if not isinstance(url, str) or not url:
+        return None
+    path = urlparse(url).path
+    prefix = uploads.UPLOAD_URL + '/'
+    if not path.startswith(prefix):
+        return None
+    return posixpath.normpath(path[len(prefix):])
+
+def _digest(name):
+    return name.split('.', 1)[0]
+
+def referenced_uploads():
+    """Retorna (rutas referenciadas, hashes de los originales referenciados) en una pasada por chats, productos y pedidos."""
+    paths = set()
+    for _, msg in iter_chat_messages():
+        if isinstance(msg, dict):
+            for field in ('image_url', 'thumb_url'):
+                path = _upload_path(msg.get(field))
+                if path:
+                    paths.add(path)
+    for _, product in storage.iter_records(PRODUCTS_FILE):
+        if isinstance(product, dict):
+            path = _upload_path(product.get('image_url'))
+            if path:
+                paths.add(path)
+    for filepath in (ORDERS_FILE, USER_PURCHASES_FILE):
+        for _, order in storage.iter_records(filepath):
+            items = order.get('items') if isinstance(order, dict) else None
+            for item in items if isinstance(items, list) else []:
+                path = _upload_path(item.get('image_url')) if isinstance(item, dict) else None
+                if path:
+                    paths.add(path)
+    digests = {_digest(posixpath.basename(path)) for path in paths if not path.startswith(uploads.THUMBS_SUBDIR + '/')}
+    return paths, digests
+
+def _shards():
+    """Carpetas a revisar en orden estable: '' (raíz), '00'..'ff' y 'thumbs/00'..'thumbs/ff'."""
+    shards = ['']
+    for base in ('', uploads.THUMBS_SUBDIR):
+        directory = os.path.join(uploads.UPLOAD_DIR, base)
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            continue
+        shards += [posixpath.join(base, name) for name in names
+                   if len(name) == 2 and os.path.isdir(os.path.join(directory, name))]
+    return shards
+
+def _is_garbage(shard, name, paths, digests):
+    if name.startswith('.'):
+        return name.endswith('.tmp')  # Temporal de una subida o miniatura que no terminó
+    if posixpath.join(shard, name) in paths:
+        return False
+    if shard.startswith(uploads.THUMBS_SUBDIR + '/'):
+        return _digest(name) not in digests
+    return True
+
+def _remove(shard, name, delete):
+    source = os.path.join(uploads.UPLOAD_DIR, shard, name)
+    if delete or name.startswith('.'):
+        os.remove(source)
+        return
+    target = os.path.join(QUARANTINE_DIR, shard, name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(source, target)
+
+def collect_garbage(max_shards=SHARDS_PER_RUN, grace_hours=GRACE_HOURS, delete=False, dry_run=False):
+    """
+    Revisa las siguientes 'max_shards' carpetas (todas con None) desde el punto de control y
+    retira los archivos sin referencias más antiguos que el periodo de gracia. Con dry_run solo
+    cuenta lo que retiraría y no avanza el punto de control. Retorna un resumen con 'shards',
+    'scanned', 'removed', 'bytes_reclaimed', 'next_shard' y 'cycle_complete', o None si falla.
+    """
+    try:
+        with storage.file_lock(_RUN_LOCK, exclusive=True):
+            state = storage.load_json(GC_STATE_FILE, {}, create=False)
+            checkpoint = state.get('checkpoint')
+            shards = _shards()
+            pending = [shard for shard in shards if checkpoint is None or shard > checkpoint]
+            batch = pending if max_shards is None else pending[:max_shards]
+            paths, digests = referenced_uploads()
+            cutoff = time.time() - grace_hours * 3600
+            result = {'shards': len(batch), 'scanned': 0, 'removed': 0, 'bytes_reclaimed': 0}
+            for shard in batch:
+                directory = os.path.join(uploads.UPLOAD_DIR, shard)
+                with os.scandir(directory) as entries:
+                    names = sorted(entry.name for entry in entries if entry.is_file(follow_symlinks=False))
+                for name in names:
+                    result['scanned'] += 1
+                    if not _is_garbage(shard, name, paths, digests):
+                        continue
+                    try:
+                        # Se comprueba la fecha justo antes de retirarlo (una subida repetida la actualiza)
+                        st = os.stat(os.path.join(directory, name))
+                        if st.st_mtime > cutoff:
+                            continue
+                        if not dry_run:
+                            _remove(shard, name, delete)
+                    except FileNotFoundError:
+                        continue
+                    result['removed'] += 1
+                    result['bytes_reclaimed'] += st.st_size
+            done = len(batch) == len(pending)
+            result['next_shard'] = None if done else pending[len(batch)]
+            result['cycle_complete'] = done
+            if not dry_run:
+                state['checkpoint'] = None if done or not batch else batch[-1]
+                state['last_run'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                state['last_result'] = result
+                state['total_bytes_reclaimed'] = state.get('total_bytes_reclaimed', 0) + result['bytes_reclaimed']
+                storage.save_json(GC_STATE_FILE, state)
+            logger.info(f"Limpieza de subidas: {result['shards']} carpetas, {result['scanned']} archivos revisados, "
+                        f"{result['removed']} retirados ({result['bytes_reclaimed']} bytes).")
+            return result
+    except Exception as e:
+        logger.error(f"Error en la limpieza de archivos subidos: {e}")
+        return None
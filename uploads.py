@@ -0,0 +1,262 @@
+# uploads.py - Almacén de imágenes subidas (chat y contacto con el administrador)
+#
+# Cada archivo se guarda una sola vez por contenido: se copia a disco por bloques mientras se
+# calcula su SHA-256 y se mueve a static/uploads/<2 primeros caracteres>/<hash>.<ext>. Si ese
+# archivo ya existe (misma imagen subida otra vez) el temporal se descarta. Las miniaturas
+# (WebP, o JPEG si Pillow no tiene WebP) se generan en un hilo de fondo en
+# static/uploads/thumbs/; Pillow es opcional: sin él no hay miniaturas y se usa el original.
+#
+# Con app.request_class = UploadRequest los archivos del formulario no pasan por el temporal de
+# Werkzeug: cada bloque recibido se escribe directamente en un temporal dentro de UPLOAD_DIR
+# mientras se calcula el hash, y al guardar solo se renombra. El primer bloque se compara con
+# las firmas de PNG, JPEG y GIF, así que un archivo que no es una imagen se rechaza (415) sin
+# leer el resto del cuerpo; el tamaño máximo lo aplica Werkzeug con MAX_CONTENT_LENGTH (413).
+
+import hashlib
+import io
+import logging
+import os
+import queue
+import tempfile
+import threading
+
+from flask import Request
+from werkzeug.exceptions import UnsupportedMediaType
+
+try:
+    from PIL import Image, features
+except ImportError:  # Sin Pillow no se generan miniaturas
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.path.join('static', 'uploads')
+UPLOAD_URL = '/static/uploads'
+THUMBS_SUBDIR = 'thumbs'
+THUMB_SIZE = (320, 320)
+CHUNK_SIZE = 64 * 1024
+
+# Tamaño máximo de una petición con imagen (MAX_CONTENT_LENGTH de Flask)
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 8))
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# Firma (primeros bytes) de cada formato aceptado -> extensión con la que se guarda
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'\xff\xd8\xff': 'jpg',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+}
+SNIFF_BYTES = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+if Image is None:
+    THUMB_FORMAT = None
+elif features.check('webp'):
+    THUMB_FORMAT = 'webp'
+else:
+    THUMB_FORMAT = 'jpeg'
+
+_thumb_queue = queue.Queue()
+_worker = None
+_worker_guard = threading.Lock()
+
+def _content_path(digest, ext):
+    return os.path.join(UPLOAD_DIR, digest[:2], f'{digest}.{ext}')
+
+def _thumb_path(digest):
+    ext = 'jpg' if THUMB_FORMAT == 'jpeg' else THUMB_FORMAT
+    return os.path.join(UPLOAD_DIR, THUMBS_SUBDIR, digest[:2], f'{digest}.{ext}')
+
+def _url(path):
+    return UPLOAD_URL + '/' + os.path.relpath(path, UPLOAD_DIR).replace(os.sep, '/')
+
+def image_type(head):
+    """Extensión correspondiente a los primeros bytes de un archivo, o None si no es una imagen aceptada."""
+    for signature, ext in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return ext
+    return None
+
+def _new_temp():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    return tempfile.mkstemp(dir=UPLOAD_DIR, prefix='.upload-', suffix='.tmp')
+
+def _move_into_place(tmp_path, digest, ext):
+    """Mueve el temporal a su ruta por contenido (o lo descarta si ya existe). Retorna la ruta."""
+    path = _content_path(digest, ext)
+    if os.path.exists(path):
+        os.remove(tmp_path)  # Misma imagen ya guardada: se reutiliza
+        os.utime(path)  # y cuenta como reciente para el periodo de gracia de upload_gc
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    return path
+
+class UploadStream:
+    """
+    Destino de un archivo del formulario mientras se recibe: escribe en un temporal de
+    UPLOAD_DIR, calcula el SHA-256 y comprueba la firma de imagen en cuanto tiene SNIFF_BYTES.
+    Si no se llega a guardar con save_upload, close() borra el temporal.
+    """
+
+    def __init__(self):
+        fd, self.path = _new_temp()
+        self.file = os.fdopen(fd, 'w+b')
+        self.sha = hashlib.sha256()
+        self.size = 0
+        self.ext = None
+        self._head = b''
+
+    def _check(self, final=False):
+        self.ext = image_type(self._head)
+        if self.ext is None and (final or len(self._head) >= SNIFF_BYTES):
+            self.close()
+            raise UnsupportedMediaType('El archivo no es una imagen PNG, JPEG o GIF.')
+
+    def write(self, data):
+        if self.ext is None:
+            self._head += data[:SNIFF_BYTES]
+            self._check()
+        self.sha.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def seek(self, offset, whence=0):
+        # Werkzeug rebobina al terminar la parte: el archivo completo ya se recibió
+        if self.ext is None:
+            self._check(final=True)
+        return self.file.seek(offset, whence)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def tell(self):
+        return self.file.tell()
+
+    def claim(self):
+        """Cierra el temporal y lo mueve a su ruta definitiva. Retorna (digest, ruta)."""
+        self.file.close()
+        digest = self.sha.hexdigest()
+        path = _move_into_place(self.path, digest, self.ext)
+        self.path = None
+        return digest, path
+
+    def close(self):
+        self.file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+class UploadRequest(Request):
+    """Request de Flask que recibe los archivos con UploadStream (ver cabecera del módulo)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._upload_streams = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            return io.BytesIO()  # Campo de archivo vacío: el formulario se envió sin imagen
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        mimetype = (content_type or '').split(';')[0].strip().lower()
+        if ext not in IMAGE_EXTENSIONS or not (mimetype.startswith('image/') or mimetype in ('', 'application/octet-stream')):
+            raise UnsupportedMediaType('Solo se admiten imágenes PNG, JPEG o GIF.')
+        stream = UploadStream()
+        self._upload_streams.append(stream)
+        return stream
+
+    def close(self):
+        # Incluye las partes que no llegaron a formar un FileStorage (petición cortada por tamaño o tipo)
+        super().close()
+        for stream in self._upload_streams:
+            stream.close()
+
+def save_upload(file, ext):
+    """
+    Guarda un archivo subido (FileStorage de Werkzeug) con la extensión 'ext' ya validada.
+    Si se recibió con UploadRequest solo se renombra y se usa la extensión de su firma; si no,
+    se copia por bloques. Retorna (url del original, url de la miniatura o None si no habrá miniatura).
+    """
+    if isinstance(file.stream, UploadStream):
+        digest, path = file.stream.claim()
+    else:
+        sha = hashlib.sha256()
+        fd, tmp_path = _new_temp()
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                    sha.update(chunk)
+                    out.write(chunk)
+            digest = sha.hexdigest()
+            path = _move_into_place(tmp_path, digest, ext)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    if THUMB_FORMAT is None:
+        return _url(path), None
+    thumb = _thumb_path(digest)
+    if not os.path.exists(thumb):
+        _enqueue_thumbnail(path, thumb)
+    return _url(path), _url(thumb)
+
+def _enqueue_thumbnail(source, target):
+    global _worker
+    _thumb_queue.put((source, target))
+    with _worker_guard:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_thumbnail_worker, name='upload-thumbnails', daemon=True)
+            _worker.start()
+
+def _thumbnail_worker():
+    while True:
+        source, target = _thumb_queue.get()
+        try:
+            make_thumbnail(source, target)
+        except Exception as e:
+            logger.error(f"Error al generar la miniatura de {source}: {e}")
+        finally:
+            _thumb_queue.task_done()
+
+def make_thumbnail(source, target):
+    """Genera la miniatura de 'source' en 'target' (escritura atómica). Retorna False si ya existía."""
+    if os.path.exists(target):
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as img:
+        img.thumbnail(THUMB_SIZE)
+        if THUMB_FORMAT == 'jpeg' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.thumb-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                img.save(out, THUMB_FORMAT, quality=80)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return True
+
+def wait_for_thumbnails():
+    """Espera a que el hilo de fondo termine las miniaturas pendientes."""
+    _thumb_queue.join()
+
+def generate_missing_thumbnails():
+    """Genera las miniaturas que falten (p. ej. si el proceso se reinició con trabajo en cola). Retorna cuántas."""
+    if THUMB_FORMAT is None:
+        return 0
+    created = 0
+    for shard in sorted(os.listdir(UPLOAD_DIR)) if os.path.isdir(UPLOAD_DIR) else []:
+        shard_dir = os.path.join(UPLOAD_DIR, shard)
+        if shard == THUMBS_SUBDIR or len(shard) != 2 or not os.path.isdir(shard_dir):
+            continue
+        for name in sorted(os.listdir(shard_dir)):
+            if name.startswith('.'):
+                continue  # Temporales de subidas en curso
+            digest = name.split('.', 1)[0]
+            try:
+                created += make_thumbnail(os.path.join(shard_dir, name), _thumb_path(digest))
+            except Exception as e:
+                logger.error(f"Error al generar la miniatura de {name}: {e}")
+    return created
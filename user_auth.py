@@ -8,6 +8,7 @@ import json
 import os
 import re
 import secrets
+import logging
 
 # --- IMPORTACIONES DESDE data_manager.py ---
 # Todas las funciones de carga y guardado de datos deben venir de aquí.
@@ -18,10 +19,17 @@ from data_manager import (
 )
 # Aquí también, importas estas funciones directamente desde data_manager
 from data_manager import add_notification, get_cart
-from data_manager_chat import get_user_chats_by_order
+from data_manager import get_user, put_user, update_user_fields, delete_user, get_order
+from data_manager import get_user_by_email, email_in_use, get_user_orders, remove_user_purchase
+from data_manager import delete_order as delete_order_record
+from data_manager import transaction
+from data_manager import get_user_notifications, count_unread_notifications, mark_notifications_read
+from data_manager_chat import get_recent_chats_by_order
 from user_forms import UserLoginForm, UserRegisterForm, UserEditProfileForm, UserChangePasswordForm
 
 
+logger = logging.getLogger(__name__)
+
 # Define CART_SESSION_KEY aquí también si es necesario para funciones de carrito internas
 CART_SESSION_KEY = 'cart'
 
@@ -69,16 +77,15 @@ def register():
         birthdate = form.birthdate.data.strftime('%Y-%m-%d') if form.birthdate.data else ''
         gender = form.gender.data or ''
         password = form.password.data
-        users = load_users()
         # Validaciones personalizadas (puedes mantener las existentes si quieres)
-        if any(u_data['username'] == username for u_data in users.values()):
+        if get_user(username):
             flash('Nombre de usuario ya existe.', 'error')
             return render_template('user_register.html', form=form)
-        if any(u_data['email'] == email for u_data in users.values()):
+        if email_in_use(email):
             flash('Este email ya está registrado.', 'error')
             return render_template('user_register.html', form=form)
         hashed_password = generate_password_hash(password)
-        users[username] = {
+        put_user(username, {
             'username': username,
             'email': email,
             'full_name': full_name,
@@ -91,8 +98,7 @@ def register():
             'last_login': None,
             'is_active': True,
             'delivery_address': ''
-        }
-        save_users(users)
+        })
         flash('Registro exitoso. ¡Ahora puedes iniciar sesión!', 'success')
         return redirect(url_for('user_auth.login'))
     return render_template('user_register.html', form=form)
@@ -104,19 +110,15 @@ def login():
     if form.validate_on_submit():
         username_or_email = form.username.data.strip()
         password = form.password.data
-        users = load_users()
-        user = None
-        for u_data in users.values():
-            if u_data['username'] == username_or_email or u_data['email'] == username_or_email:
-                user = u_data
-                break
+        user = get_user(username_or_email)
+        if not user and '@' in username_or_email:
+            user = get_user_by_email(username_or_email)
         if user and check_password_hash(user['password'], password):
             session.permanent = True
             session['user_logged_in'] = True
             session['user_username'] = user['username']
             session['user_email'] = user['email']
-            user['last_login'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            save_users(users)
+            update_user_fields(user['username'], last_login=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
             flash(f'¡Bienvenido de nuevo, {user["username"]}!', 'success')
             return redirect(url_for('user_auth.user_dashboard'))
         else:
@@ -128,8 +130,7 @@ def login():
 def user_dashboard():
     """Muestra el panel de control del usuario."""
     username = session.get('user_username')
-    users = load_users()
-    user = users.get(username) # Obtener todos los datos del usuario
+    user = get_user(username) # Obtener todos los datos del usuario
 
     if not user:
         flash('Error al cargar los datos del usuario.', 'error')
@@ -142,20 +143,23 @@ def user_dashboard():
 def user_edit_profile():
     """Permite al usuario editar sus datos personales y dirección."""
     username = session.get('user_username')
-    users = load_users()
-    user = users.get(username)
+    user = get_user(username)
     form = UserEditProfileForm(obj=user)
     if not user:
         flash('Error al cargar los datos del usuario.', 'error')
         return redirect(url_for('user_auth.login'))
     if form.validate_on_submit():
-        user['full_name'] = form.full_name.data.strip()
-        user['email'] = form.email.data.strip()
-        user['phone'] = form.phone.data.strip() if form.phone.data else ''
-        user['birthdate'] = form.birthdate.data.strftime('%Y-%m-%d') if form.birthdate.data else ''
-        user['gender'] = form.gender.data or ''
-        users[username] = user
-        save_users(users)
+        if email_in_use(form.email.data, exclude_username=username):
+            flash('Este email ya está registrado.', 'error')
+            return render_template('user_edit_profile.html', form=form)
+        update_user_fields(
+            username,
+            full_name=form.full_name.data.strip(),
+            email=form.email.data.strip(),
+            phone=form.phone.data.strip() if form.phone.data else '',
+            birthdate=form.birthdate.data.strftime('%Y-%m-%d') if form.birthdate.data else '',
+            gender=form.gender.data or ''
+        )
         flash('Perfil actualizado correctamente.', 'success')
         return redirect(url_for('user_auth.user_profile'))
     # Pre-cargar datos actuales si es GET
@@ -176,15 +180,10 @@ def user_edit_profile():
 def user_orders():
     """Muestra el historial de pedidos del usuario."""
     username = session.get('user_username')
-    all_orders = load_orders()
-    # Filtrar órdenes para el usuario actual y ordenar por fecha descendente
-    user_orders = [
-        order for order in all_orders.values() 
-        if order.get('username') == username
-    ]
-    user_orders_sorted = sorted(user_orders, key=lambda x: x.get('order_date', '0'), reverse=True)
-    # Obtener los chats agrupados por order_id
-    chats_por_pedido = get_user_chats_by_order(username)
+    # Órdenes del usuario actual por fecha descendente (índice por usuario, sin recorrer todos los pedidos)
+    user_orders_sorted = get_user_orders(username)
+    # Últimos mensajes de cada pedido (sin leer el historial de chat completo)
+    chats_por_pedido = get_recent_chats_by_order(username, user_orders_sorted)
     return render_template('user_orders.html', orders=user_orders_sorted, chats_por_pedido=chats_por_pedido)
 
 @user_bp.route('/notifications')
@@ -192,16 +191,12 @@ def user_orders():
 def user_notifications():
     """Muestra las notificaciones del usuario."""
     username = session.get('user_username')
-    all_notifications = load_notifications()
-    
-    user_notifications_list = all_notifications.get(username, [])
-    
+
     # Marcar todas las notificaciones como leídas cuando el usuario las ve
-    if username in all_notifications:
-        for notif in all_notifications[username]:
-            notif['read'] = True
-        save_notifications(all_notifications) # Guardar los cambios
-    
+    # (las propias y las difusiones; solo se escribe si había alguna sin leer)
+    mark_notifications_read(username)
+    user_notifications_list = get_user_notifications(username)
+
     # Ordenar por fecha, las no leídas primero si se desea
     sorted_notifications = sorted(user_notifications_list, 
                                   key=lambda x: (x.get('read', False), x.get('timestamp', '0')), 
@@ -214,11 +209,9 @@ def user_notifications():
 @login_required
 def mark_notification_read(index):
     username = session.get('user_username')
-    all_notifications = load_notifications()
-    
-    if username in all_notifications and 0 <= index < len(all_notifications[username]):
-        all_notifications[username][index]['read'] = True
-        save_notifications(all_notifications)
+    user_notifications_list = get_user_notifications(username)
+
+    if 0 <= index < len(user_notifications_list) and mark_notifications_read(username, user_notifications_list[index]['id']):
         flash('Notificación marcada como leída.', 'success')
     else:
         flash('Notificación no encontrada.', 'error')
@@ -231,8 +224,7 @@ def mark_notification_read(index):
 def user_privacy():
     """Muestra la página de política de privacidad y control de datos."""
     username = session.get('user_username')
-    users = load_users()
-    user_data = users.get(username)
+    user_data = get_user(username)
     
     return render_template('user_privacy.html', user_data=user_data)
 
@@ -242,11 +234,8 @@ def user_privacy():
 def delete_account():
     """Permite al usuario eliminar su cuenta."""
     username = session.get('user_username')
-    users = load_users()
 
-    if username in users:
-        del users[username]
-        save_users(users)
+    if delete_user(username):
         session.pop('user_logged_in', None)
         session.pop('user_username', None)
         session.pop('user_email', None)
@@ -270,35 +259,30 @@ def logout():
 def get_unread_notifications_count():
     """Devuelve el número de notificaciones no leídas para el usuario."""
     username = session.get('user_username')
-    all_notifications = load_notifications()
-    user_notifications = all_notifications.get(username, [])
-    unread_count = sum(1 for notif in user_notifications if not notif.get('read', False))
-    return jsonify(count=unread_count)
+    return jsonify(count=count_unread_notifications(username))
 
 @user_bp.route('/orders/delete/<order_id>', methods=['POST'])
 @login_required
 def delete_order(order_id):
     """Permite al usuario cancelar/borrar un pedido propio si es suyo y está pendiente."""
     username = session.get('user_username')
-    orders = load_orders()
-    order = orders.get(order_id)
+    order = get_order(order_id)
     if not order or order.get('username') != username:
         flash('No tienes permiso para cancelar este pedido.', 'error')
         return redirect(url_for('user_auth.user_orders'))
     if order.get('status') != 'pending':
         flash('Solo puedes cancelar pedidos pendientes.', 'warning')
         return redirect(url_for('user_auth.user_orders'))
-    # Eliminar el pedido
-    del orders[order_id]
-    save_orders(orders)
-    # Eliminar de user_purchases.json si existe
+    # Eliminar el pedido y su compra en user_purchases.json (si existe) en una sola transacción
     try:
-        from app import load_user_purchases, save_user_purchases
-        purchases = load_user_purchases()
-        purchases = [p for p in purchases if p.get('order_id') != order_id]
-        save_user_purchases(purchases)
-    except Exception:
-        pass
+        with transaction():
+            if not delete_order_record(order_id):
+                raise RuntimeError(f'No se pudo eliminar el pedido {order_id}')
+            remove_user_purchase(order_id)
+    except Exception as e:
+        logger.error(f"Error al cancelar el pedido {order_id}: {e}")
+        flash('Error al cancelar el pedido. Por favor, inténtalo de nuevo.', 'error')
+        return redirect(url_for('user_auth.user_orders'))
     flash('Pedido cancelado correctamente.', 'success')
     return redirect(url_for('user_auth.user_orders'))
 
@@ -307,8 +291,7 @@ def delete_order(order_id):
 def user_profile():
     """Muestra el perfil profesional del usuario con todos los datos personales."""
     username = session.get('user_username')
-    users = load_users()
-    user = users.get(username)
+    user = get_user(username)
     if not user:
         flash('Error al cargar los datos del usuario.', 'error')
         return redirect(url_for('user_auth.login'))
@@ -318,8 +301,7 @@ def user_profile():
 def user_change_password():
     """Permite al usuario cambiar su contraseña de forma segura."""
     username = session.get('user_username')
-    users = load_users()
-    user = users.get(username)
+    user = get_user(username)
     form = UserChangePasswordForm()
     if not user:
         flash('Error: Usuario no encontrado.', 'error')
@@ -333,8 +315,7 @@ def user_change_password():
         if check_password_hash(user['password'], new_password):
             flash('La nueva contraseña no puede ser igual a la anterior.', 'error')
             return render_template('user_change_password.html', form=form)
-        user['password'] = generate_password_hash(new_password)
-        save_users(users)
+        update_user_fields(username, password=generate_password_hash(new_password))
         flash('Contraseña actualizada correctamente.', 'success')
         return redirect(url_for('user_auth.user_profile'))
     return render_template('user_change_password.html', form=form)